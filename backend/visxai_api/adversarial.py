@@ -0,0 +1,191 @@
+"""
+Batched FGSM / PGD adversarial attacks shared by the image handlers.
+
+Attacks run in pixel space ([0, 1], before normalization) so epsilons mean
+the same thing for every model. All epsilons of a request are one batch:
+each row of a step is one epsilon, so a sweep costs a single forward and
+backward pass per step instead of one request per epsilon.
+"""
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .encoding import PackedTensor, png_data_url
+from .inference import ActivationCapture
+
+ATTACK_METHODS = ('fgsm', 'pgd')
+MAX_EPSILONS = 16
+MAX_STEPS = 100
+
+
+def parse_attack_params(data: Dict[str, Any], epsilon: float) -> Dict[str, Any]:
+    """
+    Read attack parameters from a request, with the view's `epsilon` as default.
+
+    'epsilons' (list or comma-separated) sweeps several budgets at once;
+    'method' is 'fgsm' (default) or 'pgd', with 'steps', 'step_size' and
+    'early_stop' (stop perturbing an input once its label flips).
+    """
+    epsilons = data.get('epsilons')
+    if epsilons is None:
+        epsilons = [epsilon]
+    elif isinstance(epsilons, str):
+        epsilons = [item for item in epsilons.split(',') if item.strip()]
+    epsilons = [float(e) for e in epsilons]
+    if not epsilons or len(epsilons) > MAX_EPSILONS:
+        raise ValueError(f"Between 1 and {MAX_EPSILONS} epsilons are supported")
+    if any(e < 0 or e > 1 for e in epsilons):
+        raise ValueError("Epsilons are in pixel units and must be within [0, 1]")
+
+    method = str(data.get('method', 'fgsm')).lower()
+    if method not in ATTACK_METHODS:
+        raise ValueError(f"Unknown attack '{method}'. Use one of: {', '.join(ATTACK_METHODS)}")
+    steps = int(data.get('steps', 10)) if method == 'pgd' else 1
+    if steps < 1 or steps > MAX_STEPS:
+        raise ValueError(f"steps must be between 1 and {MAX_STEPS}")
+    step_size = data.get('step_size')
+    early_stop = data.get('early_stop', True)
+    if isinstance(early_stop, str):
+        early_stop = early_stop.lower() not in ('0', 'false', 'no')
+    return {
+        'epsilons': epsilons,
+        'method': method,
+        'steps': steps,
+        'step_size': float(step_size) if step_size is not None else None,
+        'early_stop': bool(early_stop),
+    }
+
+
+def _input_gradient(model: nn.Module, normalize: Callable, x: torch.Tensor, labels: Optional[torch.Tensor]):
+    """
+    Logits and d(loss)/d(x) for every row of a pixel-space batch.
+
+    Without `labels`, each row's own prediction is the label.
+    """
+    with torch.enable_grad():
+        x = x.detach().requires_grad_(True)
+        logits = model(normalize(x))
+        if labels is None:
+            labels = logits.detach().argmax(dim=1)
+        # Summed so each row's gradient only depends on its own loss
+        loss = F.cross_entropy(logits, labels, reduction='sum')
+        (grad,) = torch.autograd.grad(loss, x)
+    return logits.detach(), grad, labels
+
+
+def run_attack(model: nn.Module, normalize: Callable[[torch.Tensor], torch.Tensor], x: torch.Tensor,
+               epsilons: List[float], method: str = 'fgsm', steps: int = 1,
+               step_size: Optional[float] = None, early_stop: bool = True,
+               label: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Untargeted L-inf attack on one pixel-space image for several epsilons at once.
+
+    Args:
+        model: Network in eval mode taking normalized input
+        normalize: Maps pixel-space [0, 1] input to model input
+        x: Clean image, [1, C, H, W] in [0, 1]
+        epsilons: Perturbation budgets, one batch row each
+        method: 'fgsm' (one signed-gradient step of size epsilon) or 'pgd'
+        steps: PGD iterations
+        step_size: PGD step (default 2.5 * epsilon / steps)
+        early_stop: Freeze rows whose label has flipped; stop when all have
+        label: Class to move away from (default: the clean prediction)
+
+    Returns:
+        Dict with 'adversarial' [E, C, H, W], 'logits' [E, classes],
+        'clean_logits' [classes], 'steps' (iterations used per row), 'label',
+        and 'divergence' {layer: [E]} (relative L2 distance of each hooked
+        activation from the clean one)
+    """
+    eps = torch.tensor(epsilons, dtype=x.dtype, device=x.device).view(-1, *([1] * (x.dim() - 1)))
+    count = eps.shape[0]
+    clean = x.expand(count, *x.shape[1:])
+    labels = None
+    if label is not None:
+        labels = torch.full((count,), label, dtype=torch.long, device=x.device)
+
+    # The first gradient pass sees the clean image in every row, so its
+    # logits double as the clean prediction.
+    logits, grad, labels = _input_gradient(model, normalize, clean, labels)
+    clean_logits = logits[0]
+    adversarial = clean
+    used = torch.ones(count, dtype=torch.long)
+    if method == 'fgsm':
+        adversarial = (clean + eps * grad.sign()).clamp(0, 1)
+    else:
+        alpha = eps * 2.5 / steps if step_size is None else torch.full_like(eps, step_size)
+        # A zero budget cannot move the input, so that row never needs a step
+        active = eps.flatten() > 0
+        used.zero_()
+        for step_index in range(steps):
+            if step_index:
+                logits, grad, _ = _input_gradient(model, normalize, adversarial, labels)
+            if early_stop:
+                # Rows already misclassified keep their current perturbation
+                active &= logits.argmax(dim=1) == labels
+                if not active.any():
+                    break
+            step = alpha * grad.sign() * active.view(-1, *([1] * (x.dim() - 1)))
+            adversarial = torch.min(torch.max(adversarial + step, clean - eps), clean + eps).clamp(0, 1)
+            used += active.cpu().long()
+
+    # One final pass over [clean, adversarial...] for logits and activations
+    with ActivationCapture() as capture, torch.no_grad():
+        logits = model(normalize(torch.cat([x, adversarial])))
+    divergence = {}
+    for name, fmap in capture.maps.items():
+        flat = fmap.flatten(1).float()
+        distance = (flat[1:] - flat[:1]).norm(dim=1) / flat[0].norm().clamp_min(1e-8)
+        divergence[name] = distance.tolist()
+
+    return {
+        'adversarial': adversarial.detach(),
+        'logits': logits[1:],
+        'clean_logits': clean_logits,
+        'steps': used.tolist(),
+        'label': int(labels[0]),
+        'divergence': divergence,
+    }
+
+
+def _top_k(logits: torch.Tensor, class_labels: List[str], k: int) -> List[Dict[str, Any]]:
+    probabilities = torch.softmax(logits.float(), dim=0)
+    scores, indices = probabilities.topk(min(k, probabilities.shape[0]))
+    return [
+        {'label': class_labels[i], 'class_idx': i, 'score': float(score)}
+        for score, i in zip(scores.tolist(), indices.tolist())
+    ]
+
+
+def attack_response(attack: Dict[str, Any], params: Dict[str, Any], class_labels: List[str],
+                    top_k: int = 5, binary: bool = False) -> Dict[str, Any]:
+    """
+    JSON-ready summary of `run_attack`: the clean top-k, then per epsilon the
+    perturbed image (PNG data URL, or a uint8 PackedTensor for the binary
+    transport), its top-k, whether the label flipped, and the layer divergence.
+    """
+    images = (attack['adversarial'] * 255).round().to(torch.uint8).cpu()
+    clean = _top_k(attack['clean_logits'], class_labels, top_k)
+    predicted = attack['logits'].argmax(dim=1).tolist()
+    results = []
+    for row, epsilon in enumerate(params['epsilons']):
+        image = images[row].permute(1, 2, 0).numpy()  # [H, W, C]
+        image = image[:, :, 0] if image.shape[2] == 1 else image
+        top = _top_k(attack['logits'][row], class_labels, top_k)
+        results.append({
+            'epsilon': epsilon,
+            'adversarial_image': PackedTensor(image) if binary else png_data_url(image),
+            'top_class': top[0]['label'],
+            'probabilities': top,
+            'flipped': predicted[row] != attack['label'],
+            'steps': attack['steps'][row],
+            'divergence': {name: values[row] for name, values in attack['divergence'].items()},
+        })
+    return {
+        'method': params['method'],
+        'attacked_class': class_labels[attack['label']],
+        'original': {'top_class': clean[0]['label'], 'probabilities': clean},
+        'results': results,
+    }
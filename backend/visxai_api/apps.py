@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 class VisxaiApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
@@ -10,12 +12,50 @@ class VisxaiApiConfig(AppConfig):
         from .handlers.mnist_handler import MNISTHandler
         from .handlers.placeholder_handler import PlaceholderHandler
         from .handlers.vgg_resnet_handler import VGGResNetHandler
+        from .process_pool import RemoteHandler
 
-        # Register Models
+        ModelRegistry.configure(
+            memory_budget_mb=settings.VISXAI_MODEL_MEMORY_BUDGET_MB,
+            warmup=settings.VISXAI_WARMUP_MODELS,
+        )
+
+        # Register Models (factories: weights are only loaded on first use)
         ModelRegistry.register("voxelstack", CNNHandler("vgg16"))
-        ModelRegistry.register("mnist", MNISTHandler())
-        ModelRegistry.register("vgg16", VGGResNetHandler("vgg16"))
-        ModelRegistry.register("resnet50", VGGResNetHandler("resnet50"))
+        replicas = settings.VISXAI_MODEL_REPLICAS
+        batching = settings.VISXAI_BATCHING
+        precision = settings.VISXAI_MODEL_PRECISION
+        backend = settings.VISXAI_MODEL_BACKEND
+        stores = dict(
+            activation_store_mb=settings.VISXAI_ACTIVATION_STORE_MB,
+            session_store_mb=settings.VISXAI_SESSION_STORE_MB,
+            session_ttl=settings.VISXAI_SESSION_TTL_S,
+            calibration_dir=settings.VISXAI_CALIBRATION_DIR,
+        )
+        # Kept on the app config so serve_inference can build the real handlers
+        # (passing prepare=False to the servable ones; see process_pool.py)
+        self.model_factories = {
+            "mnist": lambda: MNISTHandler(replicas=replicas.get("mnist", 1)),
+            "vgg16": lambda **options: VGGResNetHandler(
+                "vgg16", replicas=replicas.get("vgg16", 1), batching=batching.get("vgg16"),
+                precision=precision.get("vgg16", "fp32"), backend=backend.get("vgg16", "eager"), **stores,
+                **options),
+            "resnet50": lambda **options: VGGResNetHandler(
+                "resnet50", replicas=replicas.get("resnet50", 1), batching=batching.get("resnet50"),
+                precision=precision.get("resnet50", "fp32"), backend=backend.get("resnet50", "eager"),
+                **stores, **options),
+        }
+        # Trained in this process, so their weights cannot live in serve_inference workers
+        self.local_only_models = ("mnist",)
+        remote_local_only = [name for name in self.local_only_models if name in settings.VISXAI_REMOTE_MODELS]
+        if remote_local_only:
+            raise ImproperlyConfigured(
+                f"VISXAI_REMOTE_MODELS lists {', '.join(remote_local_only)}, which trains in the Django process "
+                "and cannot be served by serve_inference workers; remove it from VISXAI_REMOTE_MODELS.")
+        for name, factory in self.model_factories.items():
+            if name in settings.VISXAI_REMOTE_MODELS:
+                # Served by the serve_inference process pool
+                factory = lambda name=name: RemoteHandler(name, settings.VISXAI_INFERENCE_SOCKET)
+            ModelRegistry.register(name, factory)
         
         # Register Placeholders
         placeholders = [
@@ -0,0 +1,165 @@
+"""
+Execution backends for forward-only passes.
+
+The eager path runs the `nn.Module` and collects activations with Python
+forward hooks, one callback per hooked layer. A compiled backend instead
+rewrites the model with torch.fx into a graph whose outputs are the logits
+plus every hooked layer's activation. It then runs that graph as:
+
+    torchscript   a traced and frozen TorchScript module
+    onnx          an ONNX Runtime CPU session exported from the same weights
+                  (optional: pip install onnx onnxruntime)
+    compile       a torch.compile'd module (needs a C++ compiler for inductor)
+
+Backends are built and checked against eager once, when the handler loads.
+If building fails, the runtime is missing, or the outputs disagree, the
+handler logs a warning and stays on eager. Compiled graphs cannot stop
+early and have no backward pass, so truncated feature requests, Grad-CAM
+and attacks keep using the eager model.
+"""
+import io
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from .inference import replicate_module
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('eager', 'torchscript', 'onnx', 'compile')
+LOGITS = '__logits__'
+
+
+class _TupleOutputs(nn.Module):
+    """Feature-extractor graph with its dict output flattened to a tuple (traceable, exportable)."""
+
+    def __init__(self, graph: nn.Module, names: List[str]):
+        super().__init__()
+        self.graph = graph
+        self.names = names
+
+    def forward(self, x):
+        outputs = self.graph(x)
+        return tuple(outputs[name] for name in self.names)
+
+
+def activation_graph(model: nn.Module, layers: List[Tuple[str, str]]) -> Tuple[nn.Module, List[str], str]:
+    """
+    A hook-free copy of `model` returning the activations of `layers`, in
+    that order, followed by the logits unless the last layer already is them.
+
+    `layers` are (name, module path) pairs. Returns the module, the output
+    names in order, and the name the logits are listed under (the last
+    layer's name when that layer is the classifier itself).
+    """
+    from torchvision.models.feature_extraction import create_feature_extractor, get_graph_node_names
+
+    replica = replicate_module(model).eval()
+    for module in replica.modules():
+        module._forward_hooks.clear()
+    final = get_graph_node_names(replica)[1][-1]  # last node of the eval-mode graph
+    return_nodes = {path: name for name, path in layers}
+    logits = return_nodes.setdefault(final, LOGITS)
+    graph = create_feature_extractor(replica, return_nodes=return_nodes)
+    names = [name for name, _ in layers] + ([LOGITS] if logits == LOGITS else [])
+    return _TupleOutputs(graph, names).eval(), names, logits
+
+
+class ExecutionBackend(ABC):
+    """Runs an activation graph and returns (logits, {layer: activation})."""
+
+    name = 'eager'
+
+    def __init__(self, names: List[str], logits: str):
+        self.names = names
+        self.logits = logits
+
+    @abstractmethod
+    def _run(self, x: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        """The graph's outputs for input `x`, in the order of `names`."""
+        pass
+
+    def __call__(self, x: torch.Tensor) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        # Activations keep the layer order of `names`, like hooks firing in forward order
+        outputs = dict(zip(self.names, self._run(x)))
+        logits = outputs.pop(LOGITS, None)
+        return (outputs[self.logits] if logits is None else logits), outputs
+
+
+class TorchScriptBackend(ExecutionBackend):
+    name = 'torchscript'
+
+    def __init__(self, graph: nn.Module, names: List[str], logits: str, example: torch.Tensor):
+        super().__init__(names, logits)
+        with torch.no_grad():
+            self.module = torch.jit.freeze(torch.jit.trace(graph, example))
+
+    def _run(self, x):
+        return self.module(x)
+
+
+class OnnxBackend(ExecutionBackend):
+    name = 'onnx'
+
+    def __init__(self, graph: nn.Module, names: List[str], logits: str, example: torch.Tensor):
+        super().__init__(names, logits)
+        import onnxruntime as ort
+
+        buffer = io.BytesIO()
+        torch.onnx.export(
+            graph, (example,), buffer, input_names=['input'], output_names=names,
+            dynamic_axes={'input': {0: 'batch'}, **{name: {0: 'batch'} for name in names}},
+            dynamo=False,
+        )
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(buffer.getvalue(), options, providers=['CPUExecutionProvider'])
+
+    def _run(self, x):
+        outputs = self.session.run(None, {'input': x.cpu().numpy()})
+        return tuple(torch.from_numpy(output).to(x.device) for output in outputs)
+
+
+class CompileBackend(ExecutionBackend):
+    name = 'compile'
+
+    def __init__(self, graph: nn.Module, names: List[str], logits: str, example: torch.Tensor):
+        super().__init__(names, logits)
+        self.module = torch.compile(graph)
+
+    def _run(self, x):
+        return self.module(x)
+
+
+_BACKEND_CLASSES = {'torchscript': TorchScriptBackend, 'onnx': OnnxBackend, 'compile': CompileBackend}
+
+
+def build_backend(name: str, model: nn.Module, layers: List[Tuple[str, str]],
+                  example: torch.Tensor) -> Optional[ExecutionBackend]:
+    """
+    Compile `model` for backend `name`, or return None to run eager.
+
+    The backend's first run (which also triggers lazy compilation) must match
+    eager on `example`, otherwise it is discarded.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Use one of: {', '.join(BACKENDS)}")
+    if name == 'eager':
+        return None
+    try:
+        graph, names, logits = activation_graph(model, layers)
+        backend = _BACKEND_CLASSES[name](graph, names, logits, example)
+        with torch.no_grad():
+            expected = graph(example)
+            logits_out, maps = backend(example)
+        for name_, tensor in zip(names, expected):
+            actual = logits_out if name_ in (LOGITS, logits) else maps[name_]
+            if not torch.allclose(actual.float(), tensor.float(), rtol=1e-3, atol=1e-3):
+                raise RuntimeError(f"output '{name_}' differs from eager")
+        return backend
+    except Exception as e:
+        logger.warning("%s backend unavailable (%s: %s); using eager.", name, type(e).__name__, e)
+        return None
@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+import torch
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching scheduler for single-image forward passes.
+
+    Requests submitted within `max_wait_ms` of the first queued one (up to
+    `max_batch_size`) are concatenated along the batch dimension and handed
+    to `run_batch` in a single call, which must return one result per row.
+    Each of the `workers` threads forms and runs its own batches, so a
+    handler with N replicas can keep all of them busy.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[torch.Tensor], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        workers: int = 1,
+        name: str = "batcher",
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, int(workers)))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, tensor: torch.Tensor) -> Future:
+        """Queue a [1, ...] tensor; the future resolves to its row's result."""
+        future: Future = Future()
+        with self._lock:
+            if not self.closed:
+                self._queue.put((tensor, future))
+                return future
+        # Handler is being torn down: serve the straggler inline.
+        future.set_result(self.run_batch(tensor)[0])
+        return future
+
+    def close(self, wait: bool = True):
+        """Stop the workers once everything already queued has been served."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            for _ in self._threads:
+                self._queue.put(None)
+        if wait:
+            # Joining also keeps worker teardown from racing interpreter shutdown.
+            for thread in self._threads:
+                thread.join()
+
+    def _collect(self, first: tuple) -> List[tuple]:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Hand the shutdown sentinel back so this worker exits after the batch.
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            futures = [future for _, future in batch]
+            try:
+                results = self.run_batch(torch.cat([tensor for tensor, _ in batch]))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
@@ -0,0 +1,264 @@
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Union
+
+from .encoding import decode_frame, encode_frame
+
+logger = logging.getLogger(__name__)
+
+# Actions whose result depends only on the model weights and the request.
+CACHEABLE_ACTIONS = {'predict', 'features', 'gradcam', 'adversarial'}
+
+# Request fields and query parameters that change a cacheable action's result
+# (handler options plus the handler's precision). Anything else, such as
+# deadline_ms, format or stream, is left out of the key. A new handler option
+# must be added here, or requests differing only in it share a result.
+RESULT_PARAMS = frozenset({
+    'transport', 'tensor_dtype', 'feature_layout', 'channel_rank', 'channels', 'preview_channels',
+    'histogram_bins', 'layer_id', 'layers', 'layer_index', 'class_idx', 'class_indices', 'top_k',
+    'epsilon', 'epsilons', 'method', 'steps', 'step_size', 'early_stop', 'precision',
+})
+DISK_SUFFIX = '.vxt'
+
+
+def input_digest(data: Any) -> Optional[str]:
+    """SHA-256 of the decoded input (image bytes or pixel array), or None if there is none."""
+    if not isinstance(data, dict):
+        return None
+    if data.get('image'):
+        image_data = data['image']
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
+        try:
+            raw = base64.b64decode(image_data)
+        except (binascii.Error, ValueError):
+            return None
+        return hashlib.sha256(raw).hexdigest()
+    if data.get('pixels'):
+        return hashlib.sha256(json.dumps(data['pixels']).encode()).hexdigest()
+    return None
+
+
+class ResultCache:
+    """
+    Two-tier, content-addressed cache for handler results.
+
+    Keys hash the model, action, weights identity, decoded input and the
+    request parameters in RESULT_PARAMS. The memory tier is an LRU bounded by
+    encoded size. The optional disk tier survives restarts. It stores one
+    tensor frame per key (see encoding.py): the result as JSON, plus its
+    packed tensors as raw bytes. Reading an entry never runs code from the
+    file. Concurrent requests for the same key wait on a single computation.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (result, nbytes)
+        self._memory_bytes = 0
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0,
+            'evictions': 0, 'disk_evictions': 0,
+        }
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(os.path.getsize(p) for p in self._disk_files())
+
+    def make_key(self, model: str, action: str, data: Any, weights: Any = 0,
+                 params: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Cache key for a request, or None if it cannot be cached."""
+        if action not in CACHEABLE_ACTIONS:
+            return None
+        if isinstance(data, dict) and data.get('session'):
+            # Session ids are minted per request, so the response is not reusable.
+            return None
+        digest = input_digest(data)
+        if digest is None:
+            return None
+        request_params = {k: v for k, v in {**data, **(params or {})}.items() if k in RESULT_PARAMS}
+        blob = json.dumps([model, action, weights, digest, request_params], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """The memory tier's result for `key`, or None; never computes."""
+        with self._lock:
+            if key not in self._memory:
+                return None
+            self._memory.move_to_end(key)
+            self.counters['hits'] += 1
+            return self._memory[key][0]
+
+    def get_or_compute(self, key: str, compute: Callable[[], Dict[str, Any]],
+                       persist: Union[bool, Callable[[], bool]] = True) -> Dict[str, Any]:
+        """
+        Return the cached result for `key`, computing it at most once across threads.
+
+        persist=False keeps the key out of the disk tier, for keys that only
+        mean something within this process. A callable is asked after a miss
+        is computed whether the result may be written (e.g. that the weights
+        did not change meanwhile).
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters['hits'] += 1
+                return self._memory[key][0]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            entry = self._disk_get(key) if persist is not False else None
+            if entry is not None:
+                result, nbytes = entry
+                with self._lock:
+                    self.counters['disk_hits'] += 1
+            else:
+                with self._lock:
+                    self.counters['misses'] += 1
+                result = compute()
+                frame = encode_frame(result) if self._cacheable(result) else None
+                nbytes = len(frame) if frame is not None else 0
+                if frame is not None and (persist() if callable(persist) else persist):
+                    self._disk_put(key, frame)
+            if self._cacheable(result):
+                self._memory_put(key, result, nbytes)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    @staticmethod
+    def _cacheable(result: Any) -> bool:
+        # Handlers report soft failures as {'error': ...}; never pin those.
+        return isinstance(result, dict) and 'error' not in result
+
+    def _memory_put(self, key: str, result: Dict[str, Any], nbytes: int):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = (result, nbytes)
+            self._memory_bytes += nbytes
+            while self._memory_bytes > self.max_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted
+                self.counters['evictions'] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}{DISK_SUFFIX}")
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(DISK_SUFFIX):
+                    yield os.path.join(root, name)
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        """(result, encoded size) from the disk tier, or None."""
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                frame = f.read()
+            return decode_frame(frame, packed=True), len(frame)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Dropping unreadable cache entry %s: %s", key, e)
+            return None
+
+    def _disk_put(self, key: str, frame: bytes):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(frame)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._disk_bytes += len(frame)
+            over_budget = self.disk_max_bytes is not None and self._disk_bytes > self.disk_max_bytes
+        if over_budget:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Delete the least recently written entries until the disk tier fits its budget."""
+        files = sorted(self._disk_files(), key=os.path.getmtime)
+        for path in files:
+            with self._lock:
+                if self._disk_bytes <= self.disk_max_bytes:
+                    return
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            with self._lock:
+                self._disk_bytes -= size
+                self.counters['disk_evictions'] += 1
+
+    def clear(self):
+        """Drop the memory tier (the disk tier is left alone)."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and sizes for monitoring."""
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['disk_hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': (self.counters['hits'] + self.counters['disk_hits']) / lookups if lookups else None,
+                'entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'max_bytes': self.max_bytes,
+                'disk_bytes': self._disk_bytes if self.disk_dir else None,
+                'inflight': len(self._inflight),
+            }
+
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Process-wide result cache built from settings, or None when disabled."""
+    global _result_cache
+    from django.conf import settings
+
+    if not settings.VISXAI_CACHE_MAX_MB:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            disk_max_mb = settings.VISXAI_CACHE_DISK_MAX_MB
+            _result_cache = ResultCache(
+                max_bytes=int(settings.VISXAI_CACHE_MAX_MB * 1024 * 1024),
+                disk_dir=settings.VISXAI_CACHE_DIR,
+                disk_max_bytes=int(disk_max_mb * 1024 * 1024) if disk_max_mb else None,
+            )
+    return _result_cache
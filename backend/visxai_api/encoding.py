@@ -0,0 +1,284 @@
+"""
+Encoding of feature maps and heatmaps for responses.
+
+PNG encoding normalizes whole layers at once and can pack a layer's channels
+into a single sprite atlas (`feature_layout='atlas'`), so a request does one
+PNG compression per layer instead of one per channel.
+
+For the binary tensor transport, handlers return `PackedTensor` objects
+instead of PNG data URLs when a request negotiates it (`Accept:
+application/x-visxai-tensors` or `?format=vxt`). `TensorFrameRenderer` then
+writes the response as one frame:
+
+    b'VXT1' | uint32 LE header length | header JSON | buffers
+
+The header JSON is `{"body": ..., "buffers": [[offset, length], ...]}`, where
+`body` is the usual response with every tensor replaced by a descriptor:
+
+    {"$tensor": <buffer index>, "shape": [...], "dtype": "uint8" | "float16",
+     "encoding": "raw" | "bitmask", "min": [...], "scale": [...]}
+
+Buffer offsets are relative to the first byte after the (8-byte aligned)
+header. A uint8 tensor with `min`/`scale` is quantized per channel (axis 0):
+value = q * scale[c] + min[c]. The "bitmask" encoding, used when it is
+smaller, stores a packed bit per element (1 = non-zero, MSB first) followed
+by the non-zero bytes in order, which suits post-ReLU maps.
+"""
+import base64
+import io
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .timing import stage
+
+TRANSPORT_MEDIA_TYPE = 'application/x-visxai-tensors'
+TRANSPORT_FORMAT = 'vxt'
+FRAME_MAGIC = b'VXT1'
+RANK_METRICS = ('mean', 'max', 'sparsity')
+
+
+class PackedTensor:
+    """An array destined for a binary frame, with the metadata needed to decode it."""
+
+    def __init__(self, array: np.ndarray, **meta):
+        self.array = np.ascontiguousarray(array)
+        self.meta = meta
+
+    def encode(self) -> Tuple[bytes, Dict[str, Any]]:
+        """Raw bytes (bitmask-sparse when that is smaller) and the tensor descriptor."""
+        descriptor = {
+            'shape': list(self.array.shape),
+            'dtype': str(self.array.dtype),
+            'encoding': 'raw',
+            **self.meta,
+        }
+        raw = self.array.tobytes()
+        if self.array.dtype == np.uint8:
+            flat = self.array.reshape(-1)
+            mask = flat != 0
+            nonzero = int(mask.sum())
+            if (flat.size + 7) // 8 + nonzero < flat.size:
+                descriptor['encoding'] = 'bitmask'
+                return np.packbits(mask).tobytes() + flat[mask].tobytes(), descriptor
+        return raw, descriptor
+
+
+def pack_channels(fmap: torch.Tensor, dtype: str = 'uint8') -> PackedTensor:
+    """
+    Pack a [C, H, W] (or [N]) activation for binary transport.
+
+    uint8 quantizes each channel to its own min/max range on-device; float16
+    keeps the raw values at half precision.
+    """
+    x = fmap.detach().float()
+    if dtype == 'float16':
+        return PackedTensor(x.half().cpu().numpy())
+
+    channels = x.shape[0] if x.dim() > 1 else 1
+    flat = x.reshape(channels, -1)
+    mins = flat.amin(dim=1)
+    scale = (flat.amax(dim=1) - mins).clamp_min(1e-8) / 255
+    q = ((flat - mins[:, None]) / scale[:, None]).round_().clamp_(0, 255).to(torch.uint8)
+    return PackedTensor(q.reshape(x.shape).cpu().numpy(), min=mins.tolist(), scale=scale.tolist())
+
+
+def pack_unit_interval(array: np.ndarray) -> PackedTensor:
+    """Pack values already in [0, 1] (e.g. Grad-CAM heatmaps) as uint8."""
+    q = np.round(np.clip(array, 0, 1) * 255).astype(np.uint8)
+    return PackedTensor(q, min=[0.0], scale=[1 / 255])
+
+
+def normalize_channels(fmap: torch.Tensor, eps: float = 1e-8) -> np.ndarray:
+    """Min/max-normalize every channel of a [C, H, W] activation to uint8 in one op."""
+    x = fmap.detach().float()
+    mins = x.amin(dim=(1, 2), keepdim=True)
+    maxs = x.amax(dim=(1, 2), keepdim=True)
+    return ((x - mins) / (maxs - mins + eps) * 255).to(torch.uint8).cpu().numpy()
+
+
+def rank_channels(fmap: torch.Tensor, k: int, metric: str) -> torch.Tensor:
+    """
+    Indices of the `k` most informative channels of a [C, H, W] activation, best first.
+
+    metric: 'mean' or 'max' activation, or 'sparsity' (fewest zeros first).
+    """
+    if metric not in RANK_METRICS:
+        raise ValueError(f"Unknown channel ranking '{metric}'. Use one of: {', '.join(RANK_METRICS)}")
+    flat = fmap.detach().flatten(1)
+    if metric == 'mean':
+        score = flat.mean(dim=1)
+    elif metric == 'max':
+        score = flat.amax(dim=1)
+    else:
+        score = (flat != 0).float().mean(dim=1)
+    return score.topk(min(k, flat.shape[0])).indices
+
+
+def channel_stats(fmap: torch.Tensor, bins: int = 16, binary: bool = False) -> Dict[str, Any]:
+    """
+    Per-channel summaries of a [C, H, W] (or [N], as one channel) activation.
+
+    Histograms share the layer's [min, max] range so channels are comparable.
+    Arrays are lists, or PackedTensors for the binary transport.
+    """
+    x = fmap.detach().float()
+    flat = x.flatten(1) if x.dim() > 1 else x.reshape(1, -1)
+    lo, hi = flat.min(), flat.max()
+    bucket = ((flat - lo) / (hi - lo).clamp_min(1e-8) * bins).long().clamp_(0, bins - 1)
+    counts = torch.zeros(flat.shape[0], bins, dtype=torch.int32, device=flat.device)
+    counts.scatter_add_(1, bucket, torch.ones_like(bucket, dtype=torch.int32))
+    arrays = {
+        'mean': flat.mean(dim=1),
+        'max': flat.amax(dim=1),
+        'fraction_zero': (flat == 0).float().mean(dim=1),
+        'histogram': counts,
+    }
+    convert = (lambda t: PackedTensor(t.cpu().numpy())) if binary else (lambda t: t.tolist())
+    return {
+        **{name: convert(value) for name, value in arrays.items()},
+        'histogram_range': [lo.item(), hi.item()],
+    }
+
+
+def resize_nearest(channels: np.ndarray, size: int) -> np.ndarray:
+    """Nearest-neighbour resize of [C, H, W] to [C, size, size] (same sampling as PIL)."""
+    rows = np.floor((np.arange(size) + 0.5) * channels.shape[1] / size).astype(np.intp)
+    cols = np.floor((np.arange(size) + 0.5) * channels.shape[2] / size).astype(np.intp)
+    return channels[:, rows][:, :, cols]
+
+
+def png_data_url(array: np.ndarray) -> str:
+    """Encode a uint8 [H, W] (grayscale) or [H, W, 3] (RGB) array as a PNG data URL."""
+    with stage('png_encode'):
+        buffer = io.BytesIO()
+        Image.fromarray(array, mode='L' if array.ndim == 2 else 'RGB').save(buffer, format='PNG')
+        return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def tile_atlas(channels: np.ndarray, cols: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Tile [C, H, W] channels row-major into one grid image (near-square unless `cols` is given).
+
+    Channel i sits at column i % cols, row i // cols; unused cells are black.
+    """
+    count, height, width = channels.shape
+    cols = cols or int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / cols))
+    grid = np.zeros((rows * cols, height, width), dtype=channels.dtype)
+    grid[:count] = channels
+    atlas = grid.reshape(rows, cols, height, width).transpose(0, 2, 1, 3).reshape(rows * height, cols * width)
+    layout = {'count': count, 'cols': cols, 'rows': rows, 'tile_width': width, 'tile_height': height}
+    return atlas, layout
+
+
+def encode_atlas(channels: np.ndarray, cols: Optional[int] = None) -> Dict[str, Any]:
+    """One PNG sprite atlas for a layer, plus the layout needed to slice it."""
+    atlas, layout = tile_atlas(channels, cols)
+    return {'atlas': png_data_url(atlas), 'layout': layout}
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that reports its time as the json_render stage."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with stage('json_render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class TensorFrameRenderer(BaseRenderer):
+    """Renders responses containing PackedTensors as a single binary frame."""
+    media_type = TRANSPORT_MEDIA_TYPE
+    format = TRANSPORT_FORMAT
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with stage('frame_render'):
+            return encode_frame(data)
+
+
+def _json_default(obj):
+    # NumPy scalars and arrays, as DRF's JSON encoder handles them
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def encode_frame(data: Any) -> bytes:
+    """`data` as one frame, its PackedTensors as raw buffers (see the module docstring)."""
+    buffers: List[bytes] = []
+
+    def extract(obj):
+        if isinstance(obj, PackedTensor):
+            buffer, descriptor = obj.encode()
+            buffers.append(buffer)
+            return {'$tensor': len(buffers) - 1, **descriptor}
+        if isinstance(obj, dict):
+            return {key: extract(value) for key, value in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [extract(value) for value in obj]
+        return obj
+
+    body = extract(data)
+    offsets, position = [], 0
+    for buffer in buffers:
+        offsets.append([position, len(buffer)])
+        position += len(buffer) + (-len(buffer) % 8)
+
+    header = json.dumps({'body': body, 'buffers': offsets}, separators=(',', ':'), default=_json_default).encode()
+    header += b' ' * (-(len(FRAME_MAGIC) + 4 + len(header)) % 8)
+    parts = [FRAME_MAGIC, struct.pack('<I', len(header)), header]
+    for buffer in buffers:
+        parts.append(buffer)
+        parts.append(b'\0' * (-len(buffer) % 8))
+    return b''.join(parts)
+
+
+def decode_frame(frame: bytes, packed: bool = False) -> Dict[str, Any]:
+    """
+    Inverse of TensorFrameRenderer (for tests, benchmarks and Python clients).
+
+    Tensors come back as float arrays, dequantized; with `packed`, as the
+    original PackedTensors instead, so the frame re-encodes byte for byte.
+    """
+    if frame[:4] != FRAME_MAGIC:
+        raise ValueError("Not a tensor frame")
+    (header_len,) = struct.unpack('<I', frame[4:8])
+    header = json.loads(frame[8:8 + header_len])
+    data = memoryview(frame)[8 + header_len:]
+
+    def restore(obj):
+        if isinstance(obj, dict) and '$tensor' in obj:
+            offset, length = header['buffers'][obj['$tensor']]
+            buffer = data[offset:offset + length]
+            shape, dtype = obj['shape'], np.dtype(obj['dtype'])
+            if obj['encoding'] == 'bitmask':
+                size = int(np.prod(shape))
+                mask_len = (size + 7) // 8
+                mask = np.unpackbits(np.frombuffer(buffer[:mask_len], np.uint8), count=size).astype(bool)
+                array = np.zeros(size, dtype)
+                array[mask] = np.frombuffer(buffer[mask_len:], dtype)
+            else:
+                array = np.frombuffer(buffer, dtype).copy()
+            array = array.reshape(shape)
+            if packed:
+                return PackedTensor(array, **{key: value for key, value in obj.items()
+                                              if key not in ('$tensor', 'shape', 'dtype', 'encoding')})
+            if 'scale' in obj:
+                scale = np.asarray(obj['scale'], np.float32).reshape(-1, *([1] * (array.ndim - 1)))
+                offset_ = np.asarray(obj['min'], np.float32).reshape(scale.shape)
+                array = array.astype(np.float32) * scale + offset_
+            return array
+        if isinstance(obj, dict):
+            return {key: restore(value) for key, value in obj.items()}
+        if isinstance(obj, list):
+            return [restore(value) for value in obj]
+        return obj
+
+    return restore(header['body'])
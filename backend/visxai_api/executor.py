@@ -0,0 +1,417 @@
+"""
+Scheduling executor for model calls.
+
+Each inference already uses `torch.get_num_threads()` intra-op threads, so
+running more of them at once than there are cores only adds contention. The
+executor therefore runs at most cpu_count // intra-op threads calls at a time
+(VISXAI_EXECUTOR_WORKERS), and decides which waiting call goes next.
+
+Handlers that serve several calls at once (model replicas, micro-batching,
+a remote worker pool) report it through `ModelHandler.concurrency()`. The
+views pass it on via `set_concurrency`, and the executor grows to the sum of
+those, so a 4-replica model really runs 4 calls at once. No model may hold
+more workers than it can use (or than the base count), so one with a single
+replica cannot take the threads another model's replicas added.
+
+- Every action belongs to a cost class (VISXAI_ACTION_COSTS, e.g. gradcam ->
+  "heavy"). The class with the lowest priority value goes first, so a burst
+  of Grad-CAMs queues behind interactive predicts instead of in front of
+  them. A call that has waited longer than VISXAI_SCHEDULER_AGING_S is
+  promoted to the top priority, so heavy work is never starved.
+- Within a class, models share the workers fairly: the next call comes from
+  the model that has used the least worker time so far. A model that was idle
+  starts level with the busiest active one rather than with its old credit.
+- Each class bounds its queue (`max_queued`). Past that, `submit` raises
+  `ExecutorFull` and the views answer 429 with Retry-After. A class may also
+  cap its concurrently running calls (`max_running`), which keeps workers
+  free for the other classes.
+- Every call has a deadline (per class, or per request). A call still queued
+  when its deadline passes is dropped with `DeadlineExceeded` (504) instead
+  of running for a client that has given up.
+
+Cancelling a queued call (e.g. on client disconnect) drops it. A call that
+has already started runs to completion, and its result is discarded.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import torch
+
+from .timing import record
+
+DEFAULT_CLASS = "interactive"
+
+
+class ExecutorFull(Exception):
+    """Raised when a cost class's queue is full; carries a Retry-After hint in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full; retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised for a call whose deadline passed before a worker picked it up."""
+
+
+def default_workers() -> int:
+    """Concurrent inferences that fit the cores given torch's intra-op thread count."""
+    return max(1, (os.cpu_count() or 1) // max(1, torch.get_num_threads()))
+
+
+class _Job:
+    __slots__ = ("future", "fn", "model", "action", "cost_class", "enqueued", "deadline", "context")
+
+    def __init__(self, fn: Callable[[], Any], model: str, action: str, cost_class: str, deadline: float):
+        self.future: Future = Future()
+        self.fn = fn
+        self.model = model
+        self.action = action
+        self.cost_class = cost_class
+        self.enqueued = time.monotonic()
+        self.deadline = deadline
+        # The submitter's context vars (e.g. its StageTimer), for the worker to run in
+        self.context = contextvars.copy_context()
+
+
+class _ActionStats:
+    """Counters and recent wait times for one action."""
+
+    def __init__(self, window: int = 512):
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.waits: Deque[float] = deque(maxlen=window)
+        self.service_time = 0.0
+
+    def to_dict(self, queued: int) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2) if waits else None
+        return {
+            "queued": queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p99": percentile(0.99),
+            "wait_ms_max": round(waits[-1] * 1000, 2) if waits else None,
+            "service_time_ms": round(self.service_time * 1000, 2),
+        }
+
+
+class InferenceExecutor:
+    """Worker threads fed by per-class, per-model queues (see module docstring)."""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        classes: Optional[Dict[str, Dict[str, Any]]] = None,
+        action_costs: Optional[Dict[str, str]] = None,
+        aging: float = 2.0,
+    ):
+        self.workers = workers or default_workers()
+        self.classes = classes or {DEFAULT_CLASS: {"priority": 0, "max_queued": 16}}
+        self.action_costs = action_costs or {}
+        self.aging = aging
+        self._cond = threading.Condition()
+        # class -> model -> FIFO of jobs
+        self._queues: Dict[str, Dict[str, Deque[_Job]]] = {name: defaultdict(deque) for name in self.classes}
+        self._running: Dict[str, int] = defaultdict(int)  # per class
+        self._model_running: Dict[str, int] = defaultdict(int)
+        self._concurrency: Dict[str, int] = {}  # per model, from set_concurrency
+        self._served: Dict[str, float] = defaultdict(float)  # worker seconds per model
+        self._service_time: Dict[str, float] = defaultdict(float)  # per class
+        self._stats: Dict[str, _ActionStats] = defaultdict(_ActionStats)
+        self._local = threading.local()
+        self._threads: List[threading.Thread] = []
+        self.closed = False
+
+    def capacity(self) -> int:
+        """Worker threads: the base count, or the models' combined concurrency when larger."""
+        return max(self.workers, sum(self._concurrency.values()))
+
+    def set_concurrency(self, model: str, calls: int):
+        """Record how many calls `model` can serve at once (e.g. replicas x batch size)."""
+        calls = max(1, int(calls))
+        with self._cond:
+            if self._concurrency.get(model) == calls:
+                return
+            self._concurrency[model] = calls
+            self._start_workers()
+            self._cond.notify_all()
+
+    def _model_limit(self, model: str) -> int:
+        return max(self.workers, self._concurrency.get(model, 1))
+
+    def cost_class(self, action: str) -> str:
+        name = self.action_costs.get(action, DEFAULT_CLASS)
+        return name if name in self.classes else next(iter(self.classes))
+
+    def _queued(self, cost_class: str) -> int:
+        return sum(len(jobs) for jobs in self._queues[cost_class].values())
+
+    def _retry_after(self, cost_class: str) -> int:
+        backlog = self._queued(cost_class) + self._running[cost_class]
+        return max(1, math.ceil(self._service_time[cost_class] * backlog / self.capacity()))
+
+    def retry_after(self, action: str) -> int:
+        """Seconds until the action's cost class is expected to drain (at least 1)."""
+        with self._cond:
+            return self._retry_after(self.cost_class(action))
+
+    def submit(self, fn: Callable[[], Any], model: str = "", action: str = "",
+               deadline: Optional[float] = None) -> Future:
+        """
+        Queue `fn()` for `model`/`action`.
+
+        `deadline` is seconds from now (default: the cost class's deadline_ms).
+        Raises ExecutorFull when the class's queue is at its limit.
+        """
+        cost_class = self.cost_class(action)
+        config = self.classes[cost_class]
+        if deadline is None and config.get("deadline_ms"):
+            deadline = config["deadline_ms"] / 1000
+        job = _Job(fn, model, action, cost_class, time.monotonic() + deadline if deadline else math.inf)
+        with self._cond:
+            if self.closed:
+                raise RuntimeError("Inference executor is shut down")
+            self._sweep_cancelled(cost_class)
+            if self._queued(cost_class) >= config.get("max_queued", 16):
+                self._stats[action].rejected += 1
+                raise ExecutorFull(self._retry_after(cost_class))
+            if not self._is_active(model):
+                # Idle models do not bank credit: start level with the least-served active one.
+                active = [self._served[m] for m in self._active_models()]
+                if active:
+                    self._served[model] = max(self._served[model], min(active))
+            self._queues[cost_class][model].append(job)
+            self._start_workers()
+            self._cond.notify()
+        job.future.add_done_callback(lambda future, action=action: self._on_cancel(future, action))
+        return job.future
+
+    def call(self, fn: Callable[[], Any], model: str = "", action: str = "",
+             deadline: Optional[float] = None) -> Any:
+        """Run `fn()` through the scheduler and wait; runs inline when already on a worker."""
+        if getattr(self._local, "worker", False):
+            return fn()
+        return self.submit(fn, model, action, deadline).result()
+
+    async def run(self, fn: Callable[[], Any], model: str = "", action: str = "",
+                  deadline: Optional[float] = None) -> Any:
+        """Await `fn()` on a worker; cancelling the caller drops it if it has not started."""
+        future = self.submit(fn, model, action, deadline)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def _on_cancel(self, future: Future, action: str):
+        if future.cancelled():
+            with self._cond:
+                self._stats[action].cancelled += 1
+
+    def _active_models(self):
+        models = {m for m, n in self._model_running.items() if n}
+        for queues in self._queues.values():
+            models.update(m for m, jobs in queues.items() if jobs)
+        return models
+
+    def _is_active(self, model: str) -> bool:
+        return self._model_running[model] > 0 or any(q.get(model) for q in self._queues.values())
+
+    def _sweep_cancelled(self, cost_class: str):
+        for jobs in self._queues[cost_class].values():
+            if any(job.future.cancelled() for job in jobs):
+                kept = [job for job in jobs if not job.future.cancelled()]
+                jobs.clear()
+                jobs.extend(kept)
+
+    def _sweep_expired(self, now: float) -> List[_Job]:
+        expired = []
+        for queues in self._queues.values():
+            for jobs in queues.values():
+                if any(job.deadline <= now for job in jobs):
+                    expired.extend(job for job in jobs if job.deadline <= now)
+                    kept = [job for job in jobs if job.deadline > now]
+                    jobs.clear()
+                    jobs.extend(kept)
+        for job in expired:
+            self._stats[job.action].dropped += 1
+        return expired
+
+    def _pick(self, now: float) -> Optional[_Job]:
+        """Next job: best (aged) class priority, then the least-served model, then FIFO."""
+        top = min(config.get("priority", 0) for config in self.classes.values())
+        best, best_key = None, None
+        for name, config in self.classes.items():
+            max_running = config.get("max_running")
+            if max_running and self._running[name] >= max_running:
+                continue
+            for model, jobs in self._queues[name].items():
+                if not jobs or self._model_running[model] >= self._model_limit(model):
+                    continue
+                priority = config.get("priority", 0)
+                if now - jobs[0].enqueued >= self.aging:
+                    priority = top
+                key = (priority, self._served[model], jobs[0].enqueued)
+                if best_key is None or key < best_key:
+                    best, best_key = (name, model), key
+        if best is None:
+            return None
+        return self._queues[best[0]][best[1]].popleft()
+
+    def _next_job(self) -> Optional[_Job]:
+        while True:
+            with self._cond:
+                while True:
+                    if self.closed:
+                        return None
+                    now = time.monotonic()
+                    expired = self._sweep_expired(now)
+                    if expired:
+                        break
+                    job = self._pick(now)
+                    if job is not None:
+                        self._running[job.cost_class] += 1
+                        self._model_running[job.model] += 1
+                        self._stats[job.action].running += 1
+                        break
+                    deadlines = [j.deadline for q in self._queues.values() for jobs in q.values() for j in jobs]
+                    timeout = min(deadlines) - now if deadlines else None
+                    self._cond.wait(timeout=None if timeout is None or math.isinf(timeout) else timeout)
+            # Futures are resolved outside the lock: their callbacks may re-enter it.
+            if expired:
+                for job in expired:
+                    if job.future.set_running_or_notify_cancel():
+                        job.future.set_exception(DeadlineExceeded(
+                            f"Deadline passed after {now - job.enqueued:.2f}s in the queue"))
+                continue
+            if job.future.set_running_or_notify_cancel():
+                return job
+            self._finish(job, 0.0, None)
+
+    def _finish(self, job: _Job, elapsed: float, failed: Optional[bool]):
+        with self._cond:
+            self._running[job.cost_class] -= 1
+            self._model_running[job.model] -= 1
+            stats = self._stats[job.action]
+            stats.running -= 1
+            if failed is not None:
+                self._served[job.model] += elapsed
+                stats.service_time = elapsed if not stats.service_time else 0.8 * stats.service_time + 0.2 * elapsed
+                previous = self._service_time[job.cost_class]
+                self._service_time[job.cost_class] = elapsed if not previous else 0.8 * previous + 0.2 * elapsed
+                if failed:
+                    stats.failed += 1
+                else:
+                    stats.completed += 1
+            self._cond.notify()
+
+    def _worker(self):
+        self._local.worker = True
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            start = time.monotonic()
+            with self._cond:
+                self._stats[job.action].waits.append(start - job.enqueued)
+            try:
+                result = job.context.run(self._run_job, job, start - job.enqueued)
+            except BaseException as e:
+                self._finish(job, time.monotonic() - start, True)
+                job.future.set_exception(e)
+            else:
+                self._finish(job, time.monotonic() - start, False)
+                job.future.set_result(result)
+
+    @staticmethod
+    def _run_job(job: _Job, wait: float) -> Any:
+        record('queue', wait)
+        return job.fn()
+
+    def _start_workers(self):
+        while len(self._threads) < self.capacity():
+            thread = threading.Thread(target=self._worker, name=f"visxai-infer-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, wait times and outcomes per action, plus per-class and per-model load."""
+        with self._cond:
+            queued_by_action: Dict[str, int] = defaultdict(int)
+            queued_by_model: Dict[str, int] = defaultdict(int)
+            for queues in self._queues.values():
+                for model, jobs in queues.items():
+                    for job in jobs:
+                        queued_by_action[job.action] += 1
+                        queued_by_model[model] += 1
+            return {
+                "workers": self.capacity(),
+                "classes": {
+                    name: {
+                        **config,
+                        "queued": self._queued(name),
+                        "running": self._running[name],
+                        "service_time_ms": round(self._service_time[name] * 1000, 2),
+                    }
+                    for name, config in self.classes.items()
+                },
+                "actions": {
+                    action: {"class": self.cost_class(action), **stats.to_dict(queued_by_action[action])}
+                    for action, stats in self._stats.items()
+                },
+                "models": {
+                    model: {"queued": queued_by_model[model], "running": self._model_running[model],
+                            "concurrency": self._concurrency.get(model, 1), "worker_seconds": round(served, 3)}
+                    for model, served in self._served.items()
+                },
+            }
+
+    def shutdown(self):
+        """Stop the workers after their current call; queued calls are cancelled."""
+        with self._cond:
+            self.closed = True
+            jobs = [job for q in self._queues.values() for js in q.values() for job in js]
+            for queues in self._queues.values():
+                queues.clear()
+            self._cond.notify_all()
+        for job in jobs:
+            job.future.cancel()
+
+
+_executor: Optional[InferenceExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> InferenceExecutor:
+    """Process-wide inference executor built from settings."""
+    global _executor
+    from django.conf import settings
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = InferenceExecutor(
+                workers=settings.VISXAI_EXECUTOR_WORKERS,
+                classes=settings.VISXAI_COST_CLASSES,
+                action_costs=settings.VISXAI_ACTION_COSTS,
+                aging=settings.VISXAI_SCHEDULER_AGING_S,
+            )
+    return _executor
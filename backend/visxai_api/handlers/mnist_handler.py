@@ -1,122 +1,371 @@
+import copy
+import logging
 import os
+import threading
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import numpy as np
-import base64
-import io
-from PIL import Image
 from torchvision import transforms
 from django.conf import settings
 from typing import Dict, Any, Optional, List
 from ..model_registry import ModelHandler
 from ..ml_models import SmallMNISTCNN
+from ..inference import ActivationCapture, ReplicaPool
+from ..timing import stage
+from ..adversarial import attack_response, parse_attack_params, run_attack
+from ..training import TrainingWorker, load_mnist, normalize_mnist
+from ..kernel_store import KernelStore, list_runs
+from ..weights import is_current, load_weights, state_digest, weights_path
+from ..encoding import (PackedTensor, channel_stats, encode_atlas, normalize_channels, pack_channels, png_data_url,
+                        resize_nearest)
+
+logger = logging.getLogger(__name__)
+
 
 class MNISTHandler(ModelHandler):
     """Handler for MNIST Digit Classification using SmallMNISTCNN."""
     
-    def __init__(self):
+    # Public layer id (used by the frontend) -> hooked module name
+    LAYER_MAP = {"0": "conv1", "1": "pool1", "2": "conv2", "3": "pool2"}
+    # Upper bounds for one interactive training request
+    MAX_TRAIN_STEPS = 2000
+    MAX_BATCH_SIZE = 512
+    
+    def __init__(self, replicas: int = 1):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model = SmallMNISTCNN().to(self.device)
         self.optimizer = optim.Adam(self.model.parameters(), lr=0.001)
         self.loss_fn = nn.CrossEntropyLoss()
         
         model_path = os.path.join(settings.BASE_DIR, 'saved_models', 'mnist_cnn.pth')
-        if os.path.exists(model_path):
+        weights_file = weights_path('mnist')
+        loaded = True
+        if is_current(weights_file, model_path):
+            # Flat mapped weights (see export_weights): no unpickling. Copied in,
+            # not assigned, since the optimizer already holds these parameters.
+            self.model.load_state_dict(load_weights(weights_file))
+            self.model.eval()
+        elif os.path.exists(model_path):
             self.model.load_state_dict(torch.load(model_path, map_location=self.device))
             self.model.eval()
         else:
-            print(f"Warning: MNIST model not found at {model_path}. Please run 'python manage.py train_mnist'.")
+            loaded = False
+            logger.warning("MNIST model not found at %s. Please run 'python manage.py train_mnist'.", model_path)
+        # Small enough to hash at load and after every training publish; random init has no identity
+        self.weights_id = state_digest(self.model.state_dict()) if loaded else None
 
-        self.feature_maps = {}
         self._register_hooks()
+        # self.model is the training copy; requests are served from a snapshot
+        # of it, republished by the trainer, so training never blocks or
+        # mutates weights under a running predict.
+        self.pool = ReplicaPool(self._snapshot(), replicas)
+        
+        self.data_dir = os.path.join(settings.BASE_DIR, 'data')
+        self._train_images: Optional[torch.Tensor] = None
+        self._train_labels: Optional[torch.Tensor] = None
+        self._train_lock = threading.Lock()
+        self.trainer = TrainingWorker(self._train_batch, self._publish_weights, name="mnist-trainer")
+
+    def warmup(self) -> None:
+        """Run a dummy forward pass to initialise kernels and allocator pools."""
+        dummy = torch.zeros(1, 1, 28, 28, device=self.device)
+        for replica in self.pool:
+            replica.eval()
+            with torch.no_grad():
+                replica(dummy)
+
+    def close(self) -> None:
+        """Stop the training worker."""
+        self.trainer.close()
+
+    def memory_bytes(self) -> int:
+        """Size of the model's parameters and buffers (training copy plus inference snapshot)."""
+        return 2 * sum(t.numel() * t.element_size() for t in list(self.model.parameters()) + list(self.model.buffers()))
+
+    def concurrency(self) -> int:
+        """One call per replica."""
+        return len(self.pool)
+
+    def _snapshot(self) -> nn.Module:
+        """Frozen copy of the training model for inference (hooks included)."""
+        snapshot = copy.deepcopy(self.model)
+        snapshot.eval()
+        for param in snapshot.parameters():
+            param.requires_grad_(False)
+        return snapshot
+
+    def _publish_weights(self):
+        """Swap inference over to the current training weights (runs on the trainer thread)."""
+        # In-flight requests finish on the replica they checked out from the old pool
+        snapshot = self._snapshot()
+        weights_id = state_digest(snapshot.state_dict())
+        self.pool = ReplicaPool(snapshot, len(self.pool))
+        # After the swap: a request keyed by the old identity that ran on the
+        # new pool sees the identity change and keeps its result off disk
+        self.weights_id = weights_id
+        self.weights_version += 1
+        return self.weights_version, self._kernel_summary()
+
+    def _kernel_summary(self) -> Dict[str, Any]:
+        """conv1/conv2 kernels (first input channel) as nested lists."""
+        return {
+            name: layer.weight.detach()[:, 0].cpu().tolist()
+            for name, layer in (("conv1", self.model.block1[0]), ("conv2", self.model.block2[0]))
+        }
 
     def _register_hooks(self):
-        def get_hook(name):
-            def hook(module, input, output):
-                self.feature_maps[name] = output.detach().cpu()
-            return hook
-
-        self.model.pool1.register_forward_hook(get_hook("pool1"))
-        self.model.pool2.register_forward_hook(get_hook("pool2"))
-        self.model.block1[0].register_forward_hook(get_hook("conv1"))
-        self.model.block2[0].register_forward_hook(get_hook("conv2"))
-
-    def _tensor_to_base64(self, tensor: torch.Tensor) -> str:
-        """Convert a 2D tensor to a Base64 PNG string."""
-        # Normalize to 0-255
-        tensor = tensor - tensor.min()
-        tensor = tensor / (tensor.max() + 1e-5)
-        tensor = (tensor * 255).byte()
-        
-        img = Image.fromarray(tensor.numpy(), mode='L')
-        # Resize for better visibility if needed, but keeping raw size is fine for textures
-        img = img.resize((64, 64), Image.NEAREST) 
-        
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # Hooks write into the request's ActivationCapture, never shared state
+        self.model.pool1.register_forward_hook(ActivationCapture.hook("pool1"))
+        self.model.pool2.register_forward_hook(ActivationCapture.hook("pool2"))
+        self.model.block1[0].register_forward_hook(ActivationCapture.hook("conv1"))
+        self.model.block2[0].register_forward_hook(ActivationCapture.hook("conv2"))
 
-    def predict(self, data: Any) -> Dict[str, Any]:
+    def _encode_feature_maps(self, feature_maps: Dict[str, torch.Tensor], options: Dict[str, Any],
+                             layers: Optional[List[str]] = None) -> Dict[str, Any]:
         """
-        Predict from pixel array.
-        data['pixels']: List of 784 floats (0-1) or 2D array.
+        Encode every channel of every hooked layer (or only the public ids in `layers`).
+        
+        Default: a list of 64x64 PNG data URLs per layer. 'feature_layout': 'atlas'
+        gives one native-resolution sprite atlas per layer instead, 'stats' only
+        per-channel summaries, and the 'binary' transport one packed tensor per layer.
         """
+        feature_data = {}
+        binary = options.get('transport') == 'binary'
+        atlas = options.get('feature_layout') == 'atlas'
+        stats = options.get('feature_layout') == 'stats'
+        
+        for layer_id, internal_name in self.LAYER_MAP.items():
+            if internal_name in feature_maps and (layers is None or layer_id in layers):
+                fmap = feature_maps[internal_name][0].cpu() # [C, H, W]
+                if stats:
+                    feature_data[layer_id] = channel_stats(fmap, int(options.get('histogram_bins', 16)), binary)
+                    continue
+                if binary:
+                    # One packed tensor per layer at native resolution
+                    feature_data[layer_id] = pack_channels(fmap, options.get('tensor_dtype', 'uint8'))
+                    continue
+                # Normalize all channels at once
+                normalized = normalize_channels(fmap, eps=1e-5)
+                if atlas:
+                    feature_data[layer_id] = encode_atlas(normalized)
+                    continue
+                # Resize for better visibility if needed, but keeping raw size is fine for textures
+                channels = resize_nearest(normalized, 64)
+                feature_data[layer_id] = [png_data_url(channel) for channel in channels]
+        return feature_data
+
+    def _classify(self, data: Any):
+        """Forward the pixels; returns (prediction, activations) or ({'error': ...}, None)."""
         pixels = data.get('pixels')
         if not pixels:
-            return {"error": "No pixels provided"}
+            return {"error": "No pixels provided"}, None
 
         # Convert list to tensor [1, 1, 28, 28]
         try:
-            arr = np.array(pixels, dtype=np.float32).reshape(28, 28)
-            # Normalize: Input is 0-1 (black-white), model expects -1 to 1
-            arr = (arr - 0.5) / 0.5
-            tensor = torch.from_numpy(arr).unsqueeze(0).unsqueeze(0).to(self.device)
+            with stage('transform'):
+                arr = np.array(pixels, dtype=np.float32).reshape(28, 28)
+                # Normalize: Input is 0-1 (black-white), model expects -1 to 1
+                arr = (arr - 0.5) / 0.5
+                tensor = torch.from_numpy(arr).unsqueeze(0).unsqueeze(0).to(self.device)
         except Exception as e:
-            return {"error": f"Invalid pixel data: {str(e)}"}
+            return {"error": f"Invalid pixel data: {str(e)}"}, None
 
-        self.model.eval()
-        with torch.no_grad():
-            output = self.model(tensor)
+        with self.pool.checkout() as model, ActivationCapture() as capture, torch.no_grad():
+            model.eval()
+            with stage('forward'):
+                output = model(tensor)
             probs = torch.softmax(output, dim=1).squeeze().tolist()
 
         # Format probabilities
         prob_list = [{"label": str(i), "score": p} for i, p in enumerate(probs)]
         top_class = str(np.argmax(probs))
-        
+        return {"probabilities": prob_list, "top_class": top_class}, capture.maps
+
+    def predict(self, data: Any) -> Dict[str, Any]:
+        """
+        Predict from pixel array.
+        data['pixels']: List of 784 floats (0-1) or 2D array.
+        """
+        result, feature_maps = self._classify(data)
+        if feature_maps is None:
+            return result
+
         # Collect all feature maps
-        feature_data = {}
-        layer_map = {"0": "conv1", "1": "pool1", "2": "conv2", "3": "pool2"}
-        
-        for layer_id, internal_name in layer_map.items():
-            if internal_name in self.feature_maps:
-                fmap = self.feature_maps[internal_name][0] # [C, H, W]
-                # Return all channels
-                channels = []
-                for i in range(fmap.shape[0]):
-                    channels.append(self._tensor_to_base64(fmap[i]))
-                feature_data[layer_id] = channels
+        result["feature_maps"] = self._encode_feature_maps(feature_maps, data)
+        return result
 
-        return {
-            "probabilities": prob_list,
-            "top_class": top_class,
-            "feature_maps": feature_data
-        }
+    def predict_stream(self, data: Any):
+        """Yield the prediction, then each layer's feature maps as soon as it is encoded."""
+        result, feature_maps = self._classify(data)
+        if feature_maps is None:
+            yield "error", result
+            return
+        yield "prediction", result
+        for layer_id, internal_name in self.LAYER_MAP.items():
+            if internal_name in feature_maps:
+                yield "layer", {
+                    "layer_id": layer_id,
+                    "feature_maps": self._encode_feature_maps(feature_maps, data, [layer_id])
+                }
+
+    def generate_adversarial(self, data: Any, epsilon: float = 0.01) -> Dict[str, Any]:
+        """
+        FGSM or PGD attack on a drawn digit (see adversarial.run_attack).
+        data['pixels']: 784 floats (0-1); attack options as for VGG/ResNet.
+        """
+        pixels = data.get('pixels')
+        if not pixels:
+            return {"error": "No pixels provided"}
+        try:
+            x = torch.tensor(pixels, dtype=torch.float32, device=self.device).reshape(1, 1, 28, 28)
+        except Exception as e:
+            return {"error": f"Invalid pixel data: {str(e)}"}
+        params = parse_attack_params(data, epsilon)
+        class_idx = data.get("class_idx")
+
+        with self.pool.checkout() as model:
+            model.eval()
+            # Same mapping as predict: 0-1 pixels to the -1..1 range the model expects
+            attack = run_attack(model, lambda t: (t - 0.5) / 0.5, x,
+                                label=int(class_idx) if class_idx is not None else None, **params)
+
+        return attack_response(attack, params, [str(i) for i in range(10)], int(data.get("top_k", 5)),
+                               binary=data.get("transport") == "binary")
+
+    def _load_training_data(self):
+        """Load the MNIST training set from disk once; raises RuntimeError when it was never downloaded."""
+        with self._train_lock:
+            if self._train_images is None:
+                self._train_images, self._train_labels = load_mnist(self.data_dir, train=True)
+
+    def _training_batch(self, batch_size: int, options: Dict[str, Any]):
+        """A random batch of MNIST training images plus the request's own labelled drawing, if any."""
+        self._load_training_data()
+        index = torch.randint(len(self._train_labels), (batch_size,))
+        # Normalized per batch from the preloaded uint8 tensor
+        images = normalize_mnist(self._train_images[index])
+        labels = self._train_labels[index]
+        if options.get("example") is not None:
+            images = torch.cat([images, options["example"]])
+            labels = torch.cat([labels, torch.tensor([options["label"]])])
+        return images.to(self.device), labels.to(self.device)
+
+    def _train_batch(self, options: Dict[str, Any]):
+        """One optimizer step on the training copy (runs on the trainer thread)."""
+        images, labels = self._training_batch(options["batch_size"], options)
+        self.model.train()
+        self.optimizer.zero_grad(set_to_none=True)
+        output = self.model(images)
+        loss = self.loss_fn(output, labels)
+        loss.backward()
+        self.optimizer.step()
+        return loss.detach(), (output.detach().argmax(dim=1) == labels).sum(), labels.shape[0]
 
     def train_step(self, data: Any) -> Dict[str, Any]:
-        """Run a single training step (mock or real)."""
-        # For interactive demo, we can just run a few random batches from MNIST
-        # Or just return success if we want to simulate
-        
-        # TODO: Implement real training step if needed, for now just returning success
-        # to trigger frontend update
-        
+        """
+        Queue interactive training on the background worker and return at once.
+
+        data: optional 'steps' (default 20), 'batch_size' (default 64), 'lr',
+        and 'pixels' + 'label' to mix the user's own drawing into every batch.
+        Poll the 'progress' action with the returned job_id for loss, accuracy
+        and conv kernels. Raises ValueError for invalid parameters.
+        """
+        try:
+            steps = int(data.get("steps", 20))
+            batch_size = int(data.get("batch_size", 64))
+            lr = float(data["lr"]) if data.get("lr") is not None else None
+            example = label = None
+            if data.get("pixels") and data.get("label") is not None:
+                example = torch.tensor(data["pixels"], dtype=torch.float32).reshape(1, 1, 28, 28)
+                label = int(data["label"])
+        except (TypeError, ValueError, RuntimeError) as e:
+            raise ValueError(f"Invalid training parameters: {str(e)}")
+        if not 1 <= steps <= self.MAX_TRAIN_STEPS or not 1 <= batch_size <= self.MAX_BATCH_SIZE:
+            raise ValueError(f"steps must be 1-{self.MAX_TRAIN_STEPS} and batch_size 1-{self.MAX_BATCH_SIZE}")
+        if lr is not None and not 0 < lr < float("inf"):
+            raise ValueError("lr must be a positive number")
+        if label is not None and not 0 <= label <= 9:
+            raise ValueError("label must be a digit 0-9")
+
+        try:
+            self._load_training_data()
+        except RuntimeError:
+            return {"error": f"MNIST training data not found in {self.data_dir}. "
+                             "Run 'python manage.py train_mnist' once to download it."}
+
+        options: Dict[str, Any] = {"batch_size": batch_size, "example": None}
+        if example is not None:
+            options["example"] = (example - 0.5) / 0.5
+            options["label"] = label
+        if lr is not None:
+            # Applies to every later step, like any optimizer setting
+            for group in self.optimizer.param_groups:
+                group["lr"] = lr
+
+        try:
+            job = self.trainer.submit(steps, options)
+        except RuntimeError as e:
+            return {"error": str(e)}
         return {
-            "status": "success",
-            "loss": 0.123, # Mock loss
-            "message": "Training step completed"
+            "status": job.state,
+            "job_id": job.id,
+            "queue_position": self.trainer.queue_position(job),
+            "message": f"Queued {steps} training steps"
         }
 
+    def train_progress(self, data: Any) -> Dict[str, Any]:
+        """Progress of a training job ('job_id', default: the latest); 'cancel': true stops it."""
+        job_id = data.get("job_id") or None
+        job = self.trainer.get(job_id)
+        if job is None:
+            return {"error": f"Unknown training job '{job_id}'" if job_id else "No training jobs yet"}
+        if data.get("cancel") in (True, "1", "true"):
+            self.trainer.cancel(job.id)
+        return job.to_dict()
+
+    def get_kernels(self, data: Any) -> Dict[str, Any]:
+        """
+        Kernel evolution recorded by train_mnist (see kernel_store.py), in one response.
+
+        data: 'run' (default: the latest), 'layer' ('conv1' or 'conv2'; default
+        both), 'epochs' ('first:last', inclusive, or one epoch), 'input_channel'
+        (atlas only, default 0) and 'scale' (atlas pixels per kernel cell, default 8).
+        Returns per layer one atlas with a row per epoch and a column per kernel,
+        or with the binary transport the raw [epochs, out, in, kh, kw] kernels.
+        """
+        root = os.path.join(settings.MEDIA_ROOT, "kernels")
+        runs = list_runs(root)
+        if not runs:
+            return {"error": "No kernel snapshots yet. Run 'python manage.py train_mnist'."}
+        run = data.get("run") or runs[-1]
+        if run not in runs:
+            return {"error": f"Unknown run '{run}'. Available: {', '.join(runs)}"}
+
+        spec = str(data.get("epochs") or ":")
+        first, _, last = spec.partition(":") if ":" in spec else (spec, "", spec)
+        first = int(first) if first else None
+        last = int(last) if last else None
+
+        store = KernelStore(os.path.join(root, run))
+        binary = data.get("transport") == "binary"
+        kernels = {}
+        for layer in ([data["layer"]] if data.get("layer") else store.layers):
+            epochs, weights = store.read(layer, first, last)
+            if not epochs:
+                return {"error": f"No snapshots for epochs '{spec}'. Recorded: {store.epochs}"}
+            if binary:
+                kernels[layer] = {"epochs": epochs, "tensor": PackedTensor(weights.astype(np.float16))}
+                continue
+            count, out_channels, _, height, width = weights.shape
+            tiles = torch.from_numpy(np.ascontiguousarray(weights[:, :, int(data.get("input_channel", 0))]))
+            # Each kernel normalized to its own range, one row per epoch
+            normalized = normalize_channels(tiles.reshape(-1, height, width), eps=1e-5)
+            scaled = resize_nearest(normalized, height * int(data.get("scale", 8)))
+            kernels[layer] = {"epochs": epochs, "shape": list(weights.shape[1:]),
+                              **encode_atlas(scaled, cols=out_channels)}
+        return {"run": run, "runs": runs, "kernels": kernels}
+
     def get_features(self, data: Any, layer_id: Optional[str] = None) -> Dict[str, Any]:
         # This is for the GET request (legacy/texture loader)
         # We might not use this if we send everything in predict
@@ -1,4 +1,7 @@
+import logging
+import os
 import torch
+import torch.nn as nn
 import torch.nn.functional as F
 import torchvision.models as models
 import torchvision.transforms as transforms
@@ -6,46 +9,262 @@ from PIL import Image
 import io
 import base64
 import json
-from typing import Dict, Any, Optional, List
+import hashlib
+import re
+import secrets
+from typing import Dict, Any, Optional, List, Tuple
 import numpy as np
 from ..model_registry import ModelHandler
+from ..inference import ActivationCapture, ActivationStore, ReplicaPool, StopForward
+from ..timing import stage
+from ..batching import MicroBatcher
+from ..weights import load_weights, state_digest, weights_digest, weights_path
+from ..backends import build_backend
+from ..precision import autocast, load_image_set, quantize_model, resolve_precision, synthetic_images
+from ..adversarial import attack_response, parse_attack_params, run_attack
+from ..encoding import (channel_stats, encode_atlas, normalize_channels, pack_channels, pack_unit_interval,
+                        png_data_url, rank_channels)
+
+logger = logging.getLogger(__name__)
+
+# Channels per conv layer encoded up front by predict
+PREVIEW_CHANNELS = 16
+
+
+def parse_channel_range(spec: Any, total: int) -> slice:
+    """Parse a 'start:stop' (or single 'index') channel spec, clamped to [0, total)."""
+    if spec in (None, ''):
+        return slice(0, min(PREVIEW_CHANNELS, total))
+    try:
+        if ':' in str(spec):
+            start, stop = str(spec).split(':', 1)
+            start = int(start) if start else 0
+            stop = int(stop) if stop else total
+        else:
+            start = int(spec)
+            stop = start + 1
+    except ValueError:
+        raise ValueError(f"Invalid channel range '{spec}'; expected 'start:stop'")
+    start, stop = max(0, min(start, total)), max(0, min(stop, total))
+    if start >= stop:
+        raise ValueError(f"Empty channel range '{spec}' for a layer with {total} channels")
+    return slice(start, stop)
+
+
+def discover_layers(model: nn.Module) -> List[Tuple[str, str]]:
+    """
+    Find the visualized layers of a torchvision VGG or ResNet.
+    
+    VGG: every Conv2d in `features` (conv_1..) and Linear in `classifier`
+    (fc_1..). When an in-place ReLU follows, the layer is captured at the ReLU
+    instead. That is the same tensor, but the forward pass has then finished
+    with it and can stop there. ResNet: the residual stages layer1..layerN.
+    
+    Returns:
+        List of (layer name, submodule path) in forward order
+    """
+    layers = []
+    if isinstance(model, models.VGG):
+        for prefix, kind, label in (('features', nn.Conv2d, 'conv'), ('classifier', nn.Linear, 'fc')):
+            sequence = getattr(model, prefix)
+            count = 0
+            for i, module in enumerate(sequence):
+                if not isinstance(module, kind):
+                    continue
+                count += 1
+                if i + 1 < len(sequence) and isinstance(sequence[i + 1], nn.ReLU) and sequence[i + 1].inplace:
+                    i += 1
+                layers.append((f'{label}_{count}', f'{prefix}.{i}'))
+    elif isinstance(model, models.ResNet):
+        layers = [(name, name) for name, _ in model.named_children() if re.fullmatch(r'layer\d+', name)]
+    return layers
+
+
+def apply_jet_colormap(data: np.ndarray) -> np.ndarray:
+    """Apply jet-like colormap without matplotlib."""
+    # Simple jet-like colormap: blue -> cyan -> green -> yellow -> red
+    data = np.clip(data, 0, 1)
+    h, w = data.shape
+    rgb = np.zeros((h, w, 3), dtype=np.uint8)
+    
+    # Blue to cyan (0 -> 0.25)
+    mask1 = data < 0.25
+    rgb[mask1, 0] = 0
+    rgb[mask1, 1] = (data[mask1] * 4 * 255).astype(np.uint8)
+    rgb[mask1, 2] = 255
+    
+    # Cyan to green (0.25 -> 0.5)
+    mask2 = (data >= 0.25) & (data < 0.5)
+    rgb[mask2, 0] = 0
+    rgb[mask2, 1] = 255
+    rgb[mask2, 2] = ((1 - (data[mask2] - 0.25) * 4) * 255).astype(np.uint8)
+    
+    # Green to yellow (0.5 -> 0.75)
+    mask3 = (data >= 0.5) & (data < 0.75)
+    rgb[mask3, 0] = ((data[mask3] - 0.5) * 4 * 255).astype(np.uint8)
+    rgb[mask3, 1] = 255
+    rgb[mask3, 2] = 0
+    
+    # Yellow to red (0.75 -> 1.0)
+    mask4 = data >= 0.75
+    rgb[mask4, 0] = 255
+    rgb[mask4, 1] = ((1 - (data[mask4] - 0.75) * 4) * 255).astype(np.uint8)
+    rgb[mask4, 2] = 0
+    
+    return rgb
+
 
 class VGGResNetHandler(ModelHandler):
     """Handler for VGG16 and ResNet50 pretrained models."""
     
-    def __init__(self, architecture: str):
+    def __init__(self, architecture: str, replicas: int = 1, pretrained: bool = True,
+                 batching: Optional[Dict[str, Any]] = None, activation_store_mb: float = 0,
+                 session_store_mb: float = 0, session_ttl: float = 600, precision: str = 'fp32',
+                 calibration_dir: Optional[str] = None, backend: str = 'eager', prepare: bool = True):
         self.architecture = architecture.lower()
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         
-        # Load pretrained model
-        if self.architecture == 'vgg16':
-            self.model = models.vgg16(pretrained=True)
-        elif self.architecture == 'resnet50':
-            self.model = models.resnet50(pretrained=True)
-        else:
+        # Load pretrained model (pretrained=False gives random weights, for offline benchmarks)
+        builders = {
+            'vgg16': (models.vgg16, models.VGG16_Weights.IMAGENET1K_V1),
+            'resnet50': (models.resnet50, models.ResNet50_Weights.IMAGENET1K_V1),
+        }
+        if self.architecture not in builders:
             raise ValueError(f"Unsupported architecture: {architecture}")
+        build, weights = builders[self.architecture]
+        self.weights_file = weights_path(self.architecture)
+        if pretrained and os.path.exists(self.weights_file):
+            # Exported weights (see export_weights): build on the meta device and
+            # point the parameters at the mapped file, skipping init and copies
+            with torch.device('meta'):
+                self.model = build()
+            self.model.load_state_dict(load_weights(self.weights_file), assign=True)
+            self.weights_id = weights_digest(self.weights_file)
+        else:
+            self.weights_file = None
+            self.model = build(weights=weights if pretrained else None)
+            # torchvision's published weights are fixed (their files are hash-checked on download)
+            self.weights_id = f"torchvision:{weights}" if pretrained else None
         
         self.model.to(self.device)
         self.model.eval()
+        # Weights are never trained here; Grad-CAM only needs gradients w.r.t. activations.
+        for param in self.model.parameters():
+            param.requires_grad_(False)
         
-        # ImageNet preprocessing
-        self.transform = transforms.Compose([
+        # ImageNet preprocessing, split at normalization so attacks can work in pixel space
+        self.to_pixels = transforms.Compose([
             transforms.Resize(256),
             transforms.CenterCrop(224),
             transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
         ])
+        self.normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        self.transform = transforms.Compose([self.to_pixels, self.normalize])
         
         # Load ImageNet class labels
         self.class_labels = self._load_imagenet_labels()
         
-        # Storage for feature maps
-        self.feature_maps = {}
+        # Hooks write into the request's ActivationCapture; replicas share the
+        # weights and the hooks, but each one serves a single request at a time.
         self._register_hooks()
+        self.pool = ReplicaPool(self.model, replicas)
+        
+        # Forward-only passes may run in reduced precision (see precision.py);
+        # Grad-CAM and attacks need gradients and keep using the fp32 pool
+        self.precision = resolve_precision(precision)
+        if self.precision != 'fp32' and self.device.type != 'cpu':
+            logger.warning("Precision '%s' is CPU-only; using fp32 on %s.", self.precision, self.device)
+            self.precision = 'fp32'
+        # Quantized copy and compiled graph: built by prepare(), since both run forward passes
+        self.serving_pool = self.pool
+        self.backend = None
+        self.execution_backend = 'eager'
+        self._calibration_dir = calibration_dir
+        self._backend_name = backend
+        self._prepared = False
+        
+        # Recent predict activations by image digest, reused by Grad-CAM
+        self.activations = ActivationStore(int(activation_store_mb * 1024 * 1024))
+        
+        # Activation sessions: predict(..., session=True) keeps all channels of
+        # every layer here so the client can page through them via get_features
+        self.sessions = ActivationStore(int(session_store_mb * 1024 * 1024), ttl=session_ttl)
+        
+        # Optional micro-batching: {'max_batch_size': 8, 'max_wait_ms': 5}
+        self.batcher = None
+        if batching:
+            self.batcher = MicroBatcher(
+                self._forward_batch,
+                max_batch_size=batching.get('max_batch_size', 8),
+                max_wait_ms=batching.get('max_wait_ms', 5.0),
+                workers=len(self.pool),
+                name=f"{self.architecture}-batcher",
+            )
+        if prepare:
+            self.prepare()
     
+    def prepare(self) -> None:
+        """Quantize and compile the serving copy; serve_inference defers this until after the fork."""
+        if self._prepared:
+            return
+        self._prepared = True
+        replicas = len(self.pool)
+        if self.precision.startswith('int8'):
+            calibration = (self._calibration_batches(self._calibration_dir)
+                           if self.precision == 'int8-static' else None)
+            serving = quantize_model(self.model, self.precision, calibration)
+            if calibration and self.weights_id:
+                # Static quantization scales depend on the calibration images too
+                self.weights_id += '+' + state_digest({'calibration': torch.cat(calibration)})
+            self.serving_pool = ReplicaPool(serving, replicas)
+        
+        # Optional compiled graph for full forward passes, with the hooked
+        # activations as explicit outputs (see backends.py); None = eager
+        backend = self._backend_name
+        if backend != 'eager' and self.precision == 'bf16' and backend != 'compile':
+            logger.warning("The %s backend does not apply bf16 autocast; using eager.", backend)
+        else:
+            example = torch.zeros(1, 3, 224, 224, device=self.device)
+            with autocast(self.precision):
+                self.backend = build_backend(backend, self.serving_pool.replicas[0], self.layers, example)
+        self.execution_backend = self.backend.name if self.backend is not None else 'eager'
+    
+    def _calibration_batches(self, directory: Optional[str], count: int = 32, batch_size: int = 8):
+        """Preprocessed calibration images for int8-static, from `directory` or synthetic."""
+        images = load_image_set(directory, count)
+        if not images:
+            logger.warning("No calibration images in %s; calibrating %s on synthetic images, "
+                           "expect lower int8 accuracy.", directory, self.architecture)
+            images = synthetic_images(count)
+        tensors = torch.stack([self.transform(image) for image in images]).to(self.device)
+        return list(torch.split(tensors, batch_size))
+
+    def warmup(self) -> None:
+        """Run a dummy forward pass to initialise kernels and allocator pools."""
+        dummy = torch.zeros(1, 3, 224, 224, device=self.device)
+        for replica in self.pool:
+            with torch.no_grad():
+                replica(dummy)
+        if self.serving_pool is not self.pool:
+            for replica in self.serving_pool:
+                with torch.no_grad():
+                    replica(dummy)
+
+    def close(self) -> None:
+        """Stop the micro-batching workers, if any."""
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def memory_bytes(self) -> int:
+        """Size of the model's parameters and buffers."""
+        return sum(t.numel() * t.element_size() for t in list(self.model.parameters()) + list(self.model.buffers()))
+
+    def concurrency(self) -> int:
+        """One call per replica, times the batch size when micro-batching (callers wait to be batched)."""
+        return len(self.pool) * (self.batcher.max_batch_size if self.batcher is not None else 1)
+
     def _load_imagenet_labels(self) -> List[str]:
         """Load ImageNet class labels."""
-        import os
         json_path = os.path.join(os.path.dirname(__file__), '..', 'imagenet_classes.json')
         try:
             with open(json_path, 'r') as f:
@@ -53,106 +272,183 @@ class VGGResNetHandler(ModelHandler):
                 # Return first label for each class
                 return [class_dict[str(i)][0] for i in range(1000)]
         except Exception as e:
-            print(f"Warning: Could not load ImageNet labels: {e}")
+            logger.warning("Could not load ImageNet labels: %s", e)
             return [f"class_{i}" for i in range(1000)]
     
     def _register_hooks(self):
         """Register forward hooks to capture feature maps."""
-        self.hooks = []
+        # VGG: 13 conv + 3 fc = 16 layers; ResNet: layer1..layer4
+        self.layers = discover_layers(self.model)
+        self.layer_names = [name for name, _ in self.layers]
+        self.hooks = [
+            self.model.get_submodule(path).register_forward_hook(ActivationCapture.hook(name))
+            for name, path in self.layers
+        ]
+    
+    def _read_image(self, data: Any) -> Tuple[Image.Image, str]:
+        """Decode the base64 'image' field of a request into an RGB PIL image and its SHA-256."""
+        if isinstance(data, dict) and 'image' in data:
+            image_data = data['image']
+            # Remove data URL prefix if present
+            if ',' in image_data:
+                image_data = image_data.split(',')[1]
+            try:
+                with stage('base64_decode'):
+                    image_bytes = base64.b64decode(image_data)
+                with stage('image_decode'):
+                    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            except Exception as e:
+                raise ValueError(f"Failed to decode image: {str(e)}")
+            return image, hashlib.sha256(image_bytes).hexdigest()
+        raise ValueError("Invalid input data format: 'image' field is required")
+
+    def _decode_image(self, data: Any) -> Image.Image:
+        """Decode the base64 'image' field of a request into an RGB PIL image."""
+        return self._read_image(data)[0]
+
+    def _preprocess(self, image: Image.Image) -> torch.Tensor:
+        """Resize, crop and normalize an image into a [1, 3, 224, 224] input batch."""
+        with stage('transform'):
+            return self.transform(image).unsqueeze(0).to(self.device)
+
+    def _forward(self, input_tensor: torch.Tensor, stop_after: Optional[str] = None):
+        """
+        Run a no-grad forward pass on a free replica, returning logits and hooked activations.
         
-        if self.architecture == 'vgg16':
-            # Capture from all learnable layers (13 conv + 3 fc = 16)
-            # Features (Conv layers): [0, 2, 5, 7, 10, 12, 14, 17, 19, 21, 24, 26, 28]
-            # Classifier (FC layers): [0, 3, 6] (Indices in classifier module)
-            
-            # Conv layers in features module
-            conv_indices = [0, 2, 5, 7, 10, 12, 14, 17, 19, 21, 24, 26, 28]
-            for i, idx in enumerate(conv_indices):
-                hook = self.model.features[idx].register_forward_hook(
-                    self._get_activation(f'conv_{i+1}')
-                )
-                self.hooks.append(hook)
-                
-            # FC layers in classifier module
-            fc_indices = [0, 3, 6]
-            for i, idx in enumerate(fc_indices):
-                hook = self.model.classifier[idx].register_forward_hook(
-                    self._get_activation(f'fc_{i+1}')
-                )
-                self.hooks.append(hook)
+        With `stop_after`, the pass ends once that layer is captured (logits are None).
+        Runs in the handler's precision mode, on its compiled backend unless the
+        pass is truncated; results are always fp32.
+        """
+        if self.backend is not None and stop_after is None:
+            with self.serving_pool.checkout(), torch.no_grad(), autocast(self.precision), stage('forward'):
+                output, feature_maps = self.backend(input_tensor)
+        else:
+            with self.serving_pool.checkout() as model, ActivationCapture(stop_after=stop_after) as capture, \
+                    torch.no_grad(), autocast(self.precision), stage('forward'):
+                try:
+                    output = model(input_tensor)
+                except StopForward:
+                    output = None
+            feature_maps = capture.maps
+        if self.precision == 'bf16':
+            output = output.float() if output is not None else None
+            return output, {name: fmap.float() for name, fmap in feature_maps.items()}
+        return output, feature_maps
 
-        elif self.architecture == 'resnet50':
-            # Capture from each residual block
-            for name, layer in [('layer1', self.model.layer1),
-                               ('layer2', self.model.layer2),
-                               ('layer3', self.model.layer3),
-                               ('layer4', self.model.layer4)]:
-                hook = layer.register_forward_hook(self._get_activation(name))
-                self.hooks.append(hook)
-    
-    def _get_activation(self, name: str):
-        """Create hook function to capture activations."""
-        def hook(model, input, output):
-            self.feature_maps[name] = output.detach()
-        return hook
+    def _forward_batch(self, batch: torch.Tensor) -> List[Any]:
+        """Forward a stacked batch and split logits and activations back out per row."""
+        output, feature_maps = self._forward(batch)
+        return [
+            (output[i:i + 1], {name: fmap[i:i + 1] for name, fmap in feature_maps.items()})
+            for i in range(batch.shape[0])
+        ]
+
+    def _infer(self, input_tensor: torch.Tensor):
+        """Forward one preprocessed image, through the micro-batcher when enabled."""
+        if self.batcher is not None:
+            # The pass runs on the batcher thread; time the wait for it here
+            with stage('forward'):
+                return self.batcher.submit(input_tensor).result()
+        return self._forward(input_tensor)
     
-    def _tensor_to_base64(self, tensor: torch.Tensor) -> str:
-        """Convert a tensor to base64 encoded PNG."""
-        # Normalize to 0-255
+    def _fc_to_square(self, tensor: torch.Tensor) -> np.ndarray:
+        """Reshape a 1D activation into a zero-padded square and normalize it to uint8."""
         tensor = tensor.cpu().numpy()
-        
-        # Handle 1D tensors (FC layers) by reshaping to square-ish
-        if len(tensor.shape) == 1:
-            size = int(np.ceil(np.sqrt(tensor.shape[0])))
-            padded = np.zeros(size * size)
-            padded[:tensor.shape[0]] = tensor
-            tensor = padded.reshape(size, size)
-            
+        size = int(np.ceil(np.sqrt(tensor.shape[0])))
+        padded = np.zeros(size * size)
+        padded[:tensor.shape[0]] = tensor
+        tensor = padded.reshape(size, size)
         tensor = (tensor - tensor.min()) / (tensor.max() - tensor.min() + 1e-8)
-        tensor = (tensor * 255).astype(np.uint8)
-        
-        # Convert to PIL Image
-        img = Image.fromarray(tensor, mode='L')
-        
-        # Encode to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
-        return f"data:image/png;base64,{img_str}"
+        return (tensor * 255).astype(np.uint8)
     
-    def predict(self, data: Any) -> Dict[str, Any]:
+    def _encode_feature_maps(self, feature_maps: Dict[str, torch.Tensor], layers: Optional[List[str]] = None,
+                             options: Optional[Dict[str, Any]] = None,
+                             channels: Optional[slice] = None) -> Dict[str, Any]:
         """
-        Predict class probabilities for an input image.
+        Encode captured activations.
         
-        Args:
-            data: Dict with 'image' key containing base64 encoded image
-        
-        Returns:
-            Dict with predictions and feature maps
+        Conv layers are limited to the `channels` slice, or else to
+        'preview_channels' channels per layer (16 unless set, for performance).
+        `options` are the request fields that shape the output:
+            'transport': 'binary' packs each layer into one tensor instead of PNGs
+            'tensor_dtype': 'uint8' (default) or 'float16' for the binary transport
+            'feature_layout': 'atlas' tiles a layer's channels into a single PNG
+                              (with a 'layout' to slice it) instead of one PNG each;
+                              'stats' returns per-channel summaries of every
+                              channel ('histogram_bins', default 16) and no images
+            'channel_rank': 'mean', 'max' or 'sparsity' picks the top channels by
+                            that metric (listed best first in 'channels')
+                            instead of the first ones
         """
-        # Clear previous feature maps
-        self.feature_maps = {}
+        options = options or {}
+        transport = options.get('transport', 'png')
+        layout = options.get('feature_layout')
+        rank = options.get('channel_rank')
+        preview = int(options.get('preview_channels', PREVIEW_CHANNELS))
+        feature_data = {}
         
-        # Decode image
-        if isinstance(data, dict) and 'image' in data:
-            image_data = data['image']
-            # Remove data URL prefix if present
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
+        layer_order = [name for name in self.layer_names if name in feature_maps]
+        if layers is not None:
+            layer_order = [l for l in layer_order if l in layers]
+        
+        for layer_id in layer_order:
+            fmap = feature_maps[layer_id]
+            # Take first image from batch
+            fmap = fmap[0]
+            is_conv = len(fmap.shape) == 3 # Conv layer (C, H, W); FC layers are (N)
+            # For FC layers, we just visualize the whole vector as one "map"
+            total_channels = fmap.shape[0] if is_conv else 1
             
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        else:
-            raise ValueError("Invalid input data format")
+            if layout == 'stats':
+                feature_data[layer_id] = {
+                    'stats': channel_stats(fmap, int(options.get('histogram_bins', 16)), transport == 'binary'),
+                    'total': total_channels
+                }
+                continue
+            
+            selected = channels
+            if selected is None:
+                selected = rank_channels(fmap, preview, rank) if rank and is_conv else slice(0, preview)
+            
+            if transport == 'binary':
+                entry = {
+                    'tensor': pack_channels(fmap[selected] if is_conv else fmap, options.get('tensor_dtype', 'uint8')),
+                    'total': total_channels
+                }
+            else:
+                # Normalize all selected channels in one vectorized op
+                if is_conv:
+                    normalized = normalize_channels(fmap[selected])
+                else:
+                    normalized = self._fc_to_square(fmap)[None]
+                
+                if layout == 'atlas':
+                    entry = {**encode_atlas(normalized), 'total': total_channels}
+                else:
+                    entry = {
+                        'maps': [png_data_url(channel) for channel in normalized],
+                        'total': total_channels
+                    }
+            if isinstance(selected, torch.Tensor):
+                entry['channels'] = selected.tolist()
+            feature_data[layer_id] = entry
+        
+        return feature_data
+    
+    def _classify(self, data: Any) -> Tuple[Dict[str, Any], Dict[str, torch.Tensor]]:
+        """Forward an image and return its top-5 prediction plus the raw activations."""
+        # Decode image
+        image, digest = self._read_image(data)
         
         # Preprocess
-        input_tensor = self.transform(image).unsqueeze(0).to(self.device)
+        input_tensor = self._preprocess(image)
         
         # Forward pass
-        with torch.no_grad():
-            output = self.model(input_tensor)
-            probabilities = torch.nn.functional.softmax(output[0], dim=0)
+        output, feature_maps = self._infer(input_tensor)
+        if self.precision == 'fp32':
+            # Grad-CAM resumes from these in fp32; reduced-precision maps would skew it
+            self.activations.put(digest, feature_maps)
+        probabilities = torch.nn.functional.softmax(output[0], dim=0)
         
         # Get top 5 predictions
         top5_prob, top5_idx = torch.topk(probabilities, 5)
@@ -164,68 +460,312 @@ class VGGResNetHandler(ModelHandler):
                 'score': float(top5_prob[i].item())
             })
         
-        # Extract feature maps (limit to first 16 channels per layer for performance)
-        feature_data = {}
+        result = {
+            'top_class': predictions[0]['label'],
+            'probabilities': predictions
+        }
+        if data.get('session') and self.sessions.max_bytes > 0:
+            session_id = secrets.token_urlsafe(16)
+            self.sessions.put(session_id, feature_maps)
+            result['session'] = session_id
+            result['session_ttl'] = self.sessions.ttl
+        return result, feature_maps
+    
+    def predict(self, data: Any) -> Dict[str, Any]:
+        """
+        Predict class probabilities for an input image.
         
-        # Define layer order for VGG16 to ensure sorted output
-        layer_order = [f'conv_{i+1}' for i in range(13)] + [f'fc_{i+1}' for i in range(3)]
+        Args:
+            data: Dict with 'image' key containing base64 encoded image
         
-        for layer_id in layer_order:
-            if layer_id not in self.feature_maps:
-                continue
-                
-            fmap = self.feature_maps[layer_id]
-            # Take first image from batch
-            fmap = fmap[0]
-            
-            channels = []
-            total_channels = 0
-            
-            if len(fmap.shape) == 3: # Conv layer (C, H, W)
-                total_channels = fmap.shape[0]
-                num_channels = min(16, total_channels)
-                for i in range(num_channels):
-                    channels.append(self._tensor_to_base64(fmap[i]))
-            elif len(fmap.shape) == 1: # FC layer (N)
-                # For FC layers, we just visualize the whole vector as one "map"
-                total_channels = 1
-                channels.append(self._tensor_to_base64(fmap))
-            
-            feature_data[layer_id] = {
-                'maps': channels,
-                'total': total_channels
+        Returns:
+            Dict with predictions and feature maps
+        """
+        result, feature_maps = self._classify(data)
+        result['feature_maps'] = self._encode_feature_maps(feature_maps, options=data)
+        return result
+    
+    def predict_stream(self, data: Any):
+        """Yield the prediction, then each layer's feature maps as soon as it is encoded."""
+        result, feature_maps = self._classify(data)
+        yield 'prediction', result
+        for layer_id in [name for name in self.layer_names if name in feature_maps]:
+            yield 'layer', {
+                'layer_id': layer_id,
+                'feature_maps': self._encode_feature_maps(feature_maps, [layer_id], options=data)
             }
-        
-        return {
-            'top_class': predictions[0]['label'],
-            'probabilities': predictions,
-            'feature_maps': feature_data
-        }
     
     def get_features(self, data: Any, layer_id: Optional[str] = None) -> Dict[str, Any]:
-        """Get feature maps for a specific layer."""
-        if layer_id and layer_id in self.feature_maps:
+        """
+        Encode the feature maps of one layer (or all).
+        
+        With a 'session' from predict, reuses its activations instead of running
+        the model: 'channels' ('start:stop') picks which channels to encode, and
+        omitting `layer_id` lists the session's layers with their shapes.
+        """
+        if isinstance(data, dict) and data.get('session'):
+            return self._session_features(data['session'], layer_id, data)
+        if not (isinstance(data, dict) and 'image' in data):
+            return {"message": "Send an 'image' to compute feature maps"}
+        
+        if layer_id and layer_id not in self.layer_names:
+            raise ValueError(f"Unknown layer '{layer_id}'. Available: {', '.join(self.layer_names)}")
+        
+        input_tensor = self._preprocess(self._decode_image(data))
+        
+        if layer_id:
+            # Only run the network up to the requested layer
+            _, feature_maps = self._forward(input_tensor, stop_after=layer_id)
             return {
                 'layer_id': layer_id,
-                'feature_maps': self.feature_maps[layer_id]
+                'feature_maps': self._encode_feature_maps(feature_maps, [layer_id], options=data)
             }
-        return {'feature_maps': self.feature_maps}
+        _, feature_maps = self._infer(input_tensor)
+        return {'feature_maps': self._encode_feature_maps(feature_maps, options=data)}
+    
+    def _session_features(self, session_id: str, layer_id: Optional[str], data: Dict[str, Any]) -> Dict[str, Any]:
+        """Slice and encode channels of one layer from a stored activation session."""
+        feature_maps = self.sessions.get(session_id)
+        if feature_maps is None:
+            return {'error': f"Unknown or expired session '{session_id}'. Run predict again with 'session': true."}
+        
+        if not layer_id:
+            return {
+                'session': session_id,
+                'layers': {name: list(fmap.shape[1:]) for name, fmap in feature_maps.items()}
+            }
+        if layer_id not in feature_maps:
+            raise ValueError(f"Unknown layer '{layer_id}'. Available: {', '.join(feature_maps)}")
+        
+        fmap = feature_maps[layer_id]
+        total = fmap.shape[1] if fmap.dim() == 4 else 1
+        if data.get('channel_rank') and not data.get('channels'):
+            # Ranked selection: the indices come back with the layer's maps
+            channels, channel_range = None, None
+        else:
+            channels = parse_channel_range(data.get('channels'), total)
+            channel_range = [channels.start, channels.stop]
+        return {
+            'session': session_id,
+            'layer_id': layer_id,
+            'channels': channel_range,
+            'total': total,
+            'feature_maps': self._encode_feature_maps(feature_maps, [layer_id], options=data, channels=channels)
+        }
     
     def generate_adversarial(self, data: Any, epsilon: float = 0.01) -> Dict[str, Any]:
-        """Generate adversarial example (placeholder)."""
+        """
+        FGSM or PGD attack on the input image (see adversarial.run_attack).
+        
+        Args:
+            data: Dict with 'image' (base64) plus optional 'epsilons', 'method',
+                  'steps', 'step_size', 'early_stop', 'class_idx' and 'top_k'
+            epsilon: Perturbation budget in pixel units when 'epsilons' is absent
+        
+        Returns:
+            Dict with the clean top-k and, per epsilon, the perturbed image, its
+            top-k, whether the label flipped and the per-layer activation divergence
+        """
+        params = parse_attack_params(data, epsilon)
+        class_idx = data.get('class_idx')
+        x = self.to_pixels(self._decode_image(data)).unsqueeze(0).to(self.device)
+        
+        with self.pool.checkout() as model:
+            attack = run_attack(model, self.normalize, x, label=int(class_idx) if class_idx is not None else None,
+                                **params)
+        
+        return attack_response(attack, params, self.class_labels, int(data.get('top_k', 5)),
+                               binary=data.get('transport') == 'binary')
+    
+    def _cam_layers(self, model: torch.nn.Module) -> List[Tuple[str, torch.nn.Module]]:
+        """Grad-CAM target layers of a replica as (name, module), in forward order."""
+        if self.architecture == 'vgg16':
+            # Spatial (conv) layers only
+            return [(name, model.get_submodule(path)) for name, path in self.layers if path.startswith('features.')]
+        elif self.architecture == 'resnet50':
+            # For ResNet, use layer blocks
+            return [(name, model.get_submodule(path)) for name, path in self.layers]
+        raise ValueError(f"Grad-CAM not supported for architecture: {self.architecture}")
+    
+    def _forward_from(self, model: torch.nn.Module, layer_name: str, activation: torch.Tensor) -> torch.Tensor:
+        """Run the rest of the network on a captured Grad-CAM layer output."""
+        path = dict(self.layers)[layer_name]
+        if self.architecture == 'vgg16':
+            # Captured at (or after) the conv's in-place ReLU, so resume at the next module
+            x = model.features[int(path.split('.')[1]) + 1:](activation)
+            x = torch.flatten(model.avgpool(x), 1)
+            return model.classifier(x)
+        x = activation
+        for name, path in self.layers[self.layer_names.index(layer_name) + 1:]:
+            x = model.get_submodule(path)(x)
+        x = torch.flatten(model.avgpool(x), 1)
+        return model.fc(x)
+    
+    def _parse_cam_layers(self, requested: Any, available: List[str]) -> List[str]:
+        """Resolve a 'layers' parameter ('all', names, indices or a comma list) in forward order."""
+        if requested == 'all':
+            return list(available)
+        if isinstance(requested, str):
+            requested = [item.strip() for item in requested.split(',') if item.strip()]
+        names = set()
+        for item in requested:
+            if isinstance(item, int) or (isinstance(item, str) and item.isdigit()):
+                index = int(item)
+                if index < 0 or index >= len(available):
+                    raise ValueError(f"Layer index {index} out of range. Available: 0-{len(available)-1}")
+                names.add(available[index])
+            elif item in available:
+                names.add(item)
+            else:
+                raise ValueError(f"Unknown layer '{item}'. Available: {', '.join(available)}")
+        if not names:
+            raise ValueError("No Grad-CAM layers requested")
+        return [name for name in available if name in names]
+    
+    def _compute_cams(self, model: torch.nn.Module, x: torch.Tensor, layer_names: List[str],
+                      class_indices: Optional[List[int]], top_k: int = 1,
+                      cached: Optional[Dict[str, torch.Tensor]] = None):
+        """
+        Grad-CAM for several layers and classes from one forward and one backward pass.
+        
+        The autograd graph starts at the shallowest requested layer, whose
+        output becomes a leaf. With several classes the per-class gradients
+        come from a single batched autograd call (one vmapped backward) rather
+        than one backward per class. Only the forward pass is shared: the
+        backward below the deepest requested layer still costs about one pass
+        per class. On CPU, k=5 costs about the same as one class when
+        explaining the deepest layer (VGG16 conv_13, ResNet50 layer4), and
+        about 3x when explaining the shallowest (conv_1, layer1).
+        
+        If `cached` holds the shallowest requested layer's activation (from a
+        previous predict on the same image), the forward pass resumes from it
+        instead of starting at the input.
+        
+        Returns:
+            Tuple of ({layer_name: [K, 224, 224] heatmaps in [0, 1]}, class_indices, logits, reused)
+        """
+        start = layer_names[0] if cached is not None and layer_names[0] in cached else None
+        
+        with ActivationCapture(detach=False) as capture, torch.enable_grad(), stage('forward'):
+            if start is not None:
+                leaf = cached[start].to(self.device).clone().requires_grad_(True)
+                capture.record(start, leaf)
+                output = self._forward_from(model, start, leaf)
+            else:
+                # Parameters are frozen at load time, so nothing before the leaf is recorded
+                module = model.get_submodule(dict(self.layers)[layer_names[0]])
+                handle = module.register_forward_hook(self._leaf_hook(layer_names[0]))
+                try:
+                    output = model(x)
+                finally:
+                    handle.remove()
+        
+        # Determine target classes
+        if class_indices is None:
+            class_indices = output[0].topk(top_k).indices.tolist()
+        scores = output[0, class_indices]  # [K]
+        
+        activations = [capture.maps[name] for name in layer_names]
+        with stage('backward'):
+            if len(class_indices) == 1:
+                gradients = [g.unsqueeze(0) for g in torch.autograd.grad(scores[0], activations)]
+            else:
+                gradients = self._batched_gradients(scores, activations)
+        
+        cams = {}
+        for name, A, G in zip(layer_names, activations, gradients):
+            A = A.detach()
+            if self.architecture == 'vgg16':
+                # Gradient w.r.t. the pre-ReLU conv output, as a hook on the conv sees it
+                G = G * (A > 0)
+            cams[name] = self._grad_cam(A, G)
+        return cams, class_indices, output.detach(), start is not None
+    
+    @staticmethod
+    def _leaf_hook(name: str):
+        """Forward hook that records the layer's output as a gradient leaf and continues from it."""
+        def hook(module, inputs, output):
+            leaf = output.detach().requires_grad_(True)
+            ActivationCapture._current.get().record(name, leaf)
+            return leaf
+        return hook
+    
+    def _batched_gradients(self, scores: torch.Tensor, activations: List[torch.Tensor]) -> List[torch.Tensor]:
+        """Gradients of each of K scores w.r.t. every activation, as [K, *activation.shape]."""
+        k = scores.shape[0]
+        one_hot = torch.eye(k, device=scores.device, dtype=scores.dtype)
+        return list(torch.autograd.grad(scores, activations, grad_outputs=one_hot, is_grads_batched=True))
+    
+    def _grad_cam(self, A: torch.Tensor, G: torch.Tensor) -> np.ndarray:
+        """
+        Combine activations [1, C, H, W] and per-class gradients [K, 1, C, H, W]
+        into K normalized 224x224 heatmaps.
+        """
+        # Global average pooling of gradients
+        alpha = G.mean(dim=(-2, -1), keepdim=True)  # [K, 1, C, 1, 1]
+        
+        # Weighted combination
+        cam = (alpha * A).sum(dim=2)  # [K, 1, H, W]
+        cam = F.relu(cam)  # Apply ReLU
+        
+        # Resize to input size (224x224)
+        cam = F.interpolate(cam, size=(224, 224), mode='bilinear', align_corners=False)
+        cam = cam[:, 0].cpu().numpy()
+        
+        # Normalize each heatmap to [0, 1]
+        cam_min = cam.min(axis=(1, 2), keepdims=True)
+        cam_max = cam.max(axis=(1, 2), keepdims=True)
+        span = cam_max - cam_min
+        # If all values are the same, create a uniform heatmap
+        return np.where(span < 1e-8, 0.5, (cam - cam_min) / np.maximum(span, 1e-8)).astype(cam.dtype)
+    
+    def _heatmap_to_base64(self, cam: np.ndarray) -> str:
+        """Colorize a [0, 1] heatmap and encode it as a PNG data URL."""
+        return png_data_url(apply_jet_colormap(cam))
+    
+    def _multi_class_response(self, cams: Dict[str, np.ndarray], class_indices: List[int], logits: torch.Tensor,
+                              layer_names: List[str], available_layers: List[str], reused: bool,
+                              transport: str = 'png') -> Dict[str, Any]:
+        """Pack [layers, classes, 224, 224] heatmaps into one uint8 array."""
+        probabilities = torch.softmax(logits[0], dim=0)
+        stacked = np.stack([cams[name] for name in layer_names])
+        if transport == 'binary':
+            heatmaps = pack_unit_interval(stacked)
+        else:
+            packed = np.round(stacked * 255).astype(np.uint8)
+            heatmaps = {
+                'shape': list(packed.shape),
+                'dtype': 'uint8',
+                'scale': 1 / 255,
+                'data': base64.b64encode(packed.tobytes()).decode(),
+            }
         return {
-            'message': 'Adversarial generation not yet implemented'
+            'classes': [{
+                'class_idx': idx,
+                'class_label': self.class_labels[idx],
+                'score': float(probabilities[idx].item()),
+            } for idx in class_indices],
+            'layer_names': layer_names,
+            'available_layers': available_layers,
+            'heatmaps': heatmaps,
+            'reused_activations': reused,
         }
     
     def get_gradcam(self, data: Any) -> Dict[str, Any]:
         """
-        Generate Grad-CAM visualization for a specific layer.
+        Generate Grad-CAM visualization for one or more layers.
         
         Args:
-            data: Dict with 'image' (base64), 'layer_index' (int), and optional 'class_idx' (int)
+            data: Dict with 'image' (base64), 'layer_index' (int), and optional 'class_idx' (int).
+                  'layers' ('all', or a list of names/indices) switches to multi-layer mode:
+                  every listed layer comes from the same forward and backward pass.
+                  'top_k' (int) or 'class_indices' (list) explain several classes at once.
         
         Returns:
-            Dict with 'heatmap' (base64), 'class_idx', 'layer_name', 'available_layers'
+            Dict with 'heatmap' (base64), 'class_idx', 'layer_name', 'available_layers';
+            in multi-layer mode, 'layers' holds one such heatmap entry per layer.
+            In multi-class mode, 'heatmaps' is a packed uint8 [layers, classes, 224, 224]
+            array (base64) alongside 'classes' and 'layer_names'.
         """
         try:
             # Get parameters
@@ -235,180 +775,74 @@ class VGGResNetHandler(ModelHandler):
             class_idx = data.get('class_idx', None)
             if class_idx is not None and isinstance(class_idx, str):
                 class_idx = int(class_idx)
+            requested_layers = data.get('layers')
+            transport = data.get('transport', 'png')
+            top_k = int(data.get('top_k') or 0)
+            class_indices = data.get('class_indices')
+            if isinstance(class_indices, str):
+                class_indices = [int(c) for c in class_indices.split(',') if c.strip()]
+            elif class_indices is not None:
+                class_indices = [int(c) for c in class_indices]
+            multi_class = bool(top_k) or class_indices is not None
+            if top_k < 0 or top_k > len(self.class_labels):
+                raise ValueError(f"top_k must be between 1 and {len(self.class_labels)}")
+            if not multi_class:
+                class_indices = [class_idx] if class_idx is not None else None
             
             # Decode image
-            if isinstance(data, dict) and 'image' in data:
-                image_data = data['image']
-                if ',' in image_data:
-                    image_data = image_data.split(',')[1]
-                try:
-                    image_bytes = base64.b64decode(image_data)
-                    img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-                except Exception as e:
-                    raise ValueError(f"Failed to decode image: {str(e)}")
-            else:
-                raise ValueError("Invalid input data format: 'image' field is required")
-            
-            # Get available conv layer indices
-            if self.architecture == 'vgg16':
-                conv_indices = [0, 2, 5, 7, 10, 12, 14, 17, 19, 21, 24, 26, 28]
-                if layer_index < 0 or layer_index >= len(conv_indices):
-                    raise ValueError(f"Layer index {layer_index} out of range. Available: 0-{len(conv_indices)-1}")
-                target_layer_index = conv_indices[layer_index]
-                target_layer = self.model.features[target_layer_index]
-                layer_name = f'conv_{layer_index + 1}'
-                available_layers = [f'conv_{i+1}' for i in range(len(conv_indices))]
-            elif self.architecture == 'resnet50':
-                # For ResNet, use layer blocks
-                layer_blocks = [self.model.layer1, self.model.layer2, self.model.layer3, self.model.layer4]
-                if layer_index < 0 or layer_index >= len(layer_blocks):
-                    raise ValueError(f"Layer index {layer_index} out of range. Available: 0-{len(layer_blocks)-1}")
-                target_layer = layer_blocks[layer_index]
-                layer_name = f'layer{layer_index + 1}'
-                available_layers = [f'layer{i+1}' for i in range(len(layer_blocks))]
-            else:
-                raise ValueError(f"Grad-CAM not supported for architecture: {self.architecture}")
+            img, digest = self._read_image(data)
+            x = self._preprocess(img)
             
-            # Storage for activations and gradients
-            activations = {}
-            gradients = {}
+            # Hold one replica for the whole forward/backward
+            with self.pool.checkout() as model:
+                available_layers = [name for name, _ in self._cam_layers(model)]
+                if requested_layers is None:
+                    if layer_index < 0 or layer_index >= len(available_layers):
+                        raise ValueError(f"Layer index {layer_index} out of range. Available: 0-{len(available_layers)-1}")
+                    layer_names = [available_layers[layer_index]]
+                else:
+                    layer_names = self._parse_cam_layers(requested_layers, available_layers)
+                
+                cams, class_indices, logits, reused = self._compute_cams(
+                    model, x, layer_names, class_indices, top_k=top_k or 1,
+                    cached=self.activations.get(digest)
+                )
             
-            def forward_hook(module, inp, out):
-                # Store activation and register backward hook on it
-                activations['value'] = out
-                # Register hook on the output tensor to capture gradients
-                out.register_hook(lambda grad: gradients.update({'value': grad}))
+            if multi_class:
+                return self._multi_class_response(cams, class_indices, logits, layer_names, available_layers, reused,
+                                                  transport)
             
-            # Register forward hook (backward hook is registered on the tensor in forward_hook)
-            h1 = target_layer.register_forward_hook(forward_hook)
-            h2 = None  # No separate backward hook needed
+            class_idx = class_indices[0]
+            cams = {name: cam[0] for name, cam in cams.items()}
+            if transport == 'binary':
+                # Clients colorize the raw heatmap themselves; no PNG needed
+                entries = [{
+                    'layer_name': name,
+                    'layer_index': available_layers.index(name),
+                    'heatmap_data': pack_unit_interval(cams[name]),
+                } for name in layer_names]
+            else:
+                entries = [{
+                    'heatmap': self._heatmap_to_base64(cams[name]),
+                    'layer_name': name,
+                    'layer_index': available_layers.index(name),
+                    'heatmap_data': cams[name].tolist()  # Raw heatmap data for 3D visualization
+                } for name in layer_names]
             
-            try:
-                # Ensure model is in eval mode but allows gradients
-                self.model.eval()
-                for param in self.model.parameters():
-                    param.requires_grad = False  # Don't update model weights
-                
-                # Preprocess image
-                x = self.transform(img).unsqueeze(0).to(self.device)
-                x.requires_grad_(True)
-                
-                # Forward pass
-                output = self.model(x)
-                
-                # Determine target class
-                if class_idx is None:
-                    score, idx = output.max(1)
-                    class_idx = int(idx.item())
-                else:
-                    score = output[0, class_idx]
-                
-                # Get activations
-                if 'value' not in activations:
-                    raise ValueError("Forward hook did not capture activations")
-                
-                A = activations['value']  # [1, C, H, W]
-                
-                # Backward pass
-                self.model.zero_grad()
-                score.backward(retain_graph=False)
-                
-                # Check if gradients were captured
-                if 'value' not in gradients:
-                    raise ValueError(f"Gradient hook failed. Input grad exists: {x.grad is not None}, Activations shape: {A.shape}")
-                
-                G = gradients['value']    # [1, C, H, W]
-                
-                # Ensure G has the same shape as A (handle potential dimension mismatches)
-                if G.shape != A.shape:
-                    print(f"Warning: Gradient shape {G.shape} != Activation shape {A.shape}, attempting to match...")
-                    if len(G.shape) == len(A.shape):
-                        # Try to match by interpolation if dimensions are close
-                        if G.shape[2:] != A.shape[2:]:
-                            G = F.interpolate(G, size=A.shape[2:], mode='bilinear', align_corners=False)
-                    else:
-                        raise ValueError(f"Cannot match gradient shape {G.shape} to activation shape {A.shape}")
-                
-                # Compute Grad-CAM
-                # Global average pooling of gradients
-                alpha = G.mean(dim=(2, 3), keepdim=True)  # [1, C, 1, 1]
-                
-                # Weighted combination
-                cam = (alpha * A).sum(dim=1, keepdim=True)  # [1, 1, H, W]
-                cam = F.relu(cam)  # Apply ReLU
-                
-                # Resize to input size (224x224)
-                cam = F.interpolate(cam, size=(224, 224), mode='bilinear', align_corners=False)
-                cam = cam.squeeze().detach().cpu().numpy()
-                
-                # Normalize to [0, 1]
-                cam_min = cam.min()
-                cam_max = cam.max()
-                if cam_max - cam_min < 1e-8:
-                    # If all values are the same, create a uniform heatmap
-                    cam = np.ones_like(cam) * 0.5
-                else:
-                    cam = (cam - cam_min) / (cam_max - cam_min)
-                
-                # Convert to base64 heatmap image (colormap: jet-like)
-                # Simple jet-like colormap: blue -> cyan -> green -> yellow -> red
-                def apply_jet_colormap(data):
-                    """Apply jet-like colormap without matplotlib."""
-                    data = np.clip(data, 0, 1)
-                    h, w = data.shape
-                    rgb = np.zeros((h, w, 3), dtype=np.uint8)
-                    
-                    # Blue to cyan (0 -> 0.25)
-                    mask1 = data < 0.25
-                    rgb[mask1, 0] = 0
-                    rgb[mask1, 1] = (data[mask1] * 4 * 255).astype(np.uint8)
-                    rgb[mask1, 2] = 255
-                    
-                    # Cyan to green (0.25 -> 0.5)
-                    mask2 = (data >= 0.25) & (data < 0.5)
-                    rgb[mask2, 0] = 0
-                    rgb[mask2, 1] = 255
-                    rgb[mask2, 2] = ((1 - (data[mask2] - 0.25) * 4) * 255).astype(np.uint8)
-                    
-                    # Green to yellow (0.5 -> 0.75)
-                    mask3 = (data >= 0.5) & (data < 0.75)
-                    rgb[mask3, 0] = ((data[mask3] - 0.5) * 4 * 255).astype(np.uint8)
-                    rgb[mask3, 1] = 255
-                    rgb[mask3, 2] = 0
-                    
-                    # Yellow to red (0.75 -> 1.0)
-                    mask4 = data >= 0.75
-                    rgb[mask4, 0] = 255
-                    rgb[mask4, 1] = ((1 - (data[mask4] - 0.75) * 4) * 255).astype(np.uint8)
-                    rgb[mask4, 2] = 0
-                    
-                    return rgb
-                
-                cam_colored = apply_jet_colormap(cam)
-                
-                # Convert to PIL Image
-                heatmap_img = Image.fromarray(cam_colored, 'RGB')
-                
-                # Encode to base64
-                buffer = io.BytesIO()
-                heatmap_img.save(buffer, format='PNG')
-                heatmap_str = base64.b64encode(buffer.getvalue()).decode()
-                
+            if requested_layers is None:
                 return {
-                    'heatmap': f"data:image/png;base64,{heatmap_str}",
+                    **entries[0],
                     'class_idx': class_idx,
                     'class_label': self.class_labels[class_idx],
-                    'layer_name': layer_name,
-                    'layer_index': layer_index,
                     'available_layers': available_layers,
-                    'heatmap_data': cam.tolist()  # Raw heatmap data for 3D visualization
                 }
-            
-            finally:
-                # Remove hooks
-                if h1 is not None:
-                    h1.remove()
-                # Note: Tensor hooks are automatically removed when the tensor is garbage collected
+            return {
+                'class_idx': class_idx,
+                'class_label': self.class_labels[class_idx],
+                'available_layers': available_layers,
+                'layers': entries,
+                'reused_activations': reused,
+            }
         
         except Exception as e:
             import traceback
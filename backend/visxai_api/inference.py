@@ -0,0 +1,188 @@
+import copy
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+import torch
+import torch.nn as nn
+
+from .timing import stage
+
+
+class StopForward(Exception):
+    """Raised from a hook to end a forward pass once the needed layers are captured."""
+
+
+class ActivationCapture:
+    """
+    Request-scoped store for activations written by forward hooks.
+
+    Hooks are registered once per model and look up the capture that is active
+    in the calling thread (or task), so concurrent requests never see each
+    other's feature maps:
+
+        with ActivationCapture() as capture:
+            model(x)
+        capture.maps  # {'conv_1': tensor, ...}
+
+    With `stop_after`, recording that layer raises StopForward, so the rest of
+    the network is skipped:
+
+        with ActivationCapture(stop_after='conv_3') as capture:
+            try:
+                model(x)
+            except StopForward:
+                pass
+    """
+    _current: ContextVar[Optional["ActivationCapture"]] = ContextVar("visxai_activation_capture", default=None)
+
+    def __init__(self, detach: bool = True, stop_after: Optional[str] = None):
+        self.detach = detach
+        self.stop_after = stop_after
+        self.maps: Dict[str, torch.Tensor] = {}
+        self._token = None
+
+    def __enter__(self) -> "ActivationCapture":
+        self._token = self._current.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        self._current.reset(self._token)
+
+    def record(self, name: str, output: torch.Tensor):
+        self.maps[name] = output.detach() if self.detach else output
+        if name == self.stop_after:
+            raise StopForward(name)
+
+    @classmethod
+    def hook(cls, name: str):
+        """Create a forward hook that records `name` into the active capture, if any."""
+        def hook(module, input, output):
+            capture = cls._current.get()
+            if capture is not None:
+                with stage('hook_capture'):
+                    capture.record(name, output)
+        return hook
+
+
+def replicate_module(model: nn.Module) -> nn.Module:
+    """
+    Copy a module tree while sharing its parameter and buffer storage.
+
+    The replica has its own module objects (and hook dicts) but no extra
+    weight memory, so it is only safe for inference-style use where nothing
+    writes to the weights in place.
+    """
+    memo = {id(t): t for t in itertools.chain(model.parameters(), model.buffers())}
+    return copy.deepcopy(model, memo)
+
+
+class ReplicaPool:
+    """
+    Fixed pool of model replicas with checkout/checkin.
+
+    Each in-flight request holds one replica exclusively, which bounds the
+    number of concurrent forward passes per model to the pool size.
+    """
+
+    def __init__(self, model: nn.Module, size: int = 1):
+        self.size = max(1, int(size))
+        self.replicas: List[nn.Module] = [model] + [replicate_module(model) for _ in range(self.size - 1)]
+        self._free: "queue.Queue[nn.Module]" = queue.Queue()
+        for replica in self.replicas:
+            self._free.put(replica)
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None) -> Iterator[nn.Module]:
+        """Borrow a replica for the duration of the block (blocks while all are busy)."""
+        try:
+            replica = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No model replica became free within {timeout}s")
+        try:
+            yield replica
+        finally:
+            self._free.put(replica)
+
+    def available(self) -> int:
+        """Number of replicas currently idle."""
+        return self._free.qsize()
+
+    def __iter__(self):
+        return iter(self.replicas)
+
+    def __len__(self):
+        return self.size
+
+
+class ActivationStore:
+    """
+    Bounded LRU of detached activations, keyed by input digest or session id.
+
+    Lets a follow-up request on the same image (e.g. Grad-CAM after predict)
+    start from activations that were already computed. With a `ttl`, entries
+    also expire after that many seconds without being read.
+    """
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (maps, nbytes, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _own_storage(tensor: torch.Tensor) -> torch.Tensor:
+        # Rows split out of a micro-batch are views that would pin the whole batch.
+        if tensor.untyped_storage().nbytes() > tensor.numel() * tensor.element_size():
+            return tensor.clone()
+        return tensor
+
+    def _expires_at(self) -> float:
+        return time.monotonic() + self.ttl if self.ttl else float('inf')
+
+    def _expire(self):
+        # Every access refreshes the expiry and moves the entry to the end, so
+        # LRU order is also expiry order and expired entries are at the front.
+        now = time.monotonic()
+        while self._entries:
+            key, (_, nbytes, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now:
+                return
+            del self._entries[key]
+            self._bytes -= nbytes
+
+    def put(self, key: str, maps: Dict[str, torch.Tensor]):
+        if not key or self.max_bytes <= 0:
+            return
+        maps = {name: self._own_storage(t.detach()) for name, t in maps.items()}
+        nbytes = sum(t.numel() * t.element_size() for t in maps.values())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (maps, nbytes, self._expires_at())
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def get(self, key: Optional[str]) -> Optional[Dict[str, torch.Tensor]]:
+        if not key:
+            return None
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            maps, nbytes, _ = entry
+            self._entries[key] = (maps, nbytes, self._expires_at())
+            self._entries.move_to_end(key)
+            return maps
@@ -0,0 +1,113 @@
+"""
+Kernel-evolution snapshots: one memory-mapped array per training run.
+
+A run directory holds
+
+    kernels.npy   float32 [capacity, row_size]; row i = every layer's kernels at the i-th snapshot
+    index.json    {"layers": {name: {"shape": [...], "offset": int}}, "epochs": [...], "row_size": int}
+
+Rows are written before the index that makes them visible, and the index is
+replaced atomically, so readers never see a partially written epoch. When
+the file is full it is rewritten with twice the capacity.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+DATA_FILE = 'kernels.npy'
+
+
+class KernelStore:
+    """Append-only, epoch-indexed kernel snapshots of one training run."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.index = json.load(f)
+
+    @classmethod
+    def create(cls, path: str, shapes: Dict[str, Tuple[int, ...]], capacity: int = 16) -> "KernelStore":
+        """Start a run with the given per-layer kernel shapes."""
+        os.makedirs(path, exist_ok=True)
+        layers, offset = {}, 0
+        for name, shape in shapes.items():
+            layers[name] = {'shape': list(shape), 'offset': offset}
+            offset += int(np.prod(shape))
+        np.lib.format.open_memmap(os.path.join(path, DATA_FILE), mode='w+', dtype=np.float32,
+                                  shape=(capacity, offset)).flush()
+        cls._write_index(path, {'layers': layers, 'epochs': [], 'row_size': offset, 'created': time.time()})
+        return cls(path)
+
+    @classmethod
+    def open_or_create(cls, path: str, shapes: Dict[str, Tuple[int, ...]]) -> "KernelStore":
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            return cls(path)
+        return cls.create(path, shapes)
+
+    @staticmethod
+    def _write_index(path: str, index: Dict):
+        tmp_path = os.path.join(path, f"{INDEX_FILE}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(path, INDEX_FILE))
+
+    @property
+    def epochs(self) -> List[int]:
+        return list(self.index['epochs'])
+
+    @property
+    def layers(self) -> List[str]:
+        return list(self.index['layers'])
+
+    def append(self, epoch: int, kernels: Dict[str, np.ndarray]):
+        """Record every layer's kernels after `epoch` (re-recording an epoch overwrites it)."""
+        with self._lock:
+            epochs = self.index['epochs']
+            row = epochs.index(epoch) if epoch in epochs else len(epochs)
+            data_path = os.path.join(self.path, DATA_FILE)
+            data = np.load(data_path, mmap_mode='r+')
+            if row >= data.shape[0]:
+                grown_path = f"{data_path}.tmp"
+                grown = np.lib.format.open_memmap(grown_path, mode='w+', dtype=np.float32,
+                                                  shape=(data.shape[0] * 2, data.shape[1]))
+                grown[:data.shape[0]] = data
+                grown.flush()
+                del data, grown
+                os.replace(grown_path, data_path)
+                data = np.load(data_path, mmap_mode='r+')
+            for name, layer in self.index['layers'].items():
+                size = int(np.prod(layer['shape']))
+                data[row, layer['offset']:layer['offset'] + size] = np.asarray(kernels[name], np.float32).reshape(-1)
+            data.flush()
+            del data
+            # Publish on disk first: if the index write fails, this process
+            # keeps reporting only the epochs that are on disk
+            index = {**self.index, 'epochs': epochs + [epoch] if row == len(epochs) else list(epochs)}
+            self._write_index(self.path, index)
+            self.index = index
+
+    def read(self, layer: str, first: Optional[int] = None, last: Optional[int] = None) -> Tuple[List[int], np.ndarray]:
+        """Epochs in [first, last] (inclusive) and their kernels as [E, *shape]."""
+        if layer not in self.index['layers']:
+            raise ValueError(f"Unknown layer '{layer}'. Available: {', '.join(self.layers)}")
+        info = self.index['layers'][layer]
+        rows = [(i, e) for i, e in enumerate(self.index['epochs'])
+                if (first is None or e >= first) and (last is None or e <= last)]
+        data = np.load(os.path.join(self.path, DATA_FILE), mmap_mode='r')
+        size = int(np.prod(info['shape']))
+        kernels = data[[i for i, _ in rows], info['offset']:info['offset'] + size]
+        return [e for _, e in rows], kernels.reshape(len(rows), *info['shape'])
+
+
+def list_runs(root: str) -> List[str]:
+    """Run names under `root`, oldest first."""
+    if not os.path.isdir(root):
+        return []
+    runs = [name for name in os.listdir(root) if os.path.exists(os.path.join(root, name, INDEX_FILE))]
+    return sorted(runs, key=lambda name: os.path.getmtime(os.path.join(root, name, INDEX_FILE)))
@@ -0,0 +1,112 @@
+import base64
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from django.core.management.base import BaseCommand
+
+
+def make_request(model_name: str) -> dict:
+    """Build a deterministic request payload so runs are comparable offline."""
+    rng = np.random.default_rng(0)
+    if model_name == 'mnist':
+        return {'pixels': rng.random(784).tolist()}
+    pixels = rng.integers(0, 256, size=(320, 480, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, mode='RGB').save(buffer, format='PNG')
+    return {'image': 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()}
+
+
+def build_handler(model_name: str, replicas: int, pretrained: bool, batching: dict = None):
+    if model_name == 'mnist':
+        from visxai_api.handlers.mnist_handler import MNISTHandler
+        return MNISTHandler(replicas=replicas)
+    from visxai_api.handlers.vgg_resnet_handler import VGGResNetHandler
+    return VGGResNetHandler(model_name, replicas=replicas, pretrained=pretrained, batching=batching)
+
+
+class Command(BaseCommand):
+    help = 'Measures predict/features/gradcam throughput of a model handler for several replica counts and batching windows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default='vgg16', choices=['vgg16', 'resnet50', 'mnist'])
+        parser.add_argument('--action', default='predict', choices=['predict', 'features', 'gradcam'])
+        parser.add_argument('--layer', default=None, help='Layer for the features action (default: all)')
+        parser.add_argument('--top-k', type=int, default=0, help='Grad-CAM classes per request (0 = single class)')
+        parser.add_argument('--feature-layout', default='channels', choices=['channels', 'atlas'],
+                            help='PNG per channel, or one sprite atlas per layer')
+        parser.add_argument('--replicas', type=int, nargs='+', default=[1, 2, 4])
+        parser.add_argument('--requests', type=int, default=32, help='Requests per replica count')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Concurrent clients (default: one per replica)')
+        parser.add_argument('--max-batch-size', type=int, default=0, help='Enable micro-batching (0 = off)')
+        parser.add_argument('--max-wait-ms', type=float, default=5.0, help='Micro-batching window')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Torch intra-op threads (default: CPU count / replicas)')
+        parser.add_argument('--untrained', action='store_true', help='Use random weights (no download)')
+
+    def handle(self, *args, **options):
+        model_name = options['model']
+        payload = make_request(model_name)
+        if options['top_k']:
+            payload['top_k'] = options['top_k']
+        if options['feature_layout'] == 'atlas':
+            payload['feature_layout'] = 'atlas'
+        cpus = os.cpu_count() or 1
+
+        batching = None
+        if options['max_batch_size'] and model_name != 'mnist':
+            batching = {'max_batch_size': options['max_batch_size'], 'max_wait_ms': options['max_wait_ms']}
+
+        self.stdout.write(f"{'replicas':>8} {'clients':>7} {'threads':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'enc %':>6}")
+        for replicas in options['replicas']:
+            threads = options['threads'] or max(1, cpus // replicas)
+            torch.set_num_threads(threads)
+
+            clients = options['concurrency'] or replicas
+            handler = build_handler(model_name, replicas, pretrained=not options['untrained'], batching=batching)
+            handler.warmup()
+
+            run = {
+                'predict': handler.predict,
+                'features': lambda data: handler.get_features(data, options['layer']),
+                'gradcam': handler.get_gradcam,
+            }[options['action']]
+            encode_seconds = self._time_encoding(handler)
+
+            def timed_call(_):
+                start = time.perf_counter()
+                run(payload)
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                latencies = list(pool.map(timed_call, range(options['requests'])))
+            elapsed = time.perf_counter() - start
+            handler.close()
+
+            p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+            encode_share = 100 * sum(encode_seconds) / sum(latencies)
+            self.stdout.write(
+                f"{replicas:>8} {clients:>7} {threads:>7} {options['requests'] / elapsed:>8.2f} {p50:>8.1f} {p95:>8.1f}"
+                f" {encode_share:>6.1f}"
+            )
+
+    @staticmethod
+    def _time_encoding(handler) -> list:
+        """Wrap the handler's feature-map encoder to record how long each call takes."""
+        seconds = []
+        encode = handler._encode_feature_maps
+
+        def timed_encode(*args, **kwargs):
+            start = time.perf_counter()
+            result = encode(*args, **kwargs)
+            seconds.append(time.perf_counter() - start)
+            return result
+
+        handler._encode_feature_maps = timed_encode
+        return seconds
@@ -0,0 +1,275 @@
+import base64
+import io
+import json
+import os
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import torch
+from PIL import Image
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from visxai_api.timing import STAGES, StageTimer, stage
+from visxai_api.management.commands.benchmark_models import build_handler, make_request
+
+MODELS = ('mnist', 'vgg16', 'resnet50')
+ACTIONS = ('predict', 'features', 'gradcam', 'train')
+# Actions each handler implements; the rest are skipped
+SUPPORTED = {
+    'mnist': ('predict', 'train'),
+    'vgg16': ('predict', 'features', 'gradcam'),
+    'resnet50': ('predict', 'features', 'gradcam'),
+}
+RESULTS_VERSION = 1
+
+
+def fixture_request(model_name: str, image_path: str = None) -> dict:
+    """The request payload for a model: a local image file, or the deterministic synthetic one."""
+    if not image_path:
+        return make_request(model_name)
+    image = Image.open(image_path)
+    if model_name == 'mnist':
+        pixels = np.asarray(image.convert('L').resize((28, 28), Image.BILINEAR), dtype=np.float32) / 255
+        return {'pixels': pixels.reshape(-1).tolist()}
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='PNG')
+    return {'image': 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()}
+
+
+def summarize(latencies, stage_seconds, elapsed) -> dict:
+    """Latency percentiles, throughput and per-stage means (all per request, in ms) for one run."""
+    latencies_ms = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(latencies_ms, [50, 90, 99])
+    stages = {}
+    for name in sorted({name for seconds in stage_seconds for name in seconds},
+                       key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES)):
+        per_request = np.array([seconds.get(name, 0.0) for seconds in stage_seconds]) * 1000
+        stages[name] = {'mean_ms': float(per_request.mean()), 'p50_ms': float(np.percentile(per_request, 50))}
+    return {
+        'requests': len(latencies),
+        'throughput_rps': len(latencies) / elapsed,
+        'latency_ms': {'mean': float(latencies_ms.mean()), 'min': float(latencies_ms.min()), 'p50': float(p50),
+                       'p90': float(p90), 'p99': float(p99), 'max': float(latencies_ms.max())},
+        'stages': stages,
+    }
+
+
+def compare_results(current: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    """
+    Rows of (key, metric, baseline, current, relative change, regressed) for runs in both files.
+
+    A metric regresses when it is worse by more than `threshold` (relative)
+    and, for times, by more than `min_delta_ms`, so sub-millisecond stages
+    do not flag on noise.
+    """
+    previous = {(r['model'], r['action'], r['concurrency']): r for r in baseline['results']}
+    rows = []
+    for run in current['results']:
+        key = (run['model'], run['action'], run['concurrency'])
+        if key not in previous:
+            continue
+        old = previous[key]
+        metrics = [
+            ('throughput_rps', old['throughput_rps'], run['throughput_rps'], False),
+            ('p50_ms', old['latency_ms']['p50'], run['latency_ms']['p50'], True),
+            ('p99_ms', old['latency_ms']['p99'], run['latency_ms']['p99'], True),
+        ]
+        metrics += [(f"{name}_ms", old['stages'][name]['mean_ms'], values['mean_ms'], True)
+                    for name, values in run['stages'].items() if name in old['stages']]
+        for metric, before, after, lower_is_better in metrics:
+            if before <= 0:
+                continue
+            change = (after - before) / before
+            worse = change > threshold if lower_is_better else -change > threshold
+            if lower_is_better and after - before <= min_delta_ms:
+                worse = False
+            rows.append(('/'.join(map(str, key)), metric, before, after, change, worse))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks every model action (predict, features, gradcam, train) at several concurrency levels, '
+            'timing each pipeline stage, and writes the results as JSON; --compare flags regressions '
+            'against a stored baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', default=','.join(MODELS), help=f"Comma-separated (default: {','.join(MODELS)})")
+        parser.add_argument('--actions', default=','.join(ACTIONS),
+                            help=f"Comma-separated, run in this order (default: {','.join(ACTIONS)}); "
+                                 "gradcam after predict reuses its cached activations, as in the UI")
+        parser.add_argument('--concurrency', default='1,2,4', help='Comma-separated client counts')
+        parser.add_argument('--requests', type=int, default=16, help='Timed requests per concurrency level')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests before each action')
+        parser.add_argument('--replicas', type=int, default=None,
+                            help='Model replicas (default: the highest concurrency level)')
+        parser.add_argument('--threads', type=int, default=None, help='Torch intra-op threads')
+        parser.add_argument('--image', default=None,
+                            help='Fixture image file (default: a deterministic synthetic image)')
+        parser.add_argument('--random-weights', action='store_true', help='Skip pretrained weights (no download)')
+        parser.add_argument('--train-steps', type=int, default=20, help='Optimizer steps per train request')
+        parser.add_argument('--train-batch-size', type=int, default=64)
+        parser.add_argument('--output', default='benchmark_results.json', help='Results file')
+        parser.add_argument('--compare', default=None, help='Baseline results file to check against')
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Relative slowdown that counts as a regression (default: 0.10)')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Ignore time regressions smaller than this (default: 1.0)')
+
+    def handle(self, *args, **options):
+        models = self._parse_list(options['models'], MODELS, 'models')
+        actions = self._parse_list(options['actions'], ACTIONS, 'actions')
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',') if level]
+        except ValueError:
+            raise CommandError('--concurrency must be comma-separated integers')
+        if not levels or min(levels) < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency levels and --requests must be at least 1')
+        if options['threads']:
+            torch.set_num_threads(options['threads'])
+        replicas = options['replicas'] or max(levels)
+
+        report = {
+            'version': RESULTS_VERSION,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(),
+                'torch': torch.__version__,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'threads': torch.get_num_threads(),
+            },
+            'config': {key: options[key] for key in (
+                'requests', 'warmup', 'image', 'random_weights', 'train_steps', 'train_batch_size')},
+            'results': [],
+        }
+        report['config'].update(replicas=replicas, concurrency=levels)
+
+        self.stdout.write(f"{'model':<9}{'action':<9}{'clients':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}  stages (mean ms)")
+        for model_name in models:
+            torch.manual_seed(0)  # identical random weights across runs with --random-weights
+            handler = build_handler(model_name, replicas, pretrained=not options['random_weights'])
+            handler.warmup()
+            try:
+                for action in actions:
+                    if action not in SUPPORTED[model_name]:
+                        continue
+                    run, payload = self._action(handler, model_name, action, options)
+                    for _ in range(options['warmup']):
+                        self._timed(run, payload)
+                    for clients in levels:
+                        result = self._measure(run, payload, clients, options['requests'])
+                        result.update(model=model_name, action=action, concurrency=clients)
+                        if action == 'train':
+                            result['train_steps_per_s'] = result['throughput_rps'] * options['train_steps']
+                        report['results'].append(result)
+                        self._print_run(result)
+            finally:
+                handler.close()
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            self._compare(report, options)
+
+    @staticmethod
+    def _parse_list(value, choices, name):
+        items = [item for item in value.split(',') if item]
+        unknown = [item for item in items if item not in choices]
+        if unknown:
+            raise CommandError(f"Unknown {name}: {', '.join(unknown)}. Available: {', '.join(choices)}")
+        return items
+
+    def _action(self, handler, model_name, action, options):
+        """The callable and payload for one action on `handler`."""
+        payload = fixture_request(model_name, options['image'])
+        if action == 'predict':
+            return handler.predict, payload
+        if action == 'features':
+            return (lambda data: handler.get_features(data)), payload
+        if action == 'gradcam':
+            return handler.get_gradcam, payload
+        self._offline_training_data(handler)
+
+        def train(data):
+            queued = handler.train_step(data)
+            if queued.get('error'):
+                return queued
+            while True:
+                progress = handler.train_progress({'job_id': queued['job_id']})
+                if progress['status'] not in ('queued', 'running'):
+                    return progress
+                time.sleep(0.005)
+
+        return train, {'steps': options['train_steps'], 'batch_size': options['train_batch_size']}
+
+    def _offline_training_data(self, handler):
+        """Train on random digits when MNIST is not on disk, instead of downloading it."""
+        from torchvision import datasets
+        try:
+            datasets.MNIST(root=handler.data_dir, train=True, download=False)
+            return
+        except RuntimeError:
+            pass
+        self.stdout.write(self.style.WARNING(
+            f"MNIST not found in {handler.data_dir}; training on random images (timing only)"))
+        generator = torch.Generator().manual_seed(0)
+        handler._train_images = torch.randint(0, 256, (4096, 28, 28), dtype=torch.uint8, generator=generator)
+        handler._train_labels = torch.randint(0, 10, (4096,), generator=generator)
+
+    @staticmethod
+    def _timed(run, payload):
+        """Latency and per-stage seconds of one request, JSON rendering included."""
+        with StageTimer() as timer:
+            start = time.perf_counter()
+            result = run(payload)
+            if result.get('error'):
+                raise CommandError(f"Request failed: {result['error']}")
+            with stage('json_render'):
+                JSONRenderer().render(result)
+            elapsed = time.perf_counter() - start
+        return elapsed, timer.seconds
+
+    def _measure(self, run, payload, clients, requests):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            timings = list(pool.map(lambda _: self._timed(run, payload), range(requests)))
+        elapsed = time.perf_counter() - start
+        return summarize([latency for latency, _ in timings], [seconds for _, seconds in timings], elapsed)
+
+    def _print_run(self, result):
+        stages = ', '.join(f"{name} {values['mean_ms']:.1f}" for name, values in result['stages'].items())
+        latency = result['latency_ms']
+        self.stdout.write(f"{result['model']:<9}{result['action']:<9}{result['concurrency']:>8}"
+                          f"{result['throughput_rps']:>9.2f}{latency['p50']:>9.1f}{latency['p99']:>9.1f}  {stages}")
+
+    def _compare(self, report, options):
+        with open(options['compare']) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != RESULTS_VERSION:
+            raise CommandError(f"{options['compare']} has results version {baseline.get('version')}, "
+                               f"expected {RESULTS_VERSION}")
+        changed = [key for key in ('cpus', 'threads', 'torch')
+                   if baseline['environment'].get(key) != report['environment'][key]]
+        if changed:
+            self.stdout.write(self.style.WARNING(
+                f"Baseline was recorded with different {', '.join(changed)}; differences may not be regressions"))
+
+        rows = compare_results(report, baseline, options['threshold'], options['min_delta_ms'])
+        if not rows:
+            self.stdout.write(self.style.WARNING(f"No runs in common with {options['compare']}"))
+            return
+        self.stdout.write(f"\n{'run':<26}{'metric':<22}{'baseline':>10}{'current':>10}{'change':>9}")
+        for key, metric, before, after, change, worse in rows:
+            line = f"{key:<26}{metric:<22}{before:>10.2f}{after:>10.2f}{change:>+8.1%}"
+            self.stdout.write(self.style.ERROR(line + '  REGRESSION') if worse else line)
+        regressions = sum(1 for row in rows if row[-1])
+        if regressions:
+            raise CommandError(f"{regressions} regression(s) beyond {options['threshold']:.0%} "
+                               f"against {options['compare']}")
+        self.stdout.write(self.style.SUCCESS(f"No regressions beyond {options['threshold']:.0%}"))
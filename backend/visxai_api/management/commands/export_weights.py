@@ -0,0 +1,56 @@
+import os
+import time
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from visxai_api.weights import load_weights, save_weights, weights_path
+
+EXPORTABLE = ('mnist', 'vgg16', 'resnet50')
+
+
+class Command(BaseCommand):
+    help = ('Writes the served models\' weights as memory-mappable .safetensors files in saved_models/, '
+            'which the handlers then load lazily instead of unpickling')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', default=','.join(EXPORTABLE),
+                            help=f"Comma-separated models (default: {','.join(EXPORTABLE)})")
+
+    def handle(self, *args, **options):
+        names = [name for name in options['models'].split(',') if name]
+        unknown = [name for name in names if name not in EXPORTABLE]
+        if unknown:
+            raise CommandError(f"Unknown models: {', '.join(unknown)}. Available: {', '.join(EXPORTABLE)}")
+        os.makedirs(os.path.join(settings.BASE_DIR, 'saved_models'), exist_ok=True)
+
+        for name in names:
+            state_dict = self.state_dict(name)
+            if state_dict is None:
+                continue
+            path = weights_path(name)
+            save_weights(path, state_dict, {'source': name})
+
+            # Report what a handler will pay at startup: mapping, not reading
+            start = time.perf_counter()
+            loaded = load_weights(path)
+            load_ms = (time.perf_counter() - start) * 1000
+            if set(loaded) != set(state_dict) or not all(torch.equal(loaded[k], v.cpu()) for k, v in state_dict.items()):
+                raise CommandError(f"Round trip of {path} does not match the source weights")
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: {os.path.getsize(path) / (1024 * 1024):.1f} MB -> {path} (maps in {load_ms:.1f} ms)"))
+
+    def state_dict(self, name):
+        if name == 'mnist':
+            model_path = os.path.join(settings.BASE_DIR, 'saved_models', 'mnist_cnn.pth')
+            if not os.path.exists(model_path):
+                self.stdout.write(self.style.WARNING(
+                    f"mnist: skipped, {model_path} not found. Run 'python manage.py train_mnist' first."))
+                return None
+            return torch.load(model_path, map_location='cpu')
+
+        import torchvision.models as models
+        if name == 'vgg16':
+            return models.vgg16(weights=models.VGG16_Weights.IMAGENET1K_V1).state_dict()
+        return models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V1).state_dict()
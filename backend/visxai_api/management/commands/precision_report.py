@@ -0,0 +1,130 @@
+import io
+import json
+import os
+import time
+
+import numpy as np
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from visxai_api.handlers.vgg_resnet_handler import VGGResNetHandler
+from visxai_api.precision import PRECISION_MODES, bf16_supported, image_paths, synthetic_images, torchao_available
+
+
+class Command(BaseCommand):
+    help = ('Compares precision modes of a model on a fixed local image set: agreement with fp32 '
+            '(and accuracy, given labels.json), single-image latency and weight size')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default='vgg16', choices=['vgg16', 'resnet50'])
+        parser.add_argument('--modes', default=','.join(PRECISION_MODES),
+                            help=f"Comma-separated modes (default: {','.join(PRECISION_MODES)})")
+        parser.add_argument('--images', default=settings.VISXAI_CALIBRATION_DIR,
+                            help='Evaluation images; an optional labels.json maps file name -> ImageNet class index')
+        parser.add_argument('--calibration-dir', default=settings.VISXAI_CALIBRATION_DIR,
+                            help='int8-static calibration images (calibrating on the evaluation set flatters it)')
+        parser.add_argument('--limit', type=int, default=64, help='Images to evaluate')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed passes over the image set')
+        parser.add_argument('--threads', type=int, default=None, help='Torch intra-op threads')
+        parser.add_argument('--random-weights', action='store_true', help='Skip pretrained weights (offline smoke test)')
+        parser.add_argument('--json', default=None, help='Also write the report to this file')
+
+    def handle(self, *args, **options):
+        modes = [mode for mode in options['modes'].split(',') if mode]
+        unknown = [mode for mode in modes if mode not in PRECISION_MODES]
+        if unknown:
+            raise CommandError(f"Unknown modes: {', '.join(unknown)}. Available: {', '.join(PRECISION_MODES)}")
+        if 'bf16' in modes and not bf16_supported():
+            self.stdout.write(self.style.WARNING('Skipping bf16: no native bfloat16 support on this CPU'))
+            modes.remove('bf16')
+        if 'int8-dynamic' in modes and not torchao_available():
+            self.stdout.write(self.style.WARNING('Skipping int8-dynamic: torchao is not installed'))
+            modes.remove('int8-dynamic')
+        if 'fp32' not in modes:
+            modes.insert(0, 'fp32')  # the reference
+        if options['threads']:
+            torch.set_num_threads(options['threads'])
+
+        names, images = self.load_images(options['images'], options['limit'])
+        labels = self.load_labels(options['images'], names)
+        self.stdout.write(f"{options['model']}: {len(images)} images, modes {', '.join(modes)}, "
+                          f"{torch.get_num_threads()} threads, engine {torch.backends.quantized.engine}")
+
+        results, reference = [], None
+        for mode in modes:
+            torch.manual_seed(0)  # identical random weights across modes with --random-weights
+            handler = VGGResNetHandler(options['model'], pretrained=not options['random_weights'],
+                                       precision=mode, calibration_dir=options['calibration_dir'])
+            handler.warmup()
+            inputs = [handler.transform(image).unsqueeze(0) for image in images]
+            probabilities = torch.cat([torch.softmax(handler._forward(x)[0], dim=1) for x in inputs])
+            latencies = []
+            for _ in range(options['repeat']):
+                for x in inputs:
+                    start = time.perf_counter()
+                    handler._forward(x)
+                    latencies.append(time.perf_counter() - start)
+            with handler.serving_pool.checkout() as model:
+                buffer = io.BytesIO()
+                torch.save(model.state_dict(), buffer)
+
+            if reference is None:
+                reference = probabilities
+            results.append(self.summarize(mode, probabilities, reference, labels, latencies, buffer.tell()))
+            del handler
+
+        baseline = results[0]['latency_p50_ms']
+        self.stdout.write(f"{'mode':<14}{'top1 agree':>11}{'top5 overlap':>13}{'accuracy':>10}"
+                          f"{'p50 ms':>9}{'p95 ms':>9}{'speedup':>9}{'weights MB':>12}")
+        for row in results:
+            row['speedup'] = round(baseline / row['latency_p50_ms'], 2)
+            # Slower than the fp32 reference here: not worth deploying on this machine
+            row['slower_than_fp32'] = row['speedup'] < 1
+            accuracy = f"{row['accuracy']:.3f}" if row['accuracy'] is not None else '-'
+            line = (f"{row['mode']:<14}{row['top1_agreement']:>11.3f}{row['top5_overlap']:>13.3f}"
+                    f"{accuracy:>10}{row['latency_p50_ms']:>9.1f}{row['latency_p95_ms']:>9.1f}"
+                    f"{row['speedup']:>8.2f}x{row['weights_mb']:>12.1f}")
+            self.stdout.write(self.style.WARNING(f"{line}  slower than fp32") if row['slower_than_fp32'] else line)
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({'model': options['model'], 'images': len(images), 'threads': torch.get_num_threads(),
+                           'results': results}, f, indent=2)
+            self.stdout.write(f"Report written to {options['json']}")
+
+    def load_images(self, directory, limit):
+        paths = image_paths(directory)[:limit]
+        if not paths:
+            self.stdout.write(self.style.WARNING(
+                f"No images in {directory}; using {limit} synthetic images (agreement only, no accuracy)"))
+            return [], synthetic_images(limit)
+        return [os.path.basename(path) for path in paths], [Image.open(path).convert('RGB') for path in paths]
+
+    @staticmethod
+    def load_labels(directory, names):
+        path = os.path.join(directory, 'labels.json') if directory else None
+        if not names or not path or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            labels = json.load(f)
+        if not all(name in labels for name in names):
+            return None
+        return torch.tensor([int(labels[name]) for name in names])
+
+    @staticmethod
+    def summarize(mode, probabilities, reference, labels, latencies, weight_bytes):
+        top5 = probabilities.topk(5, dim=1).indices
+        reference_top5 = reference.topk(5, dim=1).indices
+        overlap = [len(set(a.tolist()) & set(b.tolist())) / 5 for a, b in zip(top5, reference_top5)]
+        latencies_ms = np.array(latencies) * 1000
+        return {
+            'mode': mode,
+            'top1_agreement': float((top5[:, 0] == reference_top5[:, 0]).float().mean()),
+            'top5_overlap': float(np.mean(overlap)),
+            'max_probability_delta': float((probabilities - reference).abs().max()),
+            'accuracy': float((top5[:, 0] == labels).float().mean()) if labels is not None else None,
+            'latency_p50_ms': float(np.percentile(latencies_ms, 50)),
+            'latency_p95_ms': float(np.percentile(latencies_ms, 95)),
+            'weights_mb': weight_bytes / (1024 * 1024),
+        }
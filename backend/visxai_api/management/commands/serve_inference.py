@@ -0,0 +1,52 @@
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from visxai_api.process_pool import InferenceServer
+
+
+class Command(BaseCommand):
+    help = ('Serves models from N worker processes that share one copy of the weights; '
+            'Django reaches them for the models in VISXAI_REMOTE_MODELS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', default=None,
+                            help='Comma-separated models to serve (default: VISXAI_REMOTE_MODELS)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Torch intra-op threads per worker (default: CPU cores / workers)')
+        parser.add_argument('--address', default=settings.VISXAI_INFERENCE_SOCKET,
+                            help='Manifest path; worker sockets are <address>.<i>')
+        parser.add_argument('--no-warmup', action='store_true', help='Skip the per-worker warmup pass')
+
+    def handle(self, *args, **options):
+        names = options['models'].split(',') if options['models'] else settings.VISXAI_REMOTE_MODELS
+        if not names:
+            raise CommandError('No models to serve: pass --models or set VISXAI_REMOTE_MODELS')
+        config = apps.get_app_config('visxai_api')
+        factories = config.model_factories
+        unknown = [name for name in names if name not in factories]
+        if unknown:
+            raise CommandError(f"Unknown models: {', '.join(unknown)}. Available: {', '.join(factories)}")
+        local_only = [name for name in names if name in config.local_only_models]
+        if local_only:
+            raise CommandError(f"{', '.join(local_only)} trains in the Django process and cannot be served "
+                               "by worker processes")
+
+        handlers = {}
+        for name in names:
+            self.stdout.write(f"Loading {name}...")
+            # Forward passes (calibration, compiling) wait until after the fork
+            handler = factories[name](prepare=False)
+            if getattr(handler, 'batcher', None) is not None:
+                # Batcher threads would not survive the fork; every worker forwards on its own
+                self.stdout.write(self.style.WARNING(f"Micro-batching is disabled for {name} in worker processes"))
+                handler.batcher.close()
+                handler.batcher = None
+            handlers[name] = handler
+
+        server = InferenceServer(handlers, str(options['address']), options['workers'],
+                                 threads=options['threads'], warmup=not options['no_warmup'])
+        server.serve(log=self.stdout.write)
@@ -1,20 +1,44 @@
 import os
+import time
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
-import matplotlib.pyplot as plt
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from visxai_api.ml_models import SmallMNISTCNN
+from visxai_api.training import load_mnist, normalize_mnist
+from visxai_api.kernel_store import KernelStore
+from visxai_api.weights import save_weights, weights_path
+
 
 class Command(BaseCommand):
     help = 'Trains the SmallMNISTCNN model'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--epochs', type=int, default=5, help='Total epochs (including resumed ones)')
+        parser.add_argument('--batch-size', type=int, default=64)
+        parser.add_argument('--lr', type=float, default=0.001)
+        parser.add_argument('--threads', type=int, default=None, help='Torch intra-op threads (default: torch default)')
+        parser.add_argument('--interop-threads', type=int, default=None, help='Torch inter-op threads')
+        parser.add_argument('--loader', default='tensor', choices=['tensor', 'dataloader'],
+                            help='tensor: preloaded uint8 tensor, normalized per batch; '
+                                 'dataloader: torchvision dataset through a DataLoader')
+        parser.add_argument('--workers', type=int, default=0, help='DataLoader worker processes (dataloader only)')
+        parser.add_argument('--checkpoint', default=None,
+                            help='Checkpoint path (default: saved_models/mnist_checkpoint.pt)')
+        parser.add_argument('--resume', action='store_true', help='Continue from the checkpoint if it exists')
+        parser.add_argument('--run', default=None,
+                            help='Kernel-store run name (default: timestamp, or the checkpoint\'s run on --resume)')
+        parser.add_argument('--skip-kernels', action='store_true', help='Do not record kernel snapshots per epoch')
+        parser.add_argument('--seed', type=int, default=0)
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('🚀 Training Started...'))
-        
+        if options['threads']:
+            torch.set_num_threads(options['threads'])
+        if options['interop_threads']:
+            torch.set_num_interop_threads(options['interop_threads'])
+
         # Ensure directories exist
         model_dir = os.path.join(settings.BASE_DIR, 'saved_models')
         kernel_dir = os.path.join(settings.MEDIA_ROOT, 'kernels')
@@ -22,66 +46,130 @@ class Command(BaseCommand):
         os.makedirs(kernel_dir, exist_ok=True)
 
         device = "cuda" if torch.cuda.is_available() else "cpu"
+        torch.manual_seed(options['seed'])
         model = SmallMNISTCNN().to(device)
 
         # Training settings
-        epochs = 5
+        epochs = options['epochs']
+        batch_size = options['batch_size']
         model_path = os.path.join(model_dir, "mnist_cnn.pth")
+        checkpoint_path = options['checkpoint'] or os.path.join(model_dir, "mnist_checkpoint.pt")
 
-        transform = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize((0.5,), (0.5,))
-        ])
+        loss_fn = nn.CrossEntropyLoss()
+        optim_ = optim.Adam(model.parameters(), lr=options['lr'])
+        generator = torch.Generator().manual_seed(options['seed'])
+
+        start_epoch = 1
+        run = options['run']
+        if options['resume'] and os.path.exists(checkpoint_path):
+            checkpoint = torch.load(checkpoint_path, map_location=device)
+            model.load_state_dict(checkpoint['model'])
+            optim_.load_state_dict(checkpoint['optimizer'])
+            generator.set_state(checkpoint['generator'])
+            start_epoch = checkpoint['epoch'] + 1
+            run = run or checkpoint.get('run')
+            self.stdout.write(f"Resuming from {checkpoint_path} after epoch {checkpoint['epoch']}")
 
         # Download data to a temp dir or project dir
         data_dir = os.path.join(settings.BASE_DIR, 'data')
-        train_data = datasets.MNIST(root=data_dir, train=True, download=True, transform=transform)
-        train_loader = DataLoader(train_data, batch_size=64, shuffle=True)
-
-        loss_fn = nn.CrossEntropyLoss()
-        optim_ = optim.Adam(model.parameters(), lr=0.001)
-
-        for epoch in range(1, epochs + 1):
-            total_loss = 0
+        if options['loader'] == 'tensor':
+            # One contiguous uint8 tensor (47 MB) for the whole run
+            images, labels = load_mnist(data_dir, train=True, download=True)
+            images, labels = images.contiguous().to(device), labels.to(device)
+            num_samples = len(labels)
+            batches = lambda: self.tensor_batches(images, labels, batch_size, generator)
+        else:
+            batches, num_samples = self.dataloader_batches(data_dir, batch_size, options['workers'], generator, device)
+
+        # One memory-mapped array per run instead of a PNG per kernel per epoch
+        run = run or time.strftime('mnist-%Y%m%d-%H%M%S')
+        kernel_store = None
+        if not options['skip_kernels']:
+            kernel_store = KernelStore.open_or_create(
+                os.path.join(kernel_dir, run),
+                {name: tuple(weight.shape) for name, weight in self.kernels(model).items()},
+            )
+
+        total_samples, total_seconds = 0, 0.0
+        for epoch in range(start_epoch, epochs + 1):
             model.train()
-
-            for images, labels in train_loader:
-                images, labels = images.to(device), labels.to(device)
-
-                optim_.zero_grad()
-                out = model(images)
-                loss = loss_fn(out, labels)
+            # Summed on-device; reading it every step would sync on each batch
+            total_loss = torch.zeros((), device=device)
+            steps = 0
+            start = time.perf_counter()
+
+            for images_batch, labels_batch in batches():
+                optim_.zero_grad(set_to_none=True)
+                out = model(images_batch)
+                loss = loss_fn(out, labels_batch)
                 loss.backward()
                 optim_.step()
 
-                total_loss += loss.item()
+                total_loss += loss.detach()
+                steps += 1
 
-            avg_loss = total_loss / len(train_loader)
-            self.stdout.write(f"Epoch {epoch}/{epochs} | Loss = {avg_loss:.4f}")
+            avg_loss = total_loss.item() / steps
+            seconds = time.perf_counter() - start
+            total_samples += num_samples
+            total_seconds += seconds
+            self.stdout.write(f"Epoch {epoch}/{epochs} | Loss = {avg_loss:.4f} | "
+                              f"{num_samples / seconds:,.0f} samples/s")
 
+            self.save_checkpoint(checkpoint_path, model, optim_, generator, epoch, run)
             # Save Kernels
-            self.save_kernels(model, epoch, kernel_dir)
+            if kernel_store is not None:
+                kernel_store.append(epoch, {name: w.cpu().numpy() for name, w in self.kernels(model).items()})
 
         torch.save(model.state_dict(), model_path)
+        # Mappable copy the handler loads without unpickling (see export_weights)
+        save_weights(weights_path('mnist'), model.state_dict(), {'source': 'train_mnist', 'run': run})
+        if total_seconds:
+            self.stdout.write(f"Throughput: {total_samples / total_seconds:,.0f} samples/s "
+                              f"over {total_seconds:.1f}s of training")
+        if kernel_store is not None:
+            self.stdout.write(f"Kernel snapshots: run '{run}' in {kernel_store.path}")
         self.stdout.write(self.style.SUCCESS(f'\n✅ Training Done! Model saved to {model_path}'))
 
-    def save_kernels(self, model, epoch, base_dir):
-        conv_layers = [model.block1[0], model.block2[0]]
-        conv_names = ["conv1", "conv2"]
-
-        for layer, name in zip(conv_layers, conv_names):
-            weight = layer.weight.data.cpu().numpy()
-            out_c = weight.shape[0]
+    @staticmethod
+    def tensor_batches(images, labels, batch_size, generator):
+        """Shuffled mini-batches sliced from the preloaded tensors, normalized on the fly."""
+        order = torch.randperm(len(labels), generator=generator).to(images.device)
+        for i in range(0, len(order), batch_size):
+            index = order[i:i + batch_size]
+            yield normalize_mnist(images[index]), labels[index]
 
-            epoch_dir = os.path.join(base_dir, f"{name}_epoch{epoch}")
-            os.makedirs(epoch_dir, exist_ok=True)
+    @staticmethod
+    def dataloader_batches(data_dir, batch_size, workers, generator, device):
+        """Batches from the torchvision dataset via a DataLoader (baseline for comparisons)."""
+        from torchvision import datasets, transforms
+        from torch.utils.data import DataLoader
 
-            for i in range(out_c):
-                kernel_img = weight[i, 0]
-                k = kernel_img - kernel_img.min()
-                k = k / (k.max() + 1e-5)
+        transform = transforms.Compose([
+            transforms.ToTensor(),
+            transforms.Normalize((0.5,), (0.5,))
+        ])
+        train_data = datasets.MNIST(root=data_dir, train=True, download=True, transform=transform)
+        train_loader = DataLoader(train_data, batch_size=batch_size, shuffle=True, generator=generator,
+                                  num_workers=workers, persistent_workers=workers > 0)
 
-                plt.imshow(k, cmap="gray")
-                plt.axis("off")
-                plt.savefig(os.path.join(epoch_dir, f"kernel_{i}.png"), bbox_inches="tight", pad_inches=0)
-                plt.close()
+        def batches():
+            for images, labels in train_loader:
+                yield images.to(device), labels.to(device)
+        return batches, len(train_data)
+
+    def save_checkpoint(self, path, model, optimizer, generator, epoch, run):
+        """Everything needed to resume after `epoch`, written atomically."""
+        tmp_path = f"{path}.tmp"
+        torch.save({
+            'epoch': epoch,
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'generator': generator.get_state(),
+            'run': run,
+        }, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def kernels(model):
+        """conv1/conv2 weights [out, in, kh, kw] by layer name."""
+        return {"conv1": model.block1[0].weight.detach(), "conv2": model.block2[0].weight.detach()}
@@ -0,0 +1,195 @@
+"""
+Request metrics in the Prometheus text format, served at /api/metrics/.
+
+ServerTimingMiddleware (middleware.py) records every model request: its
+total latency and each stage timed during it (see timing.py) go into
+histograms labelled by model and action (and stage). Cache, scheduler and
+model lifecycle state is read when the endpoint is scraped.
+
+Metrics are kept per server process; with several worker processes, scrape
+each one (or sum them in Prometheus).
+"""
+import bisect
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Upper bounds in seconds: sub-millisecond stages up to minute-long attacks
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects it."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: Dict[str, str]) -> List[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': repr(bound)})} {cumulative}")
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {self.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum!r}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class _Family:
+    """One metric name: its HELP/TYPE header and a sample per label set."""
+
+    def __init__(self, name: str, kind: str, help_text: str):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.samples: List[Tuple[Dict[str, Any], float]] = []
+
+    def add(self, value: Optional[float], **labels):
+        if value is not None:
+            self.samples.append((labels, value))
+
+    def lines(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_labels(labels)} {float(value)!r}" for labels, value in self.samples]
+        return lines
+
+
+class RequestMetrics:
+    """Latency histograms and status counters per model and action."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._requests: Dict[Tuple[str, str], Histogram] = {}
+        self._stages: Dict[Tuple[str, str, str], Histogram] = {}
+        self._responses: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _histogram(self, table: dict, key: tuple) -> Histogram:
+        if key not in table:
+            table[key] = Histogram(self.buckets)
+        return table[key]
+
+    def observe(self, model: str, action: str, status: int, seconds: float, stages: Dict[str, float]):
+        """Record one finished request and its stage times."""
+        with self._lock:
+            self._histogram(self._requests, (model, action)).observe(seconds)
+            for name, stage_seconds in stages.items():
+                self._histogram(self._stages, (model, action, name)).observe(stage_seconds)
+            self._responses[(model, action, status)] += 1
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            lines = ["# HELP visxai_request_duration_seconds Model request latency, rendering included.",
+                     "# TYPE visxai_request_duration_seconds histogram"]
+            for (model, action), histogram in sorted(self._requests.items()):
+                lines += histogram.lines('visxai_request_duration_seconds', {'model': model, 'action': action})
+            lines += ["# HELP visxai_stage_duration_seconds Time per request spent in each pipeline stage.",
+                      "# TYPE visxai_stage_duration_seconds histogram"]
+            for (model, action, name), histogram in sorted(self._stages.items()):
+                lines += histogram.lines('visxai_stage_duration_seconds',
+                                         {'model': model, 'action': action, 'stage': name})
+            responses = _Family('visxai_requests_total', 'counter', 'Model requests by response status.')
+            for (model, action, status), count in sorted(self._responses.items()):
+                responses.add(count, model=model, action=action, status=status)
+            return lines + responses.lines()
+
+
+def _cache_families() -> List[_Family]:
+    from .cache import get_result_cache
+
+    cache = get_result_cache()
+    if cache is None:
+        return []
+    stats = cache.stats()
+    lookups = _Family('visxai_cache_lookups_total', 'counter', 'Result cache lookups by outcome.')
+    for outcome in ('hits', 'disk_hits', 'misses', 'coalesced'):
+        lookups.add(stats.get(outcome), outcome=outcome)
+    evictions = _Family('visxai_cache_evictions_total', 'counter', 'Result cache evictions by tier.')
+    evictions.add(stats.get('evictions'), tier='memory')
+    evictions.add(stats.get('disk_evictions'), tier='disk')
+    entries = _Family('visxai_cache_entries', 'gauge', 'Results held in memory.')
+    entries.add(stats['entries'])
+    size = _Family('visxai_cache_bytes', 'gauge', 'Result cache size by tier.')
+    size.add(stats['memory_bytes'], tier='memory')
+    size.add(stats['disk_bytes'], tier='disk')
+    inflight = _Family('visxai_cache_inflight', 'gauge', 'Results being computed, with waiters coalesced on them.')
+    inflight.add(stats['inflight'])
+    return [lookups, evictions, entries, size, inflight]
+
+
+def _scheduler_families() -> List[_Family]:
+    from .executor import get_executor
+
+    stats = get_executor().stats()
+    workers = _Family('visxai_scheduler_workers', 'gauge', 'Inference scheduler worker threads.')
+    workers.add(stats['workers'])
+    queued = _Family('visxai_scheduler_queued', 'gauge', 'Calls waiting in the scheduler, by cost class.')
+    running = _Family('visxai_scheduler_running', 'gauge', 'Calls running on scheduler workers, by cost class.')
+    for name, cost_class in stats['classes'].items():
+        queued.add(cost_class['queued'], cost_class=name)
+        running.add(cost_class['running'], cost_class=name)
+    outcomes = _Family('visxai_scheduler_calls_total', 'counter', 'Scheduled calls by action and outcome.')
+    for action, action_stats in stats['actions'].items():
+        for outcome in ('completed', 'failed', 'dropped', 'cancelled', 'rejected'):
+            outcomes.add(action_stats[outcome], action=action, outcome=outcome)
+    model_queued = _Family('visxai_scheduler_model_queued', 'gauge', 'Calls waiting in the scheduler, by model.')
+    for model, model_stats in stats['models'].items():
+        model_queued.add(model_stats['queued'], model=model)
+    return [workers, queued, running, outcomes, model_queued]
+
+
+def _model_families() -> List[_Family]:
+    from .model_registry import ModelRegistry
+
+    loaded = _Family('visxai_model_loaded', 'gauge', '1 when the model is loaded in this process.')
+    state = _Family('visxai_model_state', 'gauge', 'Model lifecycle state (1 for the current state).')
+    memory = _Family('visxai_model_memory_bytes', 'gauge', 'Approximate weight memory of a loaded model.')
+    load_time = _Family('visxai_model_load_seconds', 'gauge', 'Time the last load of the model took.')
+    for name, entry in ModelRegistry.status().items():
+        loaded.add(1 if entry['state'] == 'loaded' else 0, model=name)
+        state.add(1, model=name, state=entry['state'])
+        memory.add(int(entry['memory_mb'] * 1024 * 1024), model=name)
+        load_time.add(entry['load_seconds'], model=name)
+    return [loaded, state, memory, load_time]
+
+
+def render_metrics() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    lines = get_request_metrics().lines()
+    for family in _cache_families() + _scheduler_families() + _model_families():
+        lines += family.lines()
+    return '\n'.join(lines) + '\n'
+
+
+_request_metrics: Optional[RequestMetrics] = None
+_request_metrics_lock = threading.Lock()
+
+
+def get_request_metrics() -> RequestMetrics:
+    """Process-wide request metrics."""
+    global _request_metrics
+    with _request_metrics_lock:
+        if _request_metrics is None:
+            _request_metrics = RequestMetrics()
+    return _request_metrics
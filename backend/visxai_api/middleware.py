@@ -0,0 +1,115 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+from .metrics import get_request_metrics
+from .model_registry import ModelRegistry
+from .profiling import get_profiler
+from .timing import StageTimer
+
+
+class ServerTimingMiddleware:
+    """
+    Times model requests stage by stage (see timing.py).
+
+    Requests routed to a model view get a `Server-Timing` header listing each
+    stage plus the total (browser devtools show it under Network -> Timing),
+    and are recorded in the histograms served at /api/metrics/. Streamed
+    responses only cover the work done before the first byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = settings.VISXAI_SERVER_TIMING
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with StageTimer() as timer:
+            start = time.perf_counter()
+            response = self.get_response(request)
+        return self._finish(request, response, timer, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        with StageTimer() as timer:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+        return self._finish(request, response, timer, time.perf_counter() - start)
+
+    def _finish(self, request, response, timer, seconds):
+        labels = self._labels(request)
+        if labels is None:
+            return response
+        get_request_metrics().observe(*labels, response.status_code, seconds, timer.seconds)
+        if self.header:
+            metrics = [f"{name};dur={stage_seconds * 1000:.2f}" for name, stage_seconds in timer.ordered()]
+            response['Server-Timing'] = ', '.join(metrics + [f"total;dur={seconds * 1000:.2f}"])
+        return response
+
+    @staticmethod
+    def _labels(request):
+        """(model, action) for a model request, or None; unknown names are not recorded as labels."""
+        from .views import UnifiedModelView
+
+        match = getattr(request, 'resolver_match', None)
+        kwargs = match.kwargs if match else {}
+        if 'model_name' not in kwargs or 'action' not in kwargs:
+            return None
+        model = kwargs['model_name'].lower()
+        action = kwargs['action']
+        return (model if model in ModelRegistry.list_models() else 'unknown',
+                action if action in UnifiedModelView.ACTIONS else 'unknown')
+
+
+class ProfilerMiddleware:
+    """
+    Profiles model requests while a capture is armed for their model (see
+    profiling.py); otherwise a single attribute check. Sits inside
+    ServerTimingMiddleware so stage timings are annotated in the trace.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.profiler = get_profiler()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        target = self._target(request)
+        if target is None:
+            return self.get_response(request)
+        with self.profiler.request(*target) as outcome:
+            response = self.get_response(request)
+            outcome['status'] = response.status_code
+        return response
+
+    async def __acall__(self, request):
+        target = self._target(request)
+        if target is None:
+            return await self.get_response(request)
+        with self.profiler.request(*target) as outcome:
+            response = await self.get_response(request)
+            outcome['status'] = response.status_code
+        return response
+
+    def _target(self, request):
+        """(model, action) when a capture is armed and this is a model request other than `profile`."""
+        if not self.profiler.armed:
+            return None
+        try:
+            kwargs = resolve(request.path_info).kwargs
+        except Resolver404:
+            return None
+        if 'model_name' not in kwargs or kwargs.get('action') in (None, 'profile'):
+            return None
+        return kwargs['model_name'].lower(), kwargs['action']
@@ -1,9 +1,29 @@
+import logging
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from typing import Dict, Any, Iterator, List, Optional, Callable, Tuple, Union
+
+from .timing import stage
+
+logger = logging.getLogger(__name__)
+
 
 class ModelHandler(ABC):
     """Base class for all model handlers."""
-    
+
+    # Bump whenever the weights change so cached results are not reused.
+    weights_version: int = 0
+    # Content-derived identity of the served weights (see weights.state_digest),
+    # kept current as they change. It keys results in the disk cache, which
+    # outlives the process; None (e.g. random init) keeps them in memory only.
+    weights_id: Optional[str] = None
+    # Numeric mode forward passes run in (see precision.py); part of the cache key.
+    precision: str = 'fp32'
+    # How forward passes are executed (see backends.py).
+    execution_backend: str = 'eager'
+
     @abstractmethod
     def predict(self, data: Any) -> Dict[str, Any]:
         """Run prediction on the input data."""
@@ -14,6 +34,17 @@ class ModelHandler(ABC):
         """Retrieve feature maps or internal representations."""
         pass
 
+    def predict_stream(self, data: Any) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Yield a prediction as ('prediction', ...) followed by one ('layer', ...)
+        event per feature-map layer.
+
+        The default splits a finished predict() result; handlers override it to
+        emit the prediction before any feature map is encoded.
+        """
+        from .streaming import result_events
+        yield from result_events(self.predict(data))
+
     def generate_adversarial(self, data: Any, epsilon: float = 0.01) -> Dict[str, Any]:
         """Generate an adversarial example (optional)."""
         return {"error": "Adversarial generation not supported for this model."}
@@ -22,11 +53,61 @@ class ModelHandler(ABC):
         """Generate Grad-CAM heatmap (optional)."""
         return {"error": "Grad-CAM not supported for this model."}
 
+    def prepare(self) -> None:
+        """Finish setup that runs forward passes, such as calibration or compiling (optional)."""
+        pass
+
+    def warmup(self) -> None:
+        """Run a dummy forward pass so the first real request is not slow (optional)."""
+        pass
+
+    def close(self) -> None:
+        """Release background resources when the handler is evicted (optional)."""
+        pass
+
+    def memory_bytes(self) -> int:
+        """Approximate resident size of the handler's weights, used for eviction."""
+        return 0
+
+    def concurrency(self) -> int:
+        """Calls the handler can serve at once (replicas, batch slots); sizes the inference scheduler."""
+        return 1
+
+
+HandlerFactory = Callable[[], ModelHandler]
+
+
+class _ModelEntry:
+    """Lifecycle state of one registered model."""
+
+    def __init__(self, name: str, factory: HandlerFactory, warmup: Optional[bool]):
+        self.name = name
+        self.factory = factory
+        self.warmup = warmup
+        self.handler: Optional[ModelHandler] = None
+        self.state = "registered"  # registered | loading | loaded | evicted | failed
+        self.error: Optional[str] = None
+        self.memory_bytes = 0
+        self.load_seconds: Optional[float] = None
+        self.last_used: Optional[float] = None
+        self.lock = threading.Lock()
+
 
 class ModelRegistry:
-    """Singleton registry to manage model handlers."""
+    """
+    Singleton registry to manage model handlers.
+
+    Handlers are registered as factories and only constructed on first use.
+    Loaded handlers are kept in LRU order; when a memory budget is configured,
+    the least recently used ones are evicted to make room and transparently
+    reloaded on their next request.
+    """
     _instance = None
-    _handlers: Dict[str, ModelHandler] = {}
+    _entries: Dict[str, _ModelEntry] = {}
+    _lru: "OrderedDict[str, None]" = OrderedDict()
+    _lock = threading.RLock()
+    memory_budget: Optional[int] = None  # bytes, None = unlimited
+    warmup: bool = False
 
     def __new__(cls):
         if cls._instance is None:
@@ -34,16 +115,160 @@ class ModelRegistry:
         return cls._instance
 
     @classmethod
-    def register(cls, name: str, handler: ModelHandler):
-        """Register a model handler."""
-        cls._handlers[name.lower()] = handler
+    def configure(cls, memory_budget_mb: Optional[float] = None, warmup: bool = False):
+        """Set the memory budget (in MB) and whether handlers are warmed up on load."""
+        cls.memory_budget = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        cls.warmup = warmup
+
+    @classmethod
+    def register(cls, name: str, handler: Union[ModelHandler, HandlerFactory], warmup: Optional[bool] = None):
+        """
+        Register a model handler.
+
+        `handler` is either a ready handler instance or a zero-argument factory
+        that builds one on first use. `warmup` overrides the registry default.
+        """
+        name = name.lower()
+        with cls._lock:
+            if isinstance(handler, ModelHandler):
+                entry = _ModelEntry(name, lambda h=handler: h, warmup)
+                entry.handler = handler
+                entry.state = "loaded"
+                entry.memory_bytes = handler.memory_bytes()
+                cls._lru[name] = None
+            else:
+                entry = _ModelEntry(name, handler, warmup)
+                cls._lru.pop(name, None)
+            cls._entries[name] = entry
 
     @classmethod
     def get_handler(cls, name: str) -> Optional[ModelHandler]:
-        """Retrieve a model handler by name."""
-        return cls._handlers.get(name.lower())
+        """
+        Retrieve a model handler by name, loading it if necessary.
+
+        Returns None for unknown models; re-raises the factory's exception if
+        the model fails to load.
+        """
+        entry = cls._entries.get(name.lower())
+        if entry is None:
+            return None
+
+        handler = entry.handler
+        if handler is None:
+            handler = cls._load(entry)
+
+        with cls._lock:
+            entry.last_used = time.time()
+            if entry.name in cls._lru:
+                cls._lru.move_to_end(entry.name)
+        return handler
+
+    @classmethod
+    def _load(cls, entry: _ModelEntry) -> ModelHandler:
+        # Per-model lock: concurrent first requests wait for one load instead of racing.
+        with entry.lock:
+            if entry.handler is not None:
+                return entry.handler
+
+            entry.state = "loading"
+            entry.error = None
+            start = time.perf_counter()
+            try:
+                with stage('model_load'):
+                    handler = entry.factory()
+                    warmup = cls.warmup if entry.warmup is None else entry.warmup
+                    if warmup:
+                        handler.warmup()
+            except Exception as e:
+                entry.state = "failed"
+                entry.error = str(e)
+                raise
+
+            entry.load_seconds = time.perf_counter() - start
+            entry.memory_bytes = handler.memory_bytes()
+
+            with cls._lock:
+                entry.handler = handler
+                entry.state = "loaded"
+                cls._lru[entry.name] = None
+                cls._lru.move_to_end(entry.name)
+                cls._enforce_budget(keep=entry.name)
+            return handler
+
+    @classmethod
+    def _enforce_budget(cls, keep: str):
+        """Evict least recently used handlers until the loaded set fits the budget."""
+        if cls.memory_budget is None:
+            return
+        for name in list(cls._lru.keys()):
+            if cls.loaded_bytes() <= cls.memory_budget:
+                break
+            if name != keep:
+                cls.evict(name)
+
+    @classmethod
+    def evict(cls, name: str) -> bool:
+        """Drop a loaded handler; it is rebuilt from its factory on next use."""
+        with cls._lock:
+            entry = cls._entries.get(name.lower())
+            if entry is None or entry.handler is None:
+                return False
+            # In-flight requests keep their own reference until they finish.
+            handler, entry.handler = entry.handler, None
+            entry.state = "evicted"
+            cls._lru.pop(entry.name, None)
+        handler.close()
+        return True
+
+    @classmethod
+    def loaded_bytes(cls) -> int:
+        """Total estimated memory of all loaded handlers."""
+        return sum(e.memory_bytes for e in cls._entries.values() if e.handler is not None)
+
+    @classmethod
+    def preload(cls, names: List[str], background: bool = True) -> Optional[threading.Thread]:
+        """Load the given models, optionally on a background thread."""
+        if not names:
+            return None
+
+        def run():
+            for name in names:
+                try:
+                    cls.get_handler(name)
+                except Exception as e:
+                    logger.warning("Failed to preload model '%s': %s", name, e)
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="visxai-preload", daemon=True)
+        thread.start()
+        return thread
+
+    @classmethod
+    def status(cls) -> Dict[str, Dict[str, Any]]:
+        """Lifecycle state of every registered model."""
+        with cls._lock:
+            return {
+                name: {
+                    "state": entry.state,
+                    "memory_mb": round(entry.memory_bytes / (1024 * 1024), 1),
+                    "load_seconds": entry.load_seconds,
+                    "last_used": entry.last_used,
+                    "error": entry.error,
+                    "precision": entry.handler.precision if entry.handler else None,
+                    "backend": entry.handler.execution_backend if entry.handler else None,
+                }
+                for name, entry in cls._entries.items()
+            }
+
+    @classmethod
+    def is_ready(cls, required: List[str]) -> bool:
+        """True when every model in `required` is loaded."""
+        entries = [cls._entries.get(name.lower()) for name in required]
+        return all(e is not None and e.handler is not None for e in entries)
 
     @classmethod
     def list_models(cls) -> List[str]:
         """List all registered models."""
-        return list(cls._handlers.keys())
+        return list(cls._entries.keys())
@@ -0,0 +1,154 @@
+"""
+Reduced-precision CPU inference for the image handlers.
+
+Modes (VISXAI_MODEL_PRECISION, or `precision=` at registration):
+
+    fp32           the model as loaded
+    int8-dynamic   Linear layers with int8 weights, activations quantized on
+                   the fly (VGG16's classifier holds ~120M of 138M parameters;
+                   ResNet50 is nearly all convs, so it gains nothing there).
+                   Optional: pip install torchao
+    int8-static    every Conv2d runs in int8, with activation scales fixed by
+                   calibration on a local image set; each conv is wrapped in
+                   its own quantize/dequantize pair so module paths (and the
+                   feature-map hooks on them) stay where they were
+    bf16           bfloat16 autocast, where the CPU has native bf16 support
+
+Quantized modules have no backward pass, so Grad-CAM and adversarial attacks
+always run on the fp32 model; the quantized copy shares every weight it does
+not replace. int8-static stays on torch.ao's eager-mode flow: torchao only
+offers static conv quantization on exported graphs, which would drop the
+module paths the feature-map hooks sit on.
+"""
+import contextlib
+import glob
+import logging
+import os
+from typing import Iterable, List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from .inference import replicate_module
+
+logger = logging.getLogger(__name__)
+
+PRECISION_MODES = ('fp32', 'int8-dynamic', 'int8-static', 'bf16')
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.JPEG')
+
+
+def bf16_supported() -> bool:
+    """Whether this CPU runs bfloat16 kernels natively (otherwise bf16 is emulated and slower)."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def torchao_available() -> bool:
+    """Whether torchao (used for int8-dynamic) is installed."""
+    try:
+        import torchao.quantization  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_precision(mode: Optional[str]) -> str:
+    """Validate a mode, falling back to fp32 when bf16 or torchao is not available here."""
+    mode = (mode or 'fp32').lower()
+    if mode not in PRECISION_MODES:
+        raise ValueError(f"Unknown precision '{mode}'. Use one of: {', '.join(PRECISION_MODES)}")
+    if mode == 'bf16' and not bf16_supported():
+        logger.warning("bfloat16 is not supported natively on this CPU; using fp32.")
+        return 'fp32'
+    if mode == 'int8-dynamic' and not torchao_available():
+        logger.warning("int8-dynamic needs torchao (pip install torchao); using fp32.")
+        return 'fp32'
+    return mode
+
+
+class _QuantizedConv(nn.Module):
+    """A conv that takes and returns fp32 but computes in int8 once converted."""
+
+    def __init__(self, conv: nn.Conv2d):
+        super().__init__()
+        self.quant = torch.ao.quantization.QuantStub()
+        self.conv = conv
+        self.dequant = torch.ao.quantization.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.conv(self.quant(x)))
+
+
+def _wrap_convs(module: nn.Module):
+    for name, child in module.named_children():
+        if isinstance(child, nn.Conv2d):
+            setattr(module, name, _QuantizedConv(child))
+        else:
+            _wrap_convs(child)
+
+
+def quantize_model(model: nn.Module, mode: str, calibration: Optional[Iterable[torch.Tensor]] = None) -> nn.Module:
+    """
+    The module to serve forward passes with in `mode`.
+
+    fp32 and bf16 return `model` itself (bf16 is applied by `autocast`). The
+    int8 modes return a copy that shares the weights they leave in fp32;
+    int8-static runs the `calibration` batches through it first.
+    """
+    if mode in ('fp32', 'bf16'):
+        return model
+
+    replica = replicate_module(model).eval()
+    if mode == 'int8-dynamic':
+        from torchao.quantization import Int8DynamicActivationInt8WeightConfig, quantize_
+
+        # Swaps the replica's Linear weights for int8 ones; the original module keeps its own
+        quantize_(replica, Int8DynamicActivationInt8WeightConfig(),
+                  filter_fn=lambda module, name: isinstance(module, nn.Linear))
+        return replica
+
+    from torch.ao.quantization import convert, get_default_qconfig, prepare
+
+    _wrap_convs(replica)
+    qconfig = get_default_qconfig(torch.backends.quantized.engine)
+    for module in replica.modules():
+        if isinstance(module, _QuantizedConv):
+            module.qconfig = qconfig
+    prepare(replica, inplace=True)
+    with torch.no_grad():
+        for batch in calibration or []:
+            replica(batch)
+    return convert(replica, inplace=True)
+
+
+def autocast(mode: str):
+    """Context for a forward pass in `mode` (bf16 autocast, otherwise a no-op)."""
+    if mode == 'bf16':
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def image_paths(directory: Optional[str]) -> List[str]:
+    """Image files in `directory`, in name order (empty if it does not exist)."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted({path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(directory, pattern))})
+
+
+def load_image_set(directory: Optional[str], limit: Optional[int] = None) -> List[Image.Image]:
+    """RGB images from `directory` in name order."""
+    return [Image.open(path).convert('RGB') for path in image_paths(directory)[:limit]]
+
+
+def synthetic_images(count: int, size: int = 256, seed: int = 0) -> List[Image.Image]:
+    """Deterministic smooth-noise images, a stand-in when no local image set is available."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        coarse = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        images.append(Image.fromarray(coarse, mode='RGB').resize((size, size), Image.BILINEAR))
+    return images
@@ -0,0 +1,318 @@
+"""
+Multi-process inference: one copy of the weights, N worker processes.
+
+`python manage.py serve_inference` loads the handlers once in a parent
+process and moves every parameter and buffer into shared memory. It then
+forks the workers. Each worker maps the same weight pages, so total RSS
+stays close to one copy of the weights however many workers run. Each
+worker also has its own GIL and its own intra-op thread pool.
+
+No forward pass may run in the parent before the fork, or the workers
+inherit an intra-op (OpenMP) pool that was already used. Handlers are
+therefore built with prepare=False, and each worker runs prepare() itself:
+int8 quantization (with its calibration passes) and compiled backends are
+built per worker, from the shared fp32 weights, and are not shared.
+
+Every worker listens on its own Unix socket (`<address>.<i>`). The parent
+writes a manifest to `<address>` listing the sockets and models, removes it
+again on shutdown, and restarts workers that die. Django talks to the pool
+through `RemoteHandler`, which is registered in place of the local handler
+for models in VISXAI_REMOTE_MODELS. Calls are spread round-robin over the
+workers. Activation sessions are pinned to the worker that holds them, via
+a "<worker>." prefix on the session id.
+
+Training stays in the Django process: a worker that trained would drift
+away from its siblings' weights. Trainable models (mnist) are therefore
+rejected in VISXAI_REMOTE_MODELS at startup.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+import torch.nn as nn
+
+from .model_registry import ModelHandler
+
+logger = logging.getLogger(__name__)
+
+# Handler methods served by the workers
+REMOTE_METHODS = ('predict', 'get_features', 'generate_adversarial', 'get_gradcam')
+
+
+def _authkey() -> bytes:
+    from django.conf import settings
+    return hashlib.sha256(settings.SECRET_KEY.encode()).digest()
+
+
+def _modules(handler: ModelHandler) -> List[nn.Module]:
+    modules = [value for value in vars(handler).values() if isinstance(value, nn.Module)]
+    pool = getattr(handler, 'pool', None)
+    if pool is not None:
+        modules.extend(pool)
+    return modules
+
+
+def share_weights(handler: ModelHandler) -> int:
+    """
+    Move a handler's parameters and buffers into shared memory; returns their size in bytes.
+
+    Weights mapped from an exported file (see weights.py) are left in place:
+    the OS already shares those pages between processes.
+    """
+    seen, total = set(), 0
+    mapped = getattr(handler, 'weights_file', None) is not None
+    for module in _modules(handler):
+        if not mapped:
+            module.share_memory()
+        for tensor in itertools.chain(module.parameters(), module.buffers()):
+            if tensor.data_ptr() not in seen:
+                seen.add(tensor.data_ptr())
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def _serve_connection(conn, handlers: Dict[str, ModelHandler]):
+    """Answer (model, method, args) requests on one client connection until it closes."""
+    with conn:
+        while True:
+            try:
+                model, method, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if method == 'info':
+                    handler = handlers[model]
+                    result = {'weights_version': handler.weights_version, 'weights_id': handler.weights_id,
+                              'precision': handler.precision,
+                              'execution_backend': handler.execution_backend,
+                              'concurrency': handler.concurrency(), 'pid': os.getpid()}
+                elif method in REMOTE_METHODS:
+                    result = getattr(handlers[model], method)(*args)
+                else:
+                    raise ValueError(f"Method '{method}' is not served remotely")
+                reply = (True, result)
+            except Exception as e:
+                logger.exception("Error in %s for %s", method, model)
+                reply = (False, (type(e).__name__, str(e), traceback.format_exc()))
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                return
+
+
+def _worker_main(index: int, handlers: Dict[str, ModelHandler], address: str, threads: int, warmup: bool):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(threads)
+    for handler in handlers.values():
+        handler.prepare()
+    if warmup:
+        for handler in handlers.values():
+            handler.warmup()
+    if os.path.exists(address):
+        os.unlink(address)
+    listener = Listener(address, family='AF_UNIX', authkey=_authkey())
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            # Failed handshakes (wrong authkey, client gone) only affect that client
+            logger.warning("Worker %d: rejected connection: %s", index, e)
+            continue
+        threading.Thread(target=_serve_connection, args=(conn, handlers), daemon=True).start()
+
+
+class InferenceServer:
+    """Parent process of the pool: owns the shared weights and supervises the workers."""
+
+    def __init__(self, handlers: Dict[str, ModelHandler], address: str, workers: int,
+                 threads: Optional[int] = None, warmup: bool = True):
+        self.handlers = handlers
+        self.address = address
+        self.workers = max(1, workers)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.warmup = warmup
+        self.shared_bytes = 0
+        self._context = multiprocessing.get_context('fork')
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * self.workers
+        self._stopping = False
+
+    def socket(self, index: int) -> str:
+        return f"{self.address}.{index}"
+
+    def _start(self, index: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.handlers, self.socket(index), self.threads, self.warmup),
+            name=f"visxai-inference-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _write_manifest(self):
+        manifest = {
+            'pid': os.getpid(),
+            'models': sorted(self.handlers),
+            'sockets': [self.socket(i) for i in range(self.workers)],
+            'threads_per_worker': self.threads,
+            'shared_mb': round(self.shared_bytes / (1024 * 1024), 1),
+        }
+        tmp_path = f"{self.address}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.address)
+
+    def serve(self, log: Callable[[str], None] = print, ready_timeout: float = 120):
+        """Fork the workers, publish the manifest once they listen, and restart any that exit."""
+        # Workers must not inherit a used intra-op pool: handlers are built with
+        # prepare=False, so no forward pass runs before the fork.
+        for handler in self.handlers.values():
+            self.shared_bytes += share_weights(handler)
+        for index in range(self.workers):
+            self._start(index)
+
+        deadline = time.time() + ready_timeout
+        while not all(os.path.exists(self.socket(i)) for i in range(self.workers)):
+            if time.time() > deadline:
+                raise RuntimeError(f"Workers did not start listening within {ready_timeout}s")
+            time.sleep(0.1)
+        self._write_manifest()
+        log(f"Serving {', '.join(sorted(self.handlers))} on {self.address} with {self.workers} workers "
+            f"x {self.threads} threads ({self.shared_bytes / (1024 * 1024):.0f} MB of shared weights)")
+
+        previous = signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        try:
+            while not self._stopping:
+                for index, process in enumerate(self._processes):
+                    if process is not None and not process.is_alive() and not self._stopping:
+                        log(f"Worker {index} exited with {process.exitcode}; restarting")
+                        self._start(index)
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            self.stop()
+
+    def stop(self):
+        self._stopping = True
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=5)
+        for path in [self.address] + [self.socket(i) for i in range(self.workers)]:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class RemoteHandler(ModelHandler):
+    """
+    Proxy for a model served by `serve_inference` worker processes.
+
+    Each Django thread keeps one connection per worker. Responses are the same
+    dicts the local handler returns. The served handler's weights version,
+    precision and execution backend are re-read whenever a connection is
+    opened, so a restarted server's are picked up.
+    """
+
+    def __init__(self, name: str, address: str):
+        self.name = name
+        self.address = address
+        try:
+            with open(address) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise RuntimeError(f"No inference server at {address}; run 'python manage.py serve_inference'")
+        if name not in manifest['models']:
+            raise RuntimeError(f"The inference server at {address} does not serve '{name}'")
+        self.sockets = manifest['sockets']
+        self._local = threading.local()
+        self._next = itertools.count()
+        self._worker_concurrency = 1
+        self._apply_info(self._call(0, 'info'))
+
+    def concurrency(self) -> int:
+        """Every worker process serves as many calls as its local handler."""
+        return len(self.sockets) * self._worker_concurrency
+
+    def _apply_info(self, info: Dict[str, Any]):
+        """Mirror the served handler's weights identity, precision and backend (cache keys, status)."""
+        self.weights_version = info['weights_version']
+        self.weights_id = info['weights_id']
+        self.precision = info['precision']
+        self.execution_backend = info['execution_backend']
+        self._worker_concurrency = info['concurrency']
+
+    def _connection(self, worker: int):
+        connections = self._local.__dict__.setdefault('connections', {})
+        if worker not in connections:
+            connections[worker] = Client(self.sockets[worker], family='AF_UNIX', authkey=_authkey())
+        return connections[worker]
+
+    def _exchange(self, conn, method: str, args: tuple):
+        conn.send((self.name, method, args))
+        return conn.recv()
+
+    def _call(self, worker: int, method: str, *args) -> Any:
+        for attempt in range(2):
+            fresh = worker not in self._local.__dict__.get('connections', {})
+            conn = self._connection(worker)
+            try:
+                if fresh and method != 'info':
+                    # A new connection may reach a restarted server with other weights: refresh first
+                    ok, info = self._exchange(conn, 'info', ())
+                    if ok:
+                        self._apply_info(info)
+                ok, result = self._exchange(conn, method, args)
+                break
+            except (EOFError, OSError):
+                # The worker restarted since this connection was opened; reconnect once
+                self._local.connections.pop(worker, None)
+                if attempt:
+                    raise RuntimeError(f"Inference worker {worker} for '{self.name}' is unavailable")
+        if not ok:
+            kind, message, _ = result
+            raise (ValueError if kind == 'ValueError' else RuntimeError)(message)
+        return result
+
+    def _pick(self, data: Any):
+        """Worker for a request: the session's owner, else round-robin. Returns (worker, data)."""
+        data = data.dict() if hasattr(data, 'dict') else dict(data or {})
+        session = data.get('session')
+        if isinstance(session, str) and '.' in session:
+            worker, data['session'] = session.split('.', 1)
+            if not worker.isdigit() or int(worker) >= len(self.sockets):
+                raise ValueError("Malformed session id")
+            return int(worker), data
+        return next(self._next) % len(self.sockets), data
+
+    def predict(self, data: Any) -> Dict[str, Any]:
+        worker, data = self._pick(data)
+        result = self._call(worker, 'predict', data)
+        if 'session' in result:
+            result = {**result, 'session': f"{worker}.{result['session']}"}
+        return result
+
+    def get_features(self, data: Any, layer_id: Optional[str] = None) -> Dict[str, Any]:
+        worker, data = self._pick(data)
+        return self._call(worker, 'get_features', data, layer_id)
+
+    def generate_adversarial(self, data: Any, epsilon: float = 0.01) -> Dict[str, Any]:
+        worker, data = self._pick(data)
+        return self._call(worker, 'generate_adversarial', data, epsilon)
+
+    def get_gradcam(self, data: Any) -> Dict[str, Any]:
+        worker, data = self._pick(data)
+        return self._call(worker, 'get_gradcam', data)
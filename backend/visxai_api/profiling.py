@@ -0,0 +1,348 @@
+"""
+On-demand profiling of live model requests.
+
+An admin arms a capture for the next N requests to one model
+(POST /api/models/<model>/profile/). While a claimed request runs:
+
+- its scheduled model call runs under torch.profiler on the worker thread,
+  with the request's timing stages (decode, transform, PNG encode, ...)
+  annotated in the trace;
+- tracemalloc traces Python-side allocations (numpy and PIL buffers),
+  process-wide, so concurrent requests show up there too;
+- a sampler thread records the process RSS.
+
+Each request writes `<n>-<action>.trace.json` (Chrome trace; open it in
+chrome://tracing or https://ui.perfetto.dev) and `<n>-<action>.memory.json`
+(RSS, top allocation sites, and the operators with the most CPU time and
+memory) under MEDIA_ROOT/profiles/<capture id>/. After N requests, or once
+the capture expires, it disarms itself.
+
+Only one request is profiled at a time (torch allows one active profiler);
+requests arriving meanwhile run normally and do not use up the capture.
+Models served by `serve_inference` workers run their forward passes in
+another process, so their traces only show the client side.
+"""
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+from .timing import StageTimer
+
+# Allocation sites and operators listed in each memory summary
+TOP_ENTRIES = 25
+# Finished captures listed by the status action
+KEEP_CAPTURES = 32
+
+
+def _rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux), or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RssSampler:
+    """Samples RSS on a background thread until stopped."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="visxai-rss-sampler", daemon=True)
+
+    def _run(self):
+        while True:
+            rss = _rss_bytes()
+            if rss is not None:
+                self.samples.append(rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self) -> "_RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class ProfileCapture:
+    """A capture armed for the next `requests` requests to one model."""
+
+    def __init__(self, capture_id: str, model: str, requests: int, directory: str, ttl: float,
+                 record_shapes: bool, with_stack: bool):
+        self.id = capture_id
+        self.model = model
+        self.requests = requests
+        self.directory = directory
+        self.expires_at = time.time() + ttl
+        self.record_shapes = record_shapes
+        self.with_stack = with_stack
+        self.claimed = 0
+        self.files: List[Dict[str, Any]] = []
+        self.state = "armed"  # armed | done | cancelled | expired
+        self.created = time.time()
+
+    def to_dict(self, media_root: str, media_url: str) -> Dict[str, Any]:
+        def url(path):
+            return media_url + os.path.relpath(path, media_root).replace(os.sep, '/')
+        return {
+            "id": self.id,
+            "model": self.model,
+            "status": self.state,
+            "requests": self.requests,
+            "profiled": len(self.files),
+            "remaining": self.requests - self.claimed if self.state == "armed" else 0,
+            "expires_at": self.expires_at if self.state == "armed" else None,
+            "files": [{**entry, "trace": url(entry["trace"]), "memory": url(entry["memory"])} for entry in self.files],
+        }
+
+
+class _Session:
+    """One profiled request: the capture it counts towards and what it recorded."""
+    _current: ContextVar[Optional["_Session"]] = ContextVar("visxai_profile_session", default=None)
+
+    def __init__(self, capture: ProfileCapture, index: int):
+        self.capture = capture
+        self.index = index
+        self.profiler = None
+        self.call_seconds = 0.0
+
+
+class RequestProfiler:
+    """Arms, claims and writes out profile captures; one per process (see get_profiler)."""
+
+    def __init__(self, root: str, media_root: str, media_url: str, max_requests: int = 20, ttl: float = 600):
+        self.root = root
+        self.media_root = media_root
+        self.media_url = media_url
+        self.max_requests = max_requests
+        self.ttl = ttl
+        self._armed: Dict[str, ProfileCapture] = {}
+        self._captures: Dict[str, ProfileCapture] = {}
+        self._ids = itertools.count(1)
+        self._busy = False
+        self._lock = threading.Lock()
+
+    @property
+    def armed(self) -> bool:
+        """Cheap check for the request path: is any capture armed?"""
+        return bool(self._armed)
+
+    def _expire(self):
+        now = time.time()
+        for model, capture in list(self._armed.items()):
+            if capture.expires_at <= now:
+                capture.state = "expired"
+                del self._armed[model]
+
+    def arm(self, model: str, requests: int = 1, record_shapes: bool = False,
+            with_stack: bool = False) -> Dict[str, Any]:
+        """Profile the next `requests` requests to `model`, replacing any capture already armed for it."""
+        if not 1 <= requests <= self.max_requests:
+            raise ValueError(f"requests must be 1-{self.max_requests}")
+        with self._lock:
+            self._expire()
+            capture_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{model}-{next(self._ids)}"
+            previous = self._armed.get(model)
+            if previous is not None:
+                previous.state = "cancelled"
+            capture = ProfileCapture(capture_id, model, requests, os.path.join(self.root, capture_id), self.ttl,
+                                     record_shapes, with_stack)
+            self._armed[model] = capture
+            self._captures[capture_id] = capture
+            finished = [c.id for c in self._captures.values() if c.state != "armed"]
+            for old in finished[:max(0, len(self._captures) - KEEP_CAPTURES)]:
+                del self._captures[old]
+            return capture.to_dict(self.media_root, self.media_url)
+
+    def cancel(self, model: str) -> Optional[Dict[str, Any]]:
+        """Disarm the model's capture; requests already being profiled still finish."""
+        with self._lock:
+            capture = self._armed.pop(model, None)
+            if capture is None:
+                return None
+            capture.state = "cancelled"
+            return capture.to_dict(self.media_root, self.media_url)
+
+    def status(self, model: str) -> Dict[str, Any]:
+        """The model's armed capture, if any, and its earlier captures (newest first)."""
+        with self._lock:
+            self._expire()
+            captures = [c for c in self._captures.values() if c.model == model]
+            return {
+                "armed": model in self._armed,
+                "captures": [c.to_dict(self.media_root, self.media_url)
+                             for c in sorted(captures, key=lambda c: c.created, reverse=True)],
+            }
+
+    def _claim(self, model: str) -> Optional[_Session]:
+        with self._lock:
+            self._expire()
+            capture = self._armed.get(model)
+            if capture is None or self._busy:
+                return None
+            self._busy = True
+            capture.claimed += 1
+            if capture.claimed >= capture.requests:
+                del self._armed[model]  # disarmed; the state turns "done" once the last request is written
+            return _Session(capture, capture.claimed)
+
+    @contextlib.contextmanager
+    def request(self, model: str, action: str):
+        """
+        Profile the enclosed request if `model` has a capture armed and no other
+        request is being profiled. Yields a dict for the caller to put the
+        response status in.
+        """
+        outcome: Dict[str, Any] = {}
+        session = self._claim(model) if self.armed else None
+        if session is None:
+            yield outcome
+            return
+
+        token = _Session._current.set(session)
+        timer = StageTimer.active()
+        if timer is not None:
+            timer.annotate = True
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        try:
+            with _RssSampler() as rss:
+                yield outcome
+        finally:
+            seconds = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            if timer is not None:
+                timer.annotate = False
+            _Session._current.reset(token)
+            try:
+                self._write(session, action, outcome.get("status"), seconds, rss.samples,
+                            after.compare_to(before, 'lineno'), traced_peak, timer)
+            finally:
+                with self._lock:
+                    self._busy = False
+                    capture = session.capture
+                    if capture.state == "armed" and capture.claimed >= capture.requests:
+                        capture.state = "done"
+
+    def _write(self, session: _Session, action: str, status: Optional[int], seconds: float, rss: List[int],
+               allocations, traced_peak: int, timer: Optional[StageTimer]):
+        capture = session.capture
+        os.makedirs(capture.directory, exist_ok=True)
+        stem = os.path.join(capture.directory, f"{session.index}-{action}")
+        mb = 1024 * 1024
+
+        def operator(event):
+            return {
+                "name": event.key,
+                "calls": event.count,
+                "self_cpu_ms": round(event.self_cpu_time_total / 1000, 3),
+                "cpu_total_ms": round(event.cpu_time_total / 1000, 3),
+                "cpu_memory_mb": round(event.cpu_memory_usage / mb, 3),
+                "self_cpu_memory_mb": round(event.self_cpu_memory_usage / mb, 3),
+            }
+
+        by_time, by_memory = [], []
+        if session.profiler is not None:
+            session.profiler.export_chrome_trace(stem + '.trace.json')
+            events = list(session.profiler.key_averages())
+            by_time = [operator(e) for e in sorted(events, key=lambda e: e.self_cpu_time_total, reverse=True)]
+            by_memory = [operator(e) for e in sorted(events, key=lambda e: e.cpu_memory_usage, reverse=True)
+                         if e.cpu_memory_usage > 0]
+        else:
+            # No model call was scheduled (e.g. a streamed predict): an empty, valid trace
+            with open(stem + '.trace.json', 'w') as f:
+                json.dump({"traceEvents": []}, f)
+
+        summary = {
+            "model": capture.model,
+            "action": action,
+            "status": status,
+            "seconds": round(seconds, 4),
+            "model_call_seconds": round(session.call_seconds, 4),
+            "stages_ms": {name: round(value * 1000, 3) for name, value in timer.ordered()} if timer else {},
+            "rss_mb": {
+                "start": round(rss[0] / mb, 1), "peak": round(max(rss) / mb, 1), "end": round(rss[-1] / mb, 1),
+                "samples": len(rss),
+            } if rss else None,
+            "python_allocations": {
+                "peak_mb": round(traced_peak / mb, 3),
+                "net_mb": round(sum(stat.size_diff for stat in allocations) / mb, 3),
+                "top": [{
+                    "location": str(stat.traceback[0]) if stat.traceback else "?",
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                } for stat in sorted(allocations, key=lambda s: abs(s.size_diff), reverse=True)[:TOP_ENTRIES]],
+            },
+            "operators_by_time": by_time[:TOP_ENTRIES],
+            "operators_by_memory": by_memory[:TOP_ENTRIES],
+        }
+        with open(stem + '.memory.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+        with self._lock:
+            capture.files.append({"request": session.index, "action": action, "status": status,
+                                  "seconds": summary["seconds"], "trace": stem + '.trace.json',
+                                  "memory": stem + '.memory.json'})
+
+
+def profiled(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    Wrap a model call so it runs under torch.profiler when its request is
+    being profiled (the profiler only sees the thread it runs on).
+    """
+    def call():
+        session = _Session._current.get()
+        if session is None or session.profiler is not None:
+            return fn()
+        capture = session.capture
+        profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True,
+                                          record_shapes=capture.record_shapes, with_stack=capture.with_stack)
+        session.profiler = profiler  # calls nested in this one (run inline) are already covered
+        start = time.perf_counter()
+        with profiler:
+            try:
+                return fn()
+            finally:
+                session.call_seconds = time.perf_counter() - start
+    return call
+
+
+_profiler: Optional[RequestProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> RequestProfiler:
+    """Process-wide request profiler built from settings."""
+    global _profiler
+    from django.conf import settings
+
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = RequestProfiler(
+                root=os.path.join(settings.MEDIA_ROOT, 'profiles'),
+                media_root=settings.MEDIA_ROOT,
+                media_url=settings.MEDIA_URL,
+                max_requests=settings.VISXAI_PROFILER_MAX_REQUESTS,
+                ttl=settings.VISXAI_PROFILER_TTL_S,
+            )
+    return _profiler
@@ -0,0 +1,145 @@
+"""
+Incremental responses for handler event streams.
+
+A handler's `predict_stream` yields `(event, payload)` pairs. They are written
+either as NDJSON, one `{"event": ..., "data": ...}` object per line, or as
+Server-Sent Events (`event: ...` / `data: ...`). The stream always ends with a
+`done` event, or with an `error` event if the handler fails midway.
+
+Every event is produced on the inference scheduler (see executor.py) under
+the request's model and action, so streams share the workers, queue limits
+and fairness with other calls. The first event is produced before the
+response is returned: a full queue or a missed deadline still answers
+429/504. Later events are produced as the client reads them; if the
+scheduler rejects one midway, the stream ends with an `error` event.
+
+Under ASGI the response body is an async iterator and a client disconnect
+closes the handler's generator, so no further layers are encoded. Under
+WSGI the same frames are served from a plain iterator.
+"""
+import asyncio
+import json
+import traceback
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from .executor import DeadlineExceeded, ExecutorFull, get_executor
+from .profiling import profiled
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+Event = Tuple[str, Dict[str, Any]]
+
+_END = object()
+
+
+def format_event(fmt: str, event: str, payload: Dict[str, Any]) -> bytes:
+    """Serialize one event as an NDJSON line or an SSE message."""
+    if fmt == 'sse':
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode()
+    return (json.dumps({'event': event, 'data': payload}) + "\n").encode()
+
+
+def iter_frames(events: Iterator[Event], fmt: str) -> Iterator[bytes]:
+    """Encode a handler's events, turning a failure into a final 'error' event."""
+    try:
+        for event, payload in events:
+            yield format_event(fmt, event, payload)
+            if event == 'error':
+                return
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Error while streaming: {str(e)}")
+        print(error_trace)
+        yield format_event(fmt, 'error', {
+            "error": str(e),
+            "traceback": error_trace if settings.DEBUG else None
+        })
+        return
+    yield format_event(fmt, 'done', {})
+
+
+def result_events(result: Dict[str, Any]) -> Iterator[Event]:
+    """Events for a finished predict result: the prediction, then one per feature-map layer."""
+    result = dict(result)
+    if 'error' in result:
+        yield 'error', result
+        return
+    feature_maps = result.pop('feature_maps', None) or {}
+    yield 'prediction', result
+    for layer_id, encoded in feature_maps.items():
+        yield 'layer', {'layer_id': layer_id, 'feature_maps': {layer_id: encoded}}
+
+
+def _rejected(fmt: str, error: Exception) -> bytes:
+    print(f"Stream ended early: {str(error)}")
+    return format_event(fmt, 'error', {"error": str(error)})
+
+
+def scheduled_frames(frames: Iterator[bytes], first: bytes, fmt: str, model: str, action: str) -> Iterator[bytes]:
+    """Yield `first`, then pull each following frame on a scheduler worker."""
+    executor = get_executor()
+    try:
+        frame = first
+        while frame is not _END:
+            yield frame
+            frame = executor.call(partial(next, frames, _END), model, action)
+    except (ExecutorFull, DeadlineExceeded) as e:
+        yield _rejected(fmt, e)
+    finally:
+        frames.close()
+
+
+async def aiter_scheduled_frames(frames: Iterator[bytes], first: bytes, fmt: str, model: str,
+                                 action: str) -> AsyncIterator[bytes]:
+    """Async `scheduled_frames`: awaits each frame, and drops a queued one when the client disconnects."""
+    executor = get_executor()
+    future = None
+    try:
+        frame = first
+        while frame is not _END:
+            yield frame
+            future = executor.submit(partial(next, frames, _END), model, action)
+            frame = await asyncio.wrap_future(future)
+    except (ExecutorFull, DeadlineExceeded) as e:
+        yield _rejected(fmt, e)
+    finally:
+        # Runs on client disconnect as well; stops the handler's generator, once
+        # a frame still being produced on a worker is done.
+        if future is not None and not future.done() and not future.cancel():
+            future.add_done_callback(lambda _: frames.close())
+        else:
+            frames.close()
+
+
+def streaming_response(request, events: Iterator[Event], fmt: str, model: str, action: str,
+                       deadline: Optional[float] = None) -> StreamingHttpResponse:
+    """
+    Stream `events` to the client in `fmt` ('ndjson' or 'sse'), producing
+    them on the scheduler as `model`/`action`.
+
+    Raises ExecutorFull or DeadlineExceeded when the first event cannot be
+    scheduled (`deadline` in seconds, None for the cost class default).
+    """
+    frames = iter_frames(events, fmt)
+    try:
+        first = get_executor().call(profiled(partial(next, frames, _END)), model, action, deadline)
+    except BaseException:
+        frames.close()
+        raise
+    if isinstance(request, ASGIRequest):
+        body = aiter_scheduled_frames(frames, first, fmt, model, action)
+    else:
+        body = scheduled_frames(frames, first, fmt, model, action)
+    response = StreamingHttpResponse(body, content_type=STREAM_FORMATS[fmt])
+    response['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies (nginx) from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
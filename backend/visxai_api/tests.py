@@ -1,3 +1,591 @@
+import importlib.util
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+
+import numpy as np
+import torch
+
+from django.conf import settings
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from . import executor as executor_module
+from .adversarial import run_attack
+from .cache import ResultCache
+from .encoding import FRAME_MAGIC, PackedTensor, decode_frame, encode_frame, pack_channels
+from .executor import DeadlineExceeded, ExecutorFull, InferenceExecutor
+from .handlers.mnist_handler import MNISTHandler
+from .handlers.vgg_resnet_handler import VGGResNetHandler
+from .kernel_store import KernelStore, list_runs
+from .management.commands.benchmark_suite import compare_results, summarize
+from .ml_models import SmallMNISTCNN
+from .model_registry import ModelRegistry
+from .precision import quantize_model, torchao_available
+from .views import _overload_response
+from .weights import is_current, load_weights, read_header, save_weights, state_digest, weights_digest
+
+
+class ReplicatedHandlerSchedulingTests(TestCase):
+    """The scheduler lets a replicated handler serve as many calls as it has replicas."""
+
+    def setUp(self):
+        self.saved_entries = dict(ModelRegistry._entries)
+        self.saved_executor = executor_module._executor
+        # A single base worker: any overlap comes from the handler's replicas
+        executor_module._executor = InferenceExecutor(
+            workers=1, classes=settings.VISXAI_COST_CLASSES, action_costs=settings.VISXAI_ACTION_COSTS)
+        self.handler = MNISTHandler(replicas=2)
+        ModelRegistry.register('mnist', self.handler)
+
+    def tearDown(self):
+        executor_module._executor.shutdown()
+        executor_module._executor = self.saved_executor
+        self.handler.close()
+        ModelRegistry._entries.clear()
+        ModelRegistry._entries.update(self.saved_entries)
+        ModelRegistry._lru.pop('mnist', None)
+
+    def test_concurrent_predicts_overlap(self):
+        # Each forward pass waits for a second one to start, so serialized calls time out
+        barrier = threading.Barrier(2, timeout=10)
+
+        def wait_for_peer(module, inputs, output):
+            barrier.wait()
+
+        for replica in self.handler.pool:
+            replica.register_forward_hook(wait_for_peer)
+
+        def predict(i):
+            pixels = [(i + 1) / 10] * 784  # distinct inputs, so the result cache cannot coalesce them
+            return APIClient().post('/api/models/mnist/predict/', {'pixels': pixels}, format='json')
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(predict, range(4)))
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        self.assertFalse(barrier.broken)
+        self.assertEqual(executor_module._executor.stats()['workers'], 2)
+
+
+class BenchmarkReportTests(TestCase):
+    """summarize and compare_results of the benchmark suite."""
+
+    @staticmethod
+    def _run(p50, p99=None, throughput=10.0, stages=None, key=('vgg16', 'predict', 1)):
+        return {
+            'model': key[0], 'action': key[1], 'concurrency': key[2], 'throughput_rps': throughput,
+            'latency_ms': {'p50': p50, 'p99': p99 if p99 is not None else p50},
+            'stages': {name: {'mean_ms': ms} for name, ms in (stages or {}).items()},
+        }
+
+    def test_summarize(self):
+        summary = summarize([0.1, 0.2, 0.3, 0.4], [{'forward': 0.05}, {'forward': 0.1, 'transform': 0.02}, {}, {}], 2.0)
+        self.assertEqual(summary['requests'], 4)
+        self.assertAlmostEqual(summary['throughput_rps'], 2.0)
+        self.assertAlmostEqual(summary['latency_ms']['p50'], 250.0)
+        self.assertAlmostEqual(summary['latency_ms']['min'], 100.0)
+        self.assertAlmostEqual(summary['latency_ms']['max'], 400.0)
+        # Pipeline order, and requests without a stage count as zero
+        self.assertEqual(list(summary['stages']), ['transform', 'forward'])
+        self.assertAlmostEqual(summary['stages']['forward']['mean_ms'], 37.5)
+        self.assertAlmostEqual(summary['stages']['transform']['mean_ms'], 5.0)
+
+    def test_compare_flags_regressions_past_threshold_and_delta(self):
+        baseline = {'results': [self._run(100.0, throughput=10.0, stages={'forward': 80.0, 'transform': 0.5}),
+                                self._run(10.0, key=('mnist', 'predict', 1))]}
+        current = {'results': [self._run(125.0, throughput=7.0, stages={'forward': 82.0, 'transform': 0.9}),
+                               self._run(10.0, key=('resnet50', 'predict', 1))]}
+        rows = {metric: (change, worse) for key, metric, _, _, change, worse in
+                compare_results(current, baseline, threshold=0.1, min_delta_ms=1.0)}
+        self.assertEqual(set(rows), {'throughput_rps', 'p50_ms', 'p99_ms', 'forward_ms', 'transform_ms'})
+        self.assertAlmostEqual(rows['p50_ms'][0], 0.25)
+        self.assertTrue(rows['p50_ms'][1])
+        self.assertTrue(rows['throughput_rps'][1])
+        self.assertFalse(rows['forward_ms'][1])  # within the threshold
+        self.assertFalse(rows['transform_ms'][1])  # +80%, but below min_delta_ms
+
+    def test_compare_improvements_are_not_regressions(self):
+        rows = compare_results({'results': [self._run(50.0, throughput=20.0)]},
+                               {'results': [self._run(100.0, throughput=10.0)]}, threshold=0.1, min_delta_ms=1.0)
+        self.assertTrue(rows)
+        self.assertFalse(any(row[-1] for row in rows))
+
+
+class ResultCacheTests(TestCase):
+    """Content-addressed keys, single-flight coalescing and the disk tier."""
+
+    DIGIT = {'pixels': [0.0] * 392 + [1.0] * 392}
+
+    def setUp(self):
+        self.disk_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.disk_dir)
+        self.cache = ResultCache(max_bytes=1 << 20, disk_dir=self.disk_dir)
+
+    def key(self, data=None, weights='w1', params=None, action='predict'):
+        return self.cache.make_key('mnist', action, data or self.DIGIT, weights, params=params)
+
+    def test_key_ignores_params_that_do_not_change_the_result(self):
+        self.assertEqual(self.key(), self.key(params={'deadline_ms': '50', 'format': 'vxt', 'stream': 'sse'}))
+        self.assertEqual(self.key(), self.key(data={**self.DIGIT, 'deadline_ms': 10}))
+
+    def test_key_covers_weights_input_and_result_params(self):
+        keys = {
+            self.key(),
+            self.key(weights='w2'),
+            self.key(action='gradcam'),
+            self.key(data={'pixels': [0.5] * 784}),
+            self.key(data={**self.DIGIT, 'transport': 'binary'}),
+            self.key(params={'precision': 'bf16'}),
+        }
+        self.assertEqual(len(keys), 6)
+
+    def test_uncacheable_requests_have_no_key(self):
+        self.assertIsNone(self.key(action='train'))
+        self.assertIsNone(self.key(data={**self.DIGIT, 'session': True}))
+        self.assertIsNone(self.key(data={'top_k': 3}))
+
+    def test_concurrent_misses_compute_once(self):
+        calls, release = [], threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return {'top_class': '7'}
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(self.cache.get_or_compute, self.key(), compute) for _ in range(4)]
+            while self.cache.stats()['coalesced'] < 3:
+                time.sleep(0.01)
+            release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'top_class': '7'}] * 4)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_errors_are_not_cached(self):
+        self.cache.get_or_compute(self.key(), lambda: {'error': 'bad input'})
+        self.assertEqual(self.cache.get_or_compute(self.key(), lambda: {'top_class': '1'}), {'top_class': '1'})
+
+    def test_disk_tier_survives_restart(self):
+        result = {'top_class': '3', 'feature_maps': {'0': pack_channels(torch.randn(4, 6, 6))}}
+        self.cache.get_or_compute(self.key(), lambda: result)
+
+        restarted = ResultCache(max_bytes=1 << 20, disk_dir=self.disk_dir)
+        cached = restarted.get_or_compute(self.key(), lambda: self.fail('recomputed'))
+        self.assertEqual(restarted.stats()['disk_hits'], 1)
+        self.assertIsInstance(cached['feature_maps']['0'], PackedTensor)
+        self.assertEqual(encode_frame(cached), encode_frame(result))
+
+    def test_unpersisted_results_stay_in_memory(self):
+        self.cache.get_or_compute(self.key(weights=0), lambda: {'top_class': '1'}, persist=False)
+        self.cache.get_or_compute(self.key(), lambda: {'top_class': '2'}, persist=lambda: False)
+        self.assertEqual(self.cache.stats()['disk_bytes'], 0)
+        self.assertEqual(self.cache.get_or_compute(self.key(weights=0), lambda: {}, persist=False), {'top_class': '1'})
+
+    def test_weights_identity_follows_content(self):
+        model = SmallMNISTCNN()
+        path = f"{self.disk_dir}/mnist.safetensors"
+        save_weights(path, model.state_dict())
+        self.assertEqual(weights_digest(path), state_digest(model.state_dict()))
+        with torch.no_grad():
+            model.block1[0].bias[0] += 1
+        self.assertNotEqual(state_digest(model.state_dict()), weights_digest(path))
+
+
+class GradCamTests(TestCase):
+    """Top-k Grad-CAM from one forward and one batched backward (ResNet50, random weights)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        torch.manual_seed(0)
+        cls.handler = VGGResNetHandler('resnet50', pretrained=False)
+        cls.x = cls.handler.normalize(torch.rand(1, 3, 224, 224))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.handler.close()
+        super().tearDownClass()
+
+    def test_batched_classes_match_single_class_runs(self):
+        classes = [3, 17, 512]
+        with self.handler.pool.checkout() as model:
+            layers = [name for name, _ in self.handler._cam_layers(model)]
+            cams, indices, _, _ = self.handler._compute_cams(model, self.x, layers, classes)
+            single = [self.handler._compute_cams(model, self.x, layers, [c])[0] for c in classes]
+        self.assertEqual(indices, classes)
+        for name in layers:
+            self.assertEqual(cams[name].shape, (3, 224, 224))
+            for i in range(len(classes)):
+                np.testing.assert_allclose(cams[name][i], single[i][name][0], atol=1e-4)
+        self.assertFalse(np.allclose(cams['layer4'][0], cams['layer4'][1]))
+        self.assertFalse(self.x.requires_grad)
+
+    def test_top_k_explains_the_highest_scores(self):
+        with self.handler.pool.checkout() as model:
+            _, indices, logits, _ = self.handler._compute_cams(model, self.x, ['layer4'], None, top_k=4)
+        self.assertEqual(indices, logits[0].topk(4).indices.tolist())
+
+    def test_batched_backward_failure_is_raised(self):
+        with self.handler.pool.checkout() as model, \
+                mock.patch('torch.autograd.grad', side_effect=RuntimeError('no batching rule')):
+            with self.assertRaises(RuntimeError):
+                self.handler._compute_cams(model, self.x, ['layer4'], [1, 2])
+
+
+@skipUnless(torchao_available(), 'torchao is not installed')
+class Int8DynamicTests(TestCase):
+    """int8-dynamic quantizes a copy's Linear layers and leaves the fp32 model alone."""
+
+    def test_quantized_copy_shares_convs_and_keeps_fp32_model(self):
+        torch.manual_seed(0)
+        model = SmallMNISTCNN().eval()
+        x = torch.rand(2, 1, 28, 28)
+        with torch.no_grad():
+            expected = model(x)
+            quantized = quantize_model(model, 'int8-dynamic')
+            self.assertTrue(torch.equal(model(x), expected))
+            self.assertEqual(quantized(x).argmax(1).tolist(), expected.argmax(1).tolist())
+        self.assertIs(quantized.block1[0].weight, model.block1[0].weight)
+        self.assertEqual(type(model.fc.weight), torch.nn.Parameter)
+        self.assertIsNot(type(quantized.fc.weight), torch.nn.Parameter)
+
+
+class KernelStoreTests(TestCase):
+    """Kernel snapshots: growth past capacity, overwrites and failed index writes."""
+
+    SHAPES = {'conv1': (16, 1, 3, 3), 'conv2': (32, 16, 3, 3)}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, 'run')
+
+    def snapshot(self, value):
+        return {name: np.full(shape, value, np.float32) for name, shape in self.SHAPES.items()}
+
+    def test_grows_past_capacity(self):
+        store = KernelStore.create(self.path, self.SHAPES, capacity=2)
+        for epoch in range(1, 6):
+            store.append(epoch, self.snapshot(epoch))
+        epochs, kernels = KernelStore(self.path).read('conv2')
+        self.assertEqual(epochs, [1, 2, 3, 4, 5])
+        self.assertEqual(kernels.shape, (5, 32, 16, 3, 3))
+        self.assertEqual(kernels[:, 0, 0, 0, 0].tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(store.read('conv1', 2, 3)[0], [2, 3])
+
+    def test_recording_an_epoch_again_overwrites_it(self):
+        store = KernelStore.create(self.path, self.SHAPES)
+        store.append(1, self.snapshot(1))
+        store.append(1, self.snapshot(7))
+        epochs, kernels = store.read('conv1')
+        self.assertEqual(epochs, [1])
+        self.assertEqual(float(kernels.max()), 7)
+
+    def test_failed_index_write_hides_the_epoch(self):
+        store = KernelStore.create(self.path, self.SHAPES)
+        store.append(1, self.snapshot(1))
+        with mock.patch('visxai_api.kernel_store.json.dump', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                store.append(2, self.snapshot(2))
+        self.assertEqual(store.epochs, [1])
+        self.assertEqual(KernelStore(self.path).epochs, [1])
+        self.assertEqual(store.read('conv1')[1].shape, (1, 16, 1, 3, 3))
+        self.assertEqual(list_runs(self.root), ['run'])
+
+
+class TensorFrameTests(TestCase):
+    """VXT1 frames: buffer layout, per-channel quantization and re-encoding."""
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.dense = torch.randn(3, 5, 7)
+        self.sparse = torch.relu(torch.randn(8, 16, 16) - 1.5)  # mostly zeros: bitmask encoding
+        self.frame = encode_frame({
+            'top_class': 'cat',
+            'scores': [0.5, 0.25],
+            'feature_maps': {'conv': pack_channels(self.dense), 'relu': pack_channels(self.sparse),
+                             'half': pack_channels(self.dense, 'float16')},
+        })
+
+    def test_layout(self):
+        self.assertEqual(self.frame[:4], FRAME_MAGIC)
+        (header_len,) = struct.unpack('<I', self.frame[4:8])
+        self.assertEqual((8 + header_len) % 8, 0)
+        header = json.loads(self.frame[8:8 + header_len])
+        maps = header['body']['feature_maps']
+        self.assertEqual([maps[name]['encoding'] for name in ('conv', 'relu')], ['raw', 'bitmask'])
+        self.assertEqual(len(header['buffers']), 3)
+        self.assertTrue(all(offset % 8 == 0 for offset, _ in header['buffers']))
+
+    def test_decode_is_within_half_a_quantization_step(self):
+        decoded = decode_frame(self.frame)
+        self.assertEqual((decoded['top_class'], decoded['scores']), ('cat', [0.5, 0.25]))
+        maps = decoded['feature_maps']
+        step = (self.dense.amax(dim=(1, 2)) - self.dense.amin(dim=(1, 2))) / 255
+        error = (torch.from_numpy(maps['conv']) - self.dense).abs().amax(dim=(1, 2))
+        self.assertTrue(bool((error <= step / 2 + 1e-6).all()))
+        sparse = self.sparse.numpy()
+        self.assertTrue(np.allclose(maps['relu'], sparse, atol=float(sparse.max()) / 255))
+        self.assertEqual(maps['relu'][sparse == 0].max(), 0)
+        self.assertEqual(maps['half'].dtype, np.float16)
+        self.assertTrue(np.allclose(maps['half'], self.dense.numpy(), atol=1e-2))
+
+    def test_packed_decode_reencodes_identically(self):
+        self.assertEqual(encode_frame(decode_frame(self.frame, packed=True)), self.frame)
+
+    def test_rejects_json(self):
+        with self.assertRaises(ValueError):
+            decode_frame(b'{"top_class": "cat"}')
+
+
+class AdversarialBatchingTests(TestCase):
+    """One attack over several epsilons equals separate single-epsilon attacks, row by row."""
+
+    EPSILONS = [0.0, 0.05, 0.2]
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = SmallMNISTCNN().eval().requires_grad_(False)
+        self.x = torch.rand(1, 1, 28, 28)
+
+    @staticmethod
+    def normalize(t):
+        return (t - 0.5) / 0.5
+
+    def assertMatchesSingleAttacks(self, **params):
+        batched = run_attack(self.model, self.normalize, self.x, self.EPSILONS, **params)
+        self.assertEqual(batched['adversarial'].shape, (3, 1, 28, 28))
+        for i, eps in enumerate(self.EPSILONS):
+            single = run_attack(self.model, self.normalize, self.x, [eps], **params)
+            torch.testing.assert_close(batched['adversarial'][i], single['adversarial'][0], atol=1e-5, rtol=0)
+            torch.testing.assert_close(batched['logits'][i], single['logits'][0], atol=1e-4, rtol=1e-4)
+            self.assertEqual(batched['steps'][i], single['steps'][0])
+            self.assertLessEqual(float((batched['adversarial'][i] - self.x[0]).abs().max()), eps + 1e-6)
+        torch.testing.assert_close(batched['adversarial'][0], self.x[0])
+        return batched
+
+    def test_fgsm(self):
+        self.assertEqual(self.assertMatchesSingleAttacks(method='fgsm')['steps'], [1, 1, 1])
+
+    def test_pgd(self):
+        batched = self.assertMatchesSingleAttacks(method='pgd', steps=5, early_stop=False)
+        # The zero-budget row has nothing to optimize
+        self.assertEqual(batched['steps'], [0, 5, 5])
+
+    def test_pgd_early_stop(self):
+        label = int(self.model(self.normalize(self.x)).argmax())
+        self.assertMatchesSingleAttacks(method='pgd', steps=5, early_stop=True, label=label)
+
+
+class ExecutorBackpressureTests(TestCase):
+    """A bounded queue rejects with a Retry-After hint, and cancelled calls never run."""
+
+    def setUp(self):
+        self.executor = InferenceExecutor(workers=1, classes={'interactive': {'priority': 0, 'max_queued': 1}})
+        self.addCleanup(self.executor.shutdown)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        started = threading.Event()
+
+        def hold():
+            started.set()
+            self.release.wait(5)
+
+        self.busy = self.executor.submit(hold, 'mnist', 'predict')
+        started.wait(5)
+
+    def test_full_queue_raises_with_retry_after(self):
+        self.executor.submit(lambda: None, 'mnist', 'predict')
+        with self.assertRaises(ExecutorFull) as raised:
+            self.executor.submit(lambda: None, 'mnist', 'predict')
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        self.assertEqual(self.executor.stats()['actions']['predict']['rejected'], 1)
+
+        response = _overload_response(raised.exception)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(raised.exception.retry_after))
+
+    def test_cancelled_call_frees_its_slot_and_never_runs(self):
+        ran = []
+        queued = self.executor.submit(lambda: ran.append(1), 'mnist', 'predict')
+        self.assertTrue(queued.cancel())
+        # The cancelled call no longer counts against the queue limit
+        replacement = self.executor.submit(lambda: 'done', 'mnist', 'predict')
+        self.release.set()
+        self.assertEqual(replacement.result(5), 'done')
+        self.assertEqual(ran, [])
+        self.assertEqual(self.executor.stats()['actions']['predict']['cancelled'], 1)
+
+
+class PriorityScheduleTests(TestCase):
+    """Cost-class priority, per-model fair share, deadlines and per-model concurrency."""
+
+    def setUp(self):
+        self.executor = InferenceExecutor(
+            workers=1,
+            classes={'interactive': {'priority': 0, 'max_queued': 8},
+                     'heavy': {'priority': 1, 'max_queued': 8}},
+            action_costs={'gradcam': 'heavy'},
+            aging=60,
+        )
+        self.addCleanup(self.executor.shutdown)
+        self.order = []
+
+    def hold_worker(self):
+        """Occupy the only worker; returns the event that frees it."""
+        started, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+
+        def hold():
+            started.set()
+            release.wait(5)
+
+        self.executor.submit(hold, 'busy', 'predict')
+        started.wait(5)
+        return release
+
+    def call(self, label, seconds=0.0):
+        def run():
+            time.sleep(seconds)
+            self.order.append(label)
+        return run
+
+    def test_interactive_class_overtakes_heavy(self):
+        release = self.hold_worker()
+        futures = [self.executor.submit(self.call('gradcam'), 'vgg16', 'gradcam'),
+                   self.executor.submit(self.call('predict'), 'vgg16', 'predict')]
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(self.order, ['predict', 'gradcam'])
+
+    def test_models_share_the_worker_fairly(self):
+        release = self.hold_worker()
+        futures = [self.executor.submit(self.call(label, 0.02), model, 'predict')
+                   for label, model in (('a1', 'a'), ('a2', 'a'), ('b1', 'b'))]
+        release.set()
+        for future in futures:
+            future.result(5)
+        # After a1, model a has used more worker time than b, so b1 goes before a2
+        self.assertEqual(self.order, ['a1', 'b1', 'a2'])
+
+    def test_call_past_its_deadline_is_dropped(self):
+        release = self.hold_worker()
+        future = self.executor.submit(self.call('late'), 'vgg16', 'predict', deadline=0.05)
+        with self.assertRaises(DeadlineExceeded) as raised:
+            future.result(5)
+        release.set()
+        self.assertEqual(self.order, [])
+        self.assertEqual(self.executor.stats()['actions']['predict']['dropped'], 1)
+        self.assertEqual(_overload_response(raised.exception).status_code, 504)
+
+    def test_concurrency_adds_workers_up_to_the_model_limit(self):
+        self.executor.set_concurrency('vgg16', 3)
+        self.assertEqual(self.executor.capacity(), 3)
+        running, release = [], threading.Event()
+        self.addCleanup(release.set)
+
+        def hold():
+            running.append(1)
+            release.wait(5)
+
+        futures = [self.executor.submit(hold, 'vgg16', 'predict') for _ in range(4)]
+        deadline = time.monotonic() + 5
+        while len(running) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(len(running), 3)
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(len(running), 4)
+
+
+class WeightFileTests(TestCase):
+    """Flat weight files: exact round trip, alignment and staleness against the checkpoint."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'model.safetensors')
+
+    def test_round_trip_keeps_dtypes_and_bytes(self):
+        torch.manual_seed(0)
+        state = {
+            'conv.weight': torch.randn(4, 3, 3, 3),
+            'conv.bias': torch.randn(4).half(),
+            'norm.scale': torch.randn(5).to(torch.bfloat16),
+            'norm.num_batches_tracked': torch.tensor(7),
+            'mask': torch.tensor([True, False, True]),
+            'empty': torch.zeros(0),
+        }
+        save_weights(self.path, state, metadata={'source': 'test', 'epoch': 3})
+        header, start = read_header(self.path)
+        self.assertEqual(header['__metadata__'], {'source': 'test', 'epoch': '3', 'sha256': state_digest(state)})
+        self.assertEqual(start % 8, 0)
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
+        loaded = load_weights(self.path)
+        self.assertEqual(list(loaded), list(state))
+        for name, tensor in state.items():
+            self.assertEqual(loaded[name].dtype, tensor.dtype, name)
+            self.assertTrue(torch.equal(loaded[name], tensor), name)
+
+    def test_model_loads_from_file(self):
+        model = SmallMNISTCNN().eval()
+        save_weights(self.path, model.state_dict())
+        copy = SmallMNISTCNN().eval()
+        copy.load_state_dict(load_weights(self.path))
+        x = torch.rand(2, 1, 28, 28)
+        with torch.no_grad():
+            self.assertTrue(torch.equal(model(x), copy(x)))
+
+    def test_is_current(self):
+        checkpoint = os.path.join(self.dir, 'model.pth')
+        self.assertFalse(is_current(self.path, checkpoint))
+        save_weights(self.path, {'w': torch.zeros(1)})
+        self.assertTrue(is_current(self.path, checkpoint))  # no checkpoint to compare with
+        with open(checkpoint, 'wb') as f:
+            f.write(b'checkpoint')
+        now = time.time()
+        os.utime(checkpoint, (now, now))
+        os.utime(self.path, (now - 60, now - 60))
+        self.assertFalse(is_current(self.path, checkpoint))
+        os.utime(self.path, (now + 60, now + 60))
+        self.assertTrue(is_current(self.path, checkpoint))
+
+
+class BackendParityTests(TestCase):
+    """Compiled backends return eager's logits and activations, in the handler's layer order."""
+
+    def assertMatchesEager(self, architecture, backend):
+        torch.manual_seed(0)
+        handler = VGGResNetHandler(architecture, pretrained=False, backend=backend)
+        self.addCleanup(handler.close)
+        self.assertEqual(handler.execution_backend, backend)
+        x = handler.normalize(torch.rand(1, 3, 224, 224))
+        logits, maps = handler._forward(x)
+        with mock.patch.object(handler, 'backend', None):
+            expected_logits, expected_maps = handler._forward(x)
+        torch.testing.assert_close(logits, expected_logits, atol=1e-3, rtol=1e-3)
+        self.assertEqual(list(maps), list(expected_maps))
+        self.assertEqual(list(maps), handler.layer_names)
+        for name, fmap in expected_maps.items():
+            torch.testing.assert_close(maps[name], fmap, atol=1e-3, rtol=1e-3)
+
+    def test_torchscript_vgg16(self):
+        # VGG's last hooked layer is the logits layer itself
+        self.assertMatchesEager('vgg16', 'torchscript')
+
+    def test_torchscript_resnet50(self):
+        self.assertMatchesEager('resnet50', 'torchscript')
 
-# Create your tests here.
+    @skipUnless(importlib.util.find_spec('onnxruntime'), 'onnxruntime is not installed')
+    def test_onnx_resnet50(self):
+        self.assertMatchesEager('resnet50', 'onnx')
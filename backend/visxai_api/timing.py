@@ -0,0 +1,88 @@
+"""
+Per-request stage timing.
+
+Code on the request path marks its stages:
+
+    with stage('forward'):
+        output = model(x)
+
+Nothing is recorded unless a StageTimer is active in the calling thread (or
+task), so an unobserved mark costs one context-variable lookup:
+
+    with StageTimer() as timer:
+        handler.predict(data)
+    timer.seconds  # {'base64_decode': 0.0004, 'forward': 0.21, ...}
+
+Stages can nest (hook_capture happens inside forward, png_encode inside
+feature encoding), so they are not meant to add up to the request total.
+A stage entered several times per request accumulates. The inference
+scheduler runs calls in the submitting request's context, so stages timed
+on its workers land in the request's timer.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# In pipeline order; used to order reports
+STAGES = ('model_load', 'queue', 'base64_decode', 'image_decode', 'transform', 'forward', 'hook_capture',
+          'backward', 'png_encode', 'json_render', 'frame_render')
+
+
+class StageTimer:
+    """Accumulates wall-clock seconds and entry counts per stage for one request."""
+    _current: ContextVar[Optional["StageTimer"]] = ContextVar("visxai_stage_timer", default=None)
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        # Also mark stages as torch.profiler ranges (set while the request is profiled)
+        self.annotate = False
+        self._token = None
+
+    def __enter__(self) -> "StageTimer":
+        self._token = self._current.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        self._current.reset(self._token)
+
+    def add(self, name: str, seconds: float):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    @classmethod
+    def active(cls) -> Optional["StageTimer"]:
+        return cls._current.get()
+
+    def ordered(self) -> List[Tuple[str, float]]:
+        """(stage, seconds) pairs in pipeline order."""
+        rank = {name: i for i, name in enumerate(STAGES)}
+        return sorted(self.seconds.items(), key=lambda item: rank.get(item[0], len(STAGES)))
+
+
+def record(name: str, seconds: float):
+    """Add an already measured duration to the active StageTimer, if any."""
+    timer = StageTimer._current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block as `name` in the active StageTimer, if any."""
+    timer = StageTimer._current.get()
+    if timer is None:
+        yield
+        return
+    if timer.annotate:
+        from torch.profiler import record_function
+        span = record_function(name)
+    else:
+        span = nullcontext()
+    start = time.perf_counter()
+    try:
+        with span:
+            yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
@@ -0,0 +1,197 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def load_mnist(root: str, train: bool = True, download: bool = False) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    MNIST as uint8 images [N, 28, 28] and int64 labels [N].
+
+    Raises RuntimeError when it is not in `root`, unless `download` fetches it
+    (train_mnist does; web requests must not).
+    """
+    from torchvision import datasets
+    dataset = datasets.MNIST(root=root, train=train, download=download)
+    return dataset.data, dataset.targets
+
+
+def normalize_mnist(images: torch.Tensor) -> torch.Tensor:
+    """uint8 [N, 28, 28] -> float [N, 1, 28, 28] in [-1, 1] (ToTensor + Normalize((0.5,), (0.5,)))."""
+    return images.unsqueeze(1).float().div_(127.5).sub_(1)
+
+
+class TrainingJob:
+    """Progress of one queued training request."""
+
+    def __init__(self, job_id: str, steps: int, options: Dict[str, Any]):
+        self.id = job_id
+        self.steps = steps
+        self.options = options
+        self.state = "queued"  # queued | running | done | failed | cancelled
+        self.steps_done = 0
+        self.loss: Optional[float] = None
+        self.accuracy: Optional[float] = None
+        self.history: List[Dict[str, Any]] = []
+        self.kernels: Optional[Dict[str, Any]] = None
+        self.weights_version: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancelled = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        return {
+            "job_id": self.id,
+            "status": self.state,
+            "steps": self.steps,
+            "steps_done": self.steps_done,
+            "loss": self.loss,
+            "accuracy": self.accuracy,
+            "history": self.history,
+            "kernels": self.kernels,
+            "weights_version": self.weights_version,
+            "elapsed": elapsed,
+            "error": self.error,
+        }
+
+
+class TrainingWorker:
+    """
+    Runs training jobs one at a time on a background thread.
+
+    `step` performs one optimizer step and returns (loss, correct, batch size),
+    where loss and correct may stay on-device: they are only summed, and
+    synchronized once every `publish_every` steps. At those points (and when
+    a job ends) `publish` is called to hand the new weights to inference; it
+    returns the new weights version and, optionally, a kernel summary.
+    """
+
+    def __init__(
+        self,
+        step: Callable[[Dict[str, Any]], Tuple[torch.Tensor, torch.Tensor, int]],
+        publish: Callable[[], Tuple[int, Optional[Dict[str, Any]]]],
+        publish_every: int = 10,
+        max_queued: int = 8,
+        keep_jobs: int = 32,
+        name: str = "trainer",
+    ):
+        self.step = step
+        self.publish = publish
+        self.publish_every = max(1, int(publish_every))
+        self.max_queued = max_queued
+        self.keep_jobs = keep_jobs
+        self.name = name
+        self._jobs: "OrderedDict[str, TrainingJob]" = OrderedDict()
+        self._queue: "queue.Queue[Optional[TrainingJob]]" = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.closed = False
+
+    def submit(self, steps: int, options: Dict[str, Any]) -> TrainingJob:
+        """Queue a job of `steps` optimizer steps; raises RuntimeError if the queue is full."""
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Training worker is shut down")
+            if self._queue.qsize() >= self.max_queued:
+                raise RuntimeError(f"Training queue is full ({self.max_queued} jobs); try again later")
+            job = TrainingJob(f"{self.name}-{next(self._ids)}", steps, options)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep_jobs:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.state in ("queued", "running"):
+                    break
+                self._jobs.popitem(last=False)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+                self._thread.start()
+            self._queue.put(job)
+        return job
+
+    def get(self, job_id: Optional[str] = None) -> Optional[TrainingJob]:
+        """A job by id, or the most recent one."""
+        with self._lock:
+            if job_id is None:
+                return next(reversed(self._jobs.values()), None)
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job: TrainingJob) -> int:
+        """Jobs ahead of `job` (0 = running or next)."""
+        with self._lock:
+            pending = [j for j in self._jobs.values() if j.state in ("queued", "running")]
+        return pending.index(job) if job in pending else 0
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.state not in ("queued", "running"):
+            return False
+        job.cancelled = True
+        return True
+
+    def close(self, wait: bool = True):
+        """Stop after the current step; queued jobs are cancelled."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            for job in self._jobs.values():
+                if job.state in ("queued", "running"):
+                    job.cancelled = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            if wait:
+                thread.join()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if job.cancelled:
+                job.state = "cancelled"
+                continue
+            self._run(job)
+
+    def _flush(self, job: TrainingJob, loss_sum, correct_sum, seen: int, steps: int):
+        job.loss = float(loss_sum) / steps
+        job.accuracy = float(correct_sum) / seen
+        job.history.append({"step": job.steps_done, "loss": job.loss, "accuracy": job.accuracy})
+        job.weights_version, job.kernels = self.publish()
+
+    def _run(self, job: TrainingJob):
+        job.state = "running"
+        job.started = time.time()
+        loss_sum, correct_sum, seen, pending = 0.0, 0, 0, 0
+        try:
+            while job.steps_done < job.steps and not job.cancelled:
+                loss, correct, batch_size = self.step(job.options)
+                loss_sum = loss_sum + loss
+                correct_sum = correct_sum + correct
+                seen += batch_size
+                pending += 1
+                job.steps_done += 1
+                if pending == self.publish_every:
+                    self._flush(job, loss_sum, correct_sum, seen, pending)
+                    loss_sum, correct_sum, seen, pending = 0.0, 0, 0, 0
+            if pending:
+                self._flush(job, loss_sum, correct_sum, seen, pending)
+            job.state = "cancelled" if job.cancelled else "done"
+        except Exception as e:
+            logger.exception("Error in training job %s", job.id)
+            job.error = str(e)
+            job.state = "failed"
+        finally:
+            job.finished = time.time()
@@ -1,6 +1,11 @@
 from django.urls import path
-from .views import UnifiedModelView
+from .views import UnifiedModelView, ReadinessView, CacheStatsView, SchedulerStatsView, async_model_view, metrics_view
 
 urlpatterns = [
+    path('ready/', ReadinessView.as_view(), name='readiness'),
+    path('cache/', CacheStatsView.as_view(), name='cache_stats'),
+    path('scheduler/', SchedulerStatsView.as_view(), name='scheduler_stats'),
+    path('metrics/', metrics_view, name='metrics'),
     path('models/<str:model_name>/<str:action>/', UnifiedModelView.as_view(), name='unified_model_view'),
+    path('async/models/<str:model_name>/<str:action>/', async_model_view, name='async_model_view'),
 ]
@@ -1,44 +1,256 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.renderers import BrowsableAPIRenderer
 from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from .model_registry import ModelRegistry
+from .cache import get_result_cache
+from .executor import DeadlineExceeded, ExecutorFull, get_executor
+from .encoding import TensorFrameRenderer, TimedJSONRenderer, TRANSPORT_FORMAT
+from .metrics import CONTENT_TYPE, render_metrics
+from .profiling import get_profiler, profiled
+from .streaming import STREAM_FORMATS, result_events, streaming_response
+
+def _load_handler(model_name):
+    """
+    Fetch (and lazily load) a handler, turning load failures into a 503.
+
+    Also tells the inference scheduler how many calls the handler can serve
+    at once, so its replicas or batch slots are not queued behind one worker.
+    """
+    try:
+        handler = ModelRegistry.get_handler(model_name)
+        if handler is not None:
+            get_executor().set_concurrency(model_name, handler.concurrency())
+        return handler, None
+    except Exception as e:
+        print(f"Error loading model {model_name}: {str(e)}")
+        return None, Response({"error": f"Model '{model_name}' failed to load: {str(e)}"},
+                              status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+def _request_deadline(request):
+    """Per-request deadline in seconds, from `X-Deadline-Ms` or `?deadline_ms=` (None = class default)."""
+    value = request.headers.get('X-Deadline-Ms') or request.GET.get('deadline_ms')
+    try:
+        return float(value) / 1000 if value else None
+    except ValueError:
+        return None
+
+
+def _overload_response(error):
+    """429 (queue full, with Retry-After) or 504 (deadline passed while queued)."""
+    if isinstance(error, ExecutorFull):
+        response = JsonResponse({"error": str(error), "retry_after": error.retry_after},
+                                status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = str(error.retry_after)
+        return response
+    return JsonResponse({"error": str(error)}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+class ReadinessView(APIView):
+    """
+    Readiness probe for load balancers.
+    Route: /api/ready/
+
+    Returns 200 once every model in VISXAI_PRELOAD_MODELS is loaded, 503 before
+    that, along with the lifecycle state of every registered model.
+    """
+
+    def get(self, request):
+        required = settings.VISXAI_PRELOAD_MODELS
+        ready = ModelRegistry.is_ready(required)
+        return Response({
+            "ready": ready,
+            "required": required,
+            "loaded_mb": round(ModelRegistry.loaded_bytes() / (1024 * 1024), 1),
+            "models": ModelRegistry.status(),
+            "executor": {"workers": get_executor().capacity()},
+        }, status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class CacheStatsView(APIView):
+    """
+    Result cache counters for monitoring.
+    Route: /api/cache/
+    """
+
+    def get(self, request):
+        cache = get_result_cache()
+        if cache is None:
+            return Response({"enabled": False}, status=status.HTTP_200_OK)
+        return Response({"enabled": True, **cache.stats()}, status=status.HTTP_200_OK)
+
+
+class SchedulerStatsView(APIView):
+    """
+    Inference scheduler queues for monitoring: depth, wait-time percentiles
+    and outcomes per action, load per cost class and model.
+    Route: /api/scheduler/
+    """
+
+    def get(self, request):
+        return Response(get_executor().stats(), status=status.HTTP_200_OK)
+
+
+def metrics_view(request):
+    """
+    Prometheus metrics: request and per-stage latency histograms by model and
+    action, plus cache, scheduler and model lifecycle gauges (see metrics.py).
+    Route: /api/metrics/
+    """
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
 
 class UnifiedModelView(APIView):
     """
     Unified endpoint for all model interactions.
     Route: /api/models/<model_name>/<action>/
+
+    Responses are JSON with PNG data URLs by default; clients that send
+    `Accept: application/x-visxai-tensors` (or `?format=vxt`) get feature maps
+    and heatmaps as packed tensors in one binary frame (see encoding.py).
+
+    `predict` with `"session": true` also returns a session id; then
+    `GET features/?session=...&layer_id=...&channels=a:b` encodes any slice of
+    that layer's channels without re-running the model.
+
+    `predict` also accepts `?stream=ndjson` or `?stream=sse`. The top-5
+    prediction is then sent first, followed by each layer's feature maps as
+    they are encoded on the scheduler (see streaming.py).
+
+    Model calls go through the inference scheduler (see executor.py): a full
+    queue answers 429, and a call still queued at its deadline (cost-class
+    default, or `X-Deadline-Ms`) answers 504.
+
+    Responses carry a `Server-Timing` header with the time spent in each
+    stage (decode, transform, forward, encode, render; see middleware.py).
+
+    `profile` (staff only) arms torch.profiler for the model's next requests:
+    POST `{"requests": N}` to arm, `{"cancel": true}` to disarm; GET lists the
+    captures and their trace files (see profiling.py).
     """
+    renderer_classes = [TimedJSONRenderer, BrowsableAPIRenderer, TensorFrameRenderer]
+
+    ACTIONS = ('predict', 'features', 'adversarial', 'gradcam', 'train', 'progress', 'kernels', 'profile')
+
+    @staticmethod
+    def _transport(request):
+        """Tensor transport from content negotiation; overrides whatever the client sent."""
+        return 'binary' if getattr(request.accepted_renderer, 'format', None) == TRANSPORT_FORMAT else 'json'
+
+    def _request_data(self, request):
+        """Request payload plus the negotiated tensor transport."""
+        return {**request.data, 'transport': self._transport(request)}
+
+    def _schedule(self, request, model_name, action, fn):
+        """Run `fn` on the inference scheduler under the action's cost class."""
+        return get_executor().call(profiled(fn), model_name, action, _request_deadline(request))
+
+    def _profile(self, request, model_name):
+        """Arm, cancel or list profiler captures for a model (staff only)."""
+        if not request.user.is_staff:
+            return Response({"error": "Profiling requires a staff account."}, status=status.HTTP_403_FORBIDDEN)
+        model = model_name.lower()
+        if model not in ModelRegistry.list_models():
+            return Response({"error": f"Model '{model_name}' not found."}, status=status.HTTP_404_NOT_FOUND)
+        profiler = get_profiler()
+        if request.method == 'GET':
+            return Response(profiler.status(model), status=status.HTTP_200_OK)
+
+        data = request.data
+        if data.get('cancel') in (True, '1', 'true'):
+            capture = profiler.cancel(model)
+            if capture is None:
+                return Response({"error": f"No capture armed for '{model}'."}, status=status.HTTP_404_NOT_FOUND)
+            return Response(capture, status=status.HTTP_200_OK)
+        try:
+            capture = profiler.arm(model, int(data.get('requests', 1)),
+                                   record_shapes=data.get('record_shapes') in (True, '1', 'true'),
+                                   with_stack=data.get('with_stack') in (True, '1', 'true'))
+        except (TypeError, ValueError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(capture, status=status.HTTP_201_CREATED)
+
+    def _run_action(self, handler, action, request, data):
+        if action == 'predict':
+            return handler.predict(data)
+        elif action == 'features':
+            layer_id = request.query_params.get('layer_id')
+            return handler.get_features(data, layer_id)
+        elif action == 'adversarial':
+            epsilon = float(data.get('epsilon', 0.01))
+            return handler.generate_adversarial(data, epsilon)
+        elif action == 'gradcam':
+            return handler.get_gradcam(data)
+        elif action == 'train':
+            return handler.train_step(data)
+        elif action == 'progress':
+            return handler.train_progress(data)
+        elif action == 'kernels':
+            return handler.get_kernels(data)
 
     def post(self, request, model_name, action):
-        handler = ModelRegistry.get_handler(model_name)
+        if action == 'profile':
+            return self._profile(request, model_name)
+        handler, error = _load_handler(model_name)
+        if error:
+            return error
         if not handler:
             return Response({"error": f"Model '{model_name}' not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        data = request.data
+        data = self._request_data(request)
         # In a real app, we would handle image uploads here (request.FILES)
 
+        if action not in self.ACTIONS:
+            return Response({"error": f"Action '{action}' not supported."}, status=status.HTTP_400_BAD_REQUEST)
+        if action in ('train', 'progress', 'kernels') and not hasattr(handler, 'train_step'):
+            return Response({"error": "Training not supported for this model."}, status=status.HTTP_400_BAD_REQUEST)
+
+        stream = request.query_params.get('stream')
+        if stream and (stream not in STREAM_FORMATS or action != 'predict'):
+            return Response({"error": "Streaming ('ndjson' or 'sse') is only supported for predict."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if stream:
+            # Stream events are JSON whatever renderer was negotiated
+            data = {**data, 'transport': 'json'}
+
         try:
-            if action == 'predict':
-                result = handler.predict(data)
-            elif action == 'features':
-                layer_id = request.query_params.get('layer_id')
-                result = handler.get_features(data, layer_id)
-            elif action == 'adversarial':
-                epsilon = float(request.data.get('epsilon', 0.01))
-                result = handler.generate_adversarial(data, epsilon)
-            elif action == 'gradcam':
-                result = handler.get_gradcam(data)
-            elif action == 'train':
-                if hasattr(handler, 'train_step'):
-                    result = handler.train_step(data)
-                else:
-                    return Response({"error": "Training not supported for this model."}, status=status.HTTP_400_BAD_REQUEST)
-            else:
-                return Response({"error": f"Action '{action}' not supported."}, status=status.HTTP_400_BAD_REQUEST)
+            # Identical requests (same model, action, input bytes and result
+            # params) are served from the result cache and coalesced while in flight.
+            cache = get_result_cache()
+            params = dict(request.query_params.items())
+            if handler.precision != 'fp32':
+                params['precision'] = handler.precision
+            # Weights without a content identity are keyed by the in-process
+            # version, which restarts at 0, so their results never go to disk.
+            # Nor does a result computed while training republished the weights.
+            weights = handler.weights_id if handler.weights_id is not None else handler.weights_version
+            persist = (lambda: handler.weights_id == weights) if handler.weights_id is not None else False
+            key = cache.make_key(model_name, action, data, weights, params=params) if cache else None
+            if stream:
+                # A cached result is replayed as events; streamed results are not cached.
+                cached = cache.peek(key) if key else None
+                events = result_events(cached) if cached is not None else handler.predict_stream(data)
+                return streaming_response(request._request, events, stream, model_name, action,
+                                          _request_deadline(request))
+            compute = lambda: self._schedule(request, model_name, action,
+                                             lambda: self._run_action(handler, action, request, data))
+            result = cache.get_or_compute(key, compute, persist) if key else compute()
+            if action == 'train' and 'error' in result:
+                # Not queued: no training data on disk, or the training queue is full
+                return Response(result, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
             return Response(result, status=status.HTTP_200_OK)
 
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        except (ExecutorFull, DeadlineExceeded) as e:
+            return _overload_response(e)
+
         except Exception as e:
             import traceback
             error_trace = traceback.format_exc()
@@ -51,13 +263,75 @@ class UnifiedModelView(APIView):
 
     def get(self, request, model_name, action):
         """Handle GET requests for features/metadata."""
-        handler = ModelRegistry.get_handler(model_name)
+        if action == 'profile':
+            return self._profile(request, model_name)
+        handler, error = _load_handler(model_name)
+        if error:
+            return error
         if not handler:
             return Response({"error": f"Model '{model_name}' not found."}, status=status.HTTP_404_NOT_FOUND)
         
         if action == 'features':
-            layer_id = request.query_params.get('layer_id')
-            result = handler.get_features({}, layer_id) # Empty data for mock
+            # Query parameters (e.g. session, channels, feature_layout) act as the payload
+            params = request.query_params.dict()
+            layer_id = params.pop('layer_id', None)
+            params['transport'] = self._transport(request)
+            try:
+                result = self._schedule(request, model_name, action, lambda: handler.get_features(params, layer_id))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except (ExecutorFull, DeadlineExceeded) as e:
+                return _overload_response(e)
+            if 'error' in result:
+                return Response(result, status=status.HTTP_404_NOT_FOUND)
             return Response(result, status=status.HTTP_200_OK)
+        
+        if action == 'progress' and hasattr(handler, 'train_progress'):
+            # Training jobs run in the background; poll with ?job_id=...
+            result = handler.train_progress(request.query_params.dict())
+            return Response(result, status=status.HTTP_404_NOT_FOUND if 'error' in result else status.HTTP_200_OK)
+        
+        if action == 'kernels' and hasattr(handler, 'get_kernels'):
+            # Whole kernel evolution in one request: ?epochs=1:5&layer=conv1
+            params = request.query_params.dict()
+            params['transport'] = self._transport(request)
+            try:
+                result = self._schedule(request, model_name, action, lambda: handler.get_kernels(params))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except (ExecutorFull, DeadlineExceeded) as e:
+                return _overload_response(e)
+            return Response(result, status=status.HTTP_404_NOT_FOUND if 'error' in result else status.HTTP_200_OK)
             
         return Response({"error": "GET not supported for this action."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+_model_view = UnifiedModelView.as_view()
+
+
+def _serve_model_view(request, model_name, action):
+    """Run UnifiedModelView and serialize its response, all on an executor thread."""
+    response = _model_view(request, model_name=model_name, action=action)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+@csrf_exempt
+async def async_model_view(request, model_name, action):
+    """
+    Async variant of UnifiedModelView for ASGI deployments.
+    Route: /api/async/models/<model_name>/<action>/
+
+    The request is served by the same view, but entirely on an inference
+    scheduler worker (see executor.py) rather than on an unbounded worker
+    thread. When the action's queue is full the request fails fast with 429
+    and a Retry-After estimate; if the client disconnects while the request is
+    still queued, it is dropped. Streamed predicts only hold a worker while
+    the response is set up; each later event is scheduled as the client reads it.
+    """
+    try:
+        return await get_executor().run(profiled(lambda: _serve_model_view(request, model_name, action)),
+                                        model_name, action, _request_deadline(request))
+    except (ExecutorFull, DeadlineExceeded) as e:
+        return _overload_response(e)
@@ -0,0 +1,132 @@
+"""
+Memory-mapped weight files (safetensors layout, no extra dependency).
+
+A file is an 8-byte little-endian header length, a JSON header mapping each
+tensor name to {"dtype", "shape", "data_offsets": [begin, end]} (plus an
+optional "__metadata__" dict of strings), then the raw little-endian tensor
+bytes back to back. Files written here can be read by the safetensors
+library and vice versa.
+
+`load_weights` maps the file copy-on-write and returns tensors that view the
+mapping. Nothing is read until a page is touched, and untouched pages live
+in the OS page cache, shared by every process that maps the same file.
+`load_state_dict(..., assign=True)` into a model built on the meta device
+therefore starts in milliseconds, with no initialization and no unpickling.
+"""
+import hashlib
+import json
+import os
+import struct
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+_DTYPES = {
+    torch.float32: ('F32', np.float32),
+    torch.float16: ('F16', np.float16),
+    torch.float64: ('F64', np.float64),
+    torch.bfloat16: ('BF16', np.uint16),  # numpy has no bfloat16; stored as raw 16-bit words
+    torch.int64: ('I64', np.int64),
+    torch.int32: ('I32', np.int32),
+    torch.int8: ('I8', np.int8),
+    torch.uint8: ('U8', np.uint8),
+    torch.bool: ('BOOL', np.bool_),
+}
+_BY_NAME = {name: (dtype, np_dtype) for dtype, (name, np_dtype) in _DTYPES.items()}
+
+WEIGHTS_SUFFIX = '.safetensors'
+# Metadata key holding the SHA-256 of a file's tensors (see weights_digest)
+DIGEST_KEY = 'sha256'
+
+
+def weights_path(name: str) -> str:
+    """Where `export_weights` writes (and handlers look for) a model's weight file."""
+    from django.conf import settings
+    return os.path.join(settings.BASE_DIR, 'saved_models', f"{name}{WEIGHTS_SUFFIX}")
+
+
+def _tensor_bytes(tensor: torch.Tensor) -> Tuple[str, bytes]:
+    """(dtype name, little-endian bytes) of a tensor as stored in a weight file."""
+    tensor = tensor.detach().cpu().contiguous()
+    if tensor.dtype not in _DTYPES:
+        raise ValueError(f"Unsupported dtype {tensor.dtype}")
+    dtype_name, np_dtype = _DTYPES[tensor.dtype]
+    raw = tensor.view(torch.int16) if tensor.dtype == torch.bfloat16 else tensor
+    return dtype_name, raw.numpy().astype(np.dtype(np_dtype).newbyteorder('<'), copy=False).tobytes()
+
+
+def state_digest(state_dict: Dict[str, torch.Tensor]) -> str:
+    """SHA-256 over the names, dtypes, shapes and bytes of a state dict's tensors."""
+    digest = hashlib.sha256()
+    for name, tensor in state_dict.items():
+        dtype_name, data = _tensor_bytes(tensor)
+        digest.update(json.dumps([name, dtype_name, list(tensor.shape)]).encode())
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def save_weights(path: str, state_dict: Dict[str, torch.Tensor], metadata: Optional[Dict[str, str]] = None):
+    """Write a state dict as one flat, mappable file (atomically), recording its digest in the metadata."""
+    header, offset = {}, 0
+    tensors = []
+    digest = hashlib.sha256()
+    for name, tensor in state_dict.items():
+        if tensor.dtype not in _DTYPES:
+            raise ValueError(f"Unsupported dtype {tensor.dtype} for '{name}'")
+        dtype_name, data = _tensor_bytes(tensor)
+        digest.update(json.dumps([name, dtype_name, list(tensor.shape)]).encode())
+        digest.update(data)
+        header[name] = {'dtype': dtype_name, 'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset + len(data)]}
+        tensors.append(data)
+        offset += len(data)
+    header['__metadata__'] = {**{key: str(value) for key, value in (metadata or {}).items()},
+                              DIGEST_KEY: digest.hexdigest()}
+
+    encoded = json.dumps(header, separators=(',', ':')).encode()
+    # Pad so the data section (and with it every tensor of <= 8-byte dtype) is 8-byte aligned
+    encoded += b' ' * (-(8 + len(encoded)) % 8)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for data in tensors:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_header(path: str) -> Tuple[Dict, int]:
+    """The JSON header and the file offset where tensor data starts."""
+    with open(path, 'rb') as f:
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+    return header, 8 + length
+
+
+def load_weights(path: str) -> Dict[str, torch.Tensor]:
+    """Tensors viewing a copy-on-write mapping of `path` (writes stay private to the process)."""
+    header, start = read_header(path)
+    header.pop('__metadata__', None)
+    if not header:
+        return {}
+    mapping = np.memmap(path, dtype=np.uint8, mode='c')
+    state_dict = {}
+    for name, info in header.items():
+        dtype, np_dtype = _BY_NAME[info['dtype']]
+        begin, end = info['data_offsets']
+        array = mapping[start + begin:start + end].view(np_dtype).reshape(info['shape'])
+        tensor = torch.from_numpy(array)
+        state_dict[name] = tensor.view(torch.bfloat16) if dtype == torch.bfloat16 else tensor
+    return state_dict
+
+
+def weights_digest(path: str) -> Optional[str]:
+    """The tensor digest recorded by save_weights, without reading any tensor data (None for older files)."""
+    header, _ = read_header(path)
+    return header.get('__metadata__', {}).get(DIGEST_KEY)
+
+
+def is_current(path: str, source: str) -> bool:
+    """True if the weight file exists and is not older than the checkpoint it was made from."""
+    return os.path.exists(path) and (not os.path.exists(source) or os.path.getmtime(path) >= os.path.getmtime(source))
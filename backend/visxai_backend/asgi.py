@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'visxai_backend.settings')
 
 application = get_asgi_application()
+
+# Start loading VISXAI_PRELOAD_MODELS in the background; /api/ready/ turns
+# green once they are in memory.
+from django.conf import settings
+from visxai_api.model_registry import ModelRegistry
+
+ModelRegistry.preload(settings.VISXAI_PRELOAD_MODELS)
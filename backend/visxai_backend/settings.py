@@ -47,6 +47,8 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'visxai_api.middleware.ServerTimingMiddleware',
+    'visxai_api.middleware.ProfilerMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -129,6 +131,95 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
 
+import json
 import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Model lifecycle (see visxai_api.model_registry)
+# Models loaded in the background when a server process starts; /api/ready/
+# reports 503 until all of them are loaded.
+VISXAI_PRELOAD_MODELS = [m for m in os.environ.get('VISXAI_PRELOAD_MODELS', '').split(',') if m]
+# Evict least recently used models once loaded weights exceed this (None = unlimited).
+VISXAI_MODEL_MEMORY_BUDGET_MB = float(os.environ.get('VISXAI_MODEL_MEMORY_BUDGET_MB', 0)) or None
+# Run a dummy forward pass right after loading a model.
+VISXAI_WARMUP_MODELS = os.environ.get('VISXAI_WARMUP_MODELS', '1') == '1'
+# Replicas per model ("vgg16=2,mnist=4"): each one serves one request at a
+# time and shares weight memory with the others.
+VISXAI_MODEL_REPLICAS = {
+    name: int(count)
+    for name, count in (item.split('=') for item in os.environ.get('VISXAI_MODEL_REPLICAS', '').split(',') if item)
+}
+# Opt-in micro-batching per model, as JSON, e.g.
+# '{"vgg16": {"max_batch_size": 8, "max_wait_ms": 5}}'. Concurrent predicts
+# arriving within max_wait_ms share one forward pass.
+VISXAI_BATCHING = json.loads(os.environ.get('VISXAI_BATCHING', '{}'))
+# Forward-pass precision per model ("vgg16=int8-dynamic,resnet50=bf16"): fp32
+# (default), int8-dynamic, int8-static or bf16; see visxai_api.precision and
+# `python manage.py precision_report`. int8-static calibrates on the images in
+# VISXAI_CALIBRATION_DIR.
+VISXAI_MODEL_PRECISION = dict(
+    item.split('=') for item in os.environ.get('VISXAI_MODEL_PRECISION', '').split(',') if item
+)
+VISXAI_CALIBRATION_DIR = os.environ.get('VISXAI_CALIBRATION_DIR', os.path.join(BASE_DIR, 'calibration'))
+# Execution backend per model ("vgg16=torchscript,resnet50=compile"): eager
+# (default), torchscript, onnx (needs onnx + onnxruntime) or compile; see
+# visxai_api.backends. Falls back to eager if the backend cannot be built.
+VISXAI_MODEL_BACKEND = dict(
+    item.split('=') for item in os.environ.get('VISXAI_MODEL_BACKEND', '').split(',') if item
+)
+
+# Result cache (see visxai_api.cache): in-memory LRU budget (0 disables the
+# cache) and an optional on-disk tier that survives restarts.
+VISXAI_CACHE_MAX_MB = float(os.environ.get('VISXAI_CACHE_MAX_MB', 128))
+VISXAI_CACHE_DIR = os.environ.get('VISXAI_CACHE_DIR') or None
+VISXAI_CACHE_DISK_MAX_MB = float(os.environ.get('VISXAI_CACHE_DISK_MAX_MB', 1024))
+
+# Per-model budget for activations kept from recent predicts, so Grad-CAM on
+# the same image can resume from them (a VGG16 image is ~60 MB; 0 disables).
+VISXAI_ACTIVATION_STORE_MB = float(os.environ.get('VISXAI_ACTIVATION_STORE_MB', 128))
+
+# Activation sessions (predict with "session": true): per-model budget for
+# full-resolution activations that GET .../features/?session=... pages
+# through, and seconds of inactivity before a session expires.
+VISXAI_SESSION_STORE_MB = float(os.environ.get('VISXAI_SESSION_STORE_MB', 256))
+VISXAI_SESSION_TTL_S = float(os.environ.get('VISXAI_SESSION_TTL_S', 600))
+
+# Inference scheduler for model calls (see visxai_api.executor): concurrent
+# calls (default: CPU cores / torch intra-op threads; raised to what loaded
+# handlers' replicas and batch slots can serve), cost classes and the
+# class of each action (others are "interactive"), and seconds after which a
+# waiting call is promoted to the top priority. Per class: priority (lower
+# runs first), max_queued (then 429), deadline_ms (queued longer: 504) and
+# optionally max_running.
+VISXAI_EXECUTOR_WORKERS = int(os.environ.get('VISXAI_EXECUTOR_WORKERS', 0)) or None
+VISXAI_COST_CLASSES = json.loads(os.environ.get('VISXAI_COST_CLASSES') or json.dumps({
+    "interactive": {"priority": 0, "max_queued": 32, "deadline_ms": 10000},
+    "heavy": {"priority": 1, "max_queued": 8, "deadline_ms": 60000},
+}))
+VISXAI_ACTION_COSTS = json.loads(os.environ.get('VISXAI_ACTION_COSTS') or json.dumps({
+    "gradcam": "heavy",
+    "adversarial": "heavy",
+}))
+VISXAI_SCHEDULER_AGING_S = float(os.environ.get('VISXAI_SCHEDULER_AGING_S', 2))
+
+# Multi-process inference (see visxai_api.process_pool): models listed here
+# are served by `python manage.py serve_inference` worker processes that share
+# one copy of the weights, reached through the manifest/socket prefix below.
+VISXAI_REMOTE_MODELS = [m for m in os.environ.get('VISXAI_REMOTE_MODELS', '').split(',') if m]
+VISXAI_INFERENCE_SOCKET = os.environ.get('VISXAI_INFERENCE_SOCKET', os.path.join(BASE_DIR, 'inference.sock'))
+
+# Observability (see visxai_api.middleware and visxai_api.metrics): model
+# responses carry a Server-Timing header with per-stage durations (set to 0
+# to hide it from clients); /api/metrics/ serves the same stages as
+# Prometheus histograms either way.
+VISXAI_SERVER_TIMING = os.environ.get('VISXAI_SERVER_TIMING', '1') == '1'
+# Lets the frontend (another origin) read the header
+CORS_EXPOSE_HEADERS = ['Server-Timing']
+
+# On-demand profiling (see visxai_api.profiling): staff users arm a capture
+# with POST /api/models/<model>/profile/ {"requests": N}; traces and memory
+# summaries go to MEDIA_ROOT/profiles/. A capture covers at most this many
+# requests and disarms itself after this many seconds if they never come.
+VISXAI_PROFILER_MAX_REQUESTS = int(os.environ.get('VISXAI_PROFILER_MAX_REQUESTS', 20))
+VISXAI_PROFILER_TTL_S = float(os.environ.get('VISXAI_PROFILER_TTL_S', 600))
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'visxai_backend.settings')
 
 application = get_wsgi_application()
+
+# Start loading VISXAI_PRELOAD_MODELS in the background; /api/ready/ turns
+# green once they are in memory.
+from django.conf import settings
+from visxai_api.model_registry import ModelRegistry
+
+ModelRegistry.preload(settings.VISXAI_PRELOAD_MODELS)
@@ -83,13 +83,21 @@ export default function VoxelStackPage() {
     const handleTrain = async () => {
         setIsTraining(true);
         try {
+            // Training runs in a background job on the server; poll its progress
             const response = await fetch('http://localhost:8000/api/models/mnist/train/', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({})
             });
-            const data = await response.json();
-            setTrainLoss(data.loss);
+            const job = await response.json();
+            if (!job.job_id) throw new Error(job.error || 'Training could not be queued');
+            while (true) {
+                await new Promise(resolve => setTimeout(resolve, 500));
+                const progress = await fetch(`http://localhost:8000/api/models/mnist/progress/?job_id=${job.job_id}`);
+                const data = await progress.json();
+                if (data.loss !== null && data.loss !== undefined) setTrainLoss(data.loss);
+                if (!progress.ok || !['queued', 'running'].includes(data.status)) break;
+            }
         } catch (error) {
             console.error("Training failed:", error);
         } finally {